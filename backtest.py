@@ -0,0 +1,221 @@
+#!/usr/bin/python3
+"""
+Evaluates the moving average strategy of a MAverage configuration on the rates stored in mamaster.db.
+The rates are loaded once, the moving averages are calculated from cumulative sums (with NumPy if available)
+and the orders, trailing stop losses and fees are simulated rate by rate.
+
+Usage: ./backtest.py <instance> [weeks]
+"""
+import os
+import sys
+import time
+from itertools import accumulate
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import database
+from ratebuffer import to_epoch
+
+FEE_IN_PERCENT = 0.075
+# settings of the bot configuration used by the simulation
+SETTINGS = ('ma_minutes_short', 'ma_minutes_long', 'interval', 'stop_loss', 'stop_loss_in_percent', 'no_action_at_loss',
+            'trade_advantage_in_percent', 'short_in_percent', 'apply_leverage', 'leverage_default', 'trade_trials',
+            'order_adjust_seconds')
+
+
+def load_settings(conf):
+    """
+    Extracts the settings relevant for the simulation from a bot configuration
+    :param conf: maverage.ExchangeConfig
+    :return dict: settings
+    """
+    settings = {name: getattr(conf, name) for name in SETTINGS}
+    settings['fee_in_percent'] = FEE_IN_PERCENT
+    return settings
+
+
+def load_rates(database_name: str, symbol: str = None, weeks: int = None):
+    """
+    Loads the rates into contiguous arrays
+    :param database_name: filename of the database
+    :param symbol: symbol of the rates, the default one if None
+    :param weeks: number of weeks to be loaded, all if None
+    :return tuple: epochs, prices ordered oldest first
+    """
+    conn = database.connect(database_name, True)
+    since = int(time.time()) - weeks * 7 * 24 * 60 * 60 if weeks else 0
+    rows = database.rates_from(conn, since, -1, symbol)
+    epochs = [to_epoch(row[1]) for row in rows]
+    prices = [row[0] for row in rows]
+    if numpy is not None:
+        return numpy.asarray(epochs, dtype=numpy.int64), numpy.asarray(prices, dtype=numpy.float64)
+    return epochs, [float(price) for price in prices]
+
+
+def resolve_symbol(conf):
+    """
+    :param conf: maverage.ExchangeConfig
+    :return str: the symbol the bot calculates its moving averages from, None for the default one
+    """
+    symbols = database.symbols(database.connect(conf.database, True))
+    wanted = conf.rate_symbol or '{}:{}'.format(conf.exchange, conf.pair)
+    return wanted if wanted in symbols else None
+
+
+def to_window(minutes: int, interval: int):
+    """
+    Converts the minutes of a moving average into a number of rates, like maverage.calculate_fetch_size
+    """
+    return round(minutes / interval) if minutes >= interval else 1
+
+
+def moving_average(prices, size: int):
+    """
+    Calculates the moving average over the last x rates for every rate using a cumulative sum
+    :param prices: the rates ordered oldest first
+    :param size: number of rates
+    :return array or list of the moving averages, NaN until the window is filled
+    """
+    if numpy is not None:
+        sums = numpy.cumsum(numpy.concatenate(([0.0], prices)))
+        averages = numpy.full(len(prices), numpy.nan)
+        if len(prices) >= size:
+            averages[size - 1:] = (sums[size:] - sums[:-size]) / size
+        return averages
+    sums = list(accumulate(prices, initial=0.0))
+    return [(sums[i + 1] - sums[i + 1 - size]) / size if i + 1 >= size else float('nan') for i in range(len(prices))]
+
+
+def crossover_signals(short, long):
+    """
+    :return list of True (BUY) or False (SELL) for every rate, like maverage.buy_or_sell
+    """
+    if numpy is not None:
+        return (short > long).tolist()
+    return [s > l for s, l in zip(short, long)]
+
+
+def calculate_stop_loss_price(market_price: float, order_price: float, stop_loss_price: float, side: str,
+                              settings: dict):
+    """
+    Mirrors maverage.calculate_stop_loss_price with the settings passed in
+    :return float: new calculated stop loss price or None
+    """
+    percent = settings['stop_loss_in_percent']
+    if side == 'LONG':
+        if not stop_loss_price:
+            stop_loss_price = order_price - (order_price / 100) * percent
+        if market_price - (market_price / 100) * percent > stop_loss_price:
+            stop_loss_price = market_price - (market_price / 100) * percent
+        if not settings['no_action_at_loss'] or stop_loss_price > order_price:
+            return stop_loss_price
+        return None
+    if not stop_loss_price:
+        stop_loss_price = order_price + (order_price / 100) * percent
+    if market_price + (market_price / 100) * percent < stop_loss_price:
+        stop_loss_price = market_price + (market_price / 100) * percent
+    if not settings['no_action_at_loss'] or stop_loss_price < order_price:
+        return stop_loss_price
+    return None
+
+
+def backtest(prices, settings: dict, averages: dict = None, start: int = 0, stop: int = None):
+    """
+    Simulates the bot on the rates. Limit orders are priced with trade_advantage_in_percent and fall back to a
+    market order once trade_trials * order_adjust_seconds have passed, stop losses trail the price.
+    :param prices: the rates ordered oldest first
+    :param settings: the settings (see load_settings)
+    :param averages: dict window: moving averages, calculated if missing
+    :param start: index of the first rate to be traded
+    :param stop: index after the last rate to be traded
+    :return dict: pnl_percent, trades, stop_losses, max_drawdown_percent
+    """
+    interval = settings['interval']
+    size_short = to_window(settings['ma_minutes_short'], interval)
+    size_long = to_window(settings['ma_minutes_long'], interval)
+    averages = averages if averages is not None else {}
+    for size in (size_short, size_long):
+        if size not in averages:
+            averages[size] = moving_average(prices, size)
+    signals = crossover_signals(averages[size_short], averages[size_long])
+    stop = len(prices) if stop is None else stop
+    start = max(start, size_short - 1, size_long - 1)
+    leverage = settings['leverage_default'] if settings['apply_leverage'] else 1
+    exposures = {'BUY': leverage, 'SELL': -settings['short_in_percent'] / 100 * leverage}
+    advantage = 1 + settings['trade_advantage_in_percent'] / 100
+    fee = settings['fee_in_percent'] / 100
+    patience = max(1, round(settings['trade_trials'] * settings['order_adjust_seconds'] / (interval * 60)))
+
+    equity = peak = 1.0
+    drawdown = 0.0
+    exposure = 0.0
+    order_price = stop_loss_price = None
+    action = order = None
+    trades = stop_losses = 0
+    for i in range(start, stop):
+        price = float(prices[i])
+        if exposure:
+            value = equity * (1 + exposure * (price / order_price - 1))
+            side = 'LONG' if exposure > 0 else 'SHORT'
+            if stop_loss_price and (price <= stop_loss_price if side == 'LONG' else price >= stop_loss_price):
+                equity *= 1 + exposure * (stop_loss_price / order_price - 1)
+                equity -= equity * abs(exposure) * fee
+                exposure = 0.0
+                stop_loss_price = None
+                stop_losses += 1
+                value = equity
+        else:
+            value = equity
+        peak = max(peak, value)
+        drawdown = max(drawdown, 1 - value / peak)
+
+        signal = 'BUY' if signals[i] else 'SELL'
+        if signal != action:
+            action = signal
+            limit = price / advantage if signal == 'BUY' else price * advantage
+            order = (signal, limit, i + patience)
+        if order:
+            signal, limit, deadline = order
+            if signal == 'BUY' and price <= limit or signal == 'SELL' and price >= limit or i >= deadline:
+                fill = limit if i < deadline else price
+                if exposure:
+                    equity *= 1 + exposure * (fill / order_price - 1)
+                equity -= equity * abs(exposures[signal] - exposure) * fee
+                exposure = exposures[signal]
+                order_price = fill
+                stop_loss_price = None
+                order = None
+                trades += 1
+        if exposure and settings['stop_loss']:
+            side = 'LONG' if exposure > 0 else 'SHORT'
+            candidate = calculate_stop_loss_price(price, order_price, stop_loss_price, side, settings)
+            if candidate and (not stop_loss_price or (candidate > stop_loss_price if side == 'LONG'
+                                                      else candidate < stop_loss_price)):
+                stop_loss_price = candidate
+    if exposure:
+        equity *= 1 + exposure * (float(prices[stop - 1]) / order_price - 1)
+    return {'pnl_percent': round((equity - 1) * 100, 2), 'trades': trades, 'stop_losses': stop_losses,
+            'max_drawdown_percent': round(drawdown * 100, 2)}
+
+
+def print_result(result: dict):
+    print('PnL: {pnl_percent} %, trades: {trades}, stop losses: {stop_losses}, '
+          'max drawdown: {max_drawdown_percent} %'.format(**result))
+
+
+if __name__ == '__main__':
+    import maverage
+
+    if len(sys.argv) < 2:
+        raise SystemExit('Usage: backtest.py <instance> [weeks]')
+    maverage.INSTANCE = os.path.basename(sys.argv[1])
+    CONF = maverage.ExchangeConfig()
+    WEEKS = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    EPOCHS, PRICES = load_rates(CONF.database, resolve_symbol(CONF), WEEKS)
+    START = time.perf_counter()
+    RESULT = backtest(PRICES, load_settings(CONF))
+    print('Evaluated {} rates in {:.3f} s'.format(len(PRICES), time.perf_counter() - START))
+    print_result(RESULT)
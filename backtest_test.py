@@ -0,0 +1,72 @@
+import math
+import unittest
+from unittest.mock import MagicMock, patch
+
+import backtest
+import maverage
+
+
+class BacktestTest(unittest.TestCase):
+
+    def test_moving_average(self):
+        prices = [float(9000 + (i * 7919) % 101) for i in range(50)]
+
+        averages = backtest.moving_average(prices, 7)
+
+        self.assertTrue(math.isnan(averages[5]))
+        for i in range(6, 50):
+            rates = [[price] for price in reversed(prices[:i + 1])]
+            self.assertAlmostEqual(maverage.calculate_ma(rates, 7), averages[i])
+
+    def test_to_window(self):
+        self.assertEqual(2880, backtest.to_window(28800, 10))
+        self.assertEqual(1, backtest.to_window(5, 10))
+
+    def test_backtest_follows_crossovers(self):
+        prices = [100.0] * 10 + [100.0 + 10 * i for i in range(1, 11)] + [200.0 - 10 * i for i in range(1, 11)]
+
+        result = backtest.backtest(prices, self.create_settings())
+
+        self.assertEqual(3, result['trades'])
+        self.assertEqual(0, result['stop_losses'])
+        self.assertGreater(result['pnl_percent'], 0)
+
+    def test_backtest_trailing_stop_loss(self):
+        prices = [100.0] * 10 + [100.0 + 10 * i for i in range(1, 11)] + [150.0] * 10
+        settings = self.create_settings()
+        settings['stop_loss'] = True
+
+        result = backtest.backtest(prices, settings)
+
+        self.assertEqual(1, result['stop_losses'])
+        # short from 100, long from 120 (the limit orders are not filled, so market orders follow after the trials),
+        # stopped out at 200 - 5 % and short again at the flat 150
+        equity = 1 - 0.5 * 0.00075
+        equity *= 1 - 0.5 * (120 / 100 - 1)
+        equity -= equity * 1.5 * 0.00075
+        equity *= 190 / 120
+        equity -= equity * 0.00075
+        equity -= equity * 0.5 * 0.00075
+        self.assertEqual(round((equity - 1) * 100, 2), result['pnl_percent'])
+
+    def test_calculate_stop_loss_price_mirrors_maverage(self):
+        settings = {'stop_loss_in_percent': 2}
+        for no_action_at_loss in (True, False):
+            settings['no_action_at_loss'] = no_action_at_loss
+            conf = MagicMock(stop_loss_in_percent=2, no_action_at_loss=no_action_at_loss)
+            with patch('maverage.CONF', conf, create=True):
+                for args in ((10000, 9000, None, 'LONG'), (9000, 10000, None, 'LONG'), (10000, 9000, 9500, 'LONG'),
+                             (9000, 10000, None, 'SHORT'), (10000, 9000, None, 'SHORT'), (8000, 10000, 9500, 'SHORT')):
+                    self.assertEqual(maverage.calculate_stop_loss_price(*args),
+                                     backtest.calculate_stop_loss_price(*args, settings))
+
+    @staticmethod
+    def create_settings():
+        return {'ma_minutes_short': 20, 'ma_minutes_long': 50, 'interval': 10, 'stop_loss': False,
+                'stop_loss_in_percent': 5, 'no_action_at_loss': True, 'trade_advantage_in_percent': 0.5,
+                'short_in_percent': 50, 'apply_leverage': False, 'leverage_default': 2, 'trade_trials': 1,
+                'order_adjust_seconds': 600, 'fee_in_percent': 0.075}
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,284 @@
+#!/usr/bin/python3
+"""
+Measures the hot paths of MAverage and MAmaster on synthetic mamaster.db files of 1, 12 and 52 weeks: reading the
+rates, calculating the moving averages, persisting and purging rates, exporting the database and creating the report
+against a mocked exchange. The results are written as JSON, optionally compared with a saved baseline.
+
+Usage: ./benchmark.py [weeks=1,12,52] [repeat=5] [output=benchmark.json] [compare=baseline.json] [threshold=20]
+The comparison fails (exit code 1) if the median of a benchmark is more than threshold percent slower than the
+baseline.
+"""
+import configparser
+import datetime
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+import timeit
+from unittest.mock import MagicMock, patch
+
+import database
+import mamaster
+import maverage
+from ratebuffer import to_datetime
+
+SYMBOL = 'bitmex:BTC/USD'
+INTERVAL = 10
+PRICE = 10000
+
+
+def parse_arguments(arguments: list):
+    """
+    Parses the key=value arguments
+    :return dict: options
+    """
+    options = {'weeks': [1, 12, 52], 'repeat': 5, 'output': 'benchmark.json', 'compare': None, 'threshold': 20.0}
+    for argument in arguments:
+        key, _, value = argument.partition('=')
+        if key == 'weeks':
+            options[key] = [int(part) for part in value.split(',')]
+        elif key == 'repeat':
+            options[key] = int(value)
+        elif key == 'threshold':
+            options[key] = float(value)
+        elif key in ('output', 'compare'):
+            options[key] = value
+        else:
+            raise SystemExit('Unknown argument ' + argument)
+    return options
+
+
+def create_database(filename: str, weeks: int, until: int = None):
+    """
+    Creates a database holding a random walk of x weeks of rates
+    :param filename: filename of the database
+    :param weeks: number of weeks
+    :param until: epoch seconds of the newest rate, the last interval boundary if None
+    :return int: epoch seconds of the newest rate
+    """
+    seconds = INTERVAL * 60
+    until = until or int(time.time()) // seconds * seconds
+    count = weeks * 7 * 24 * 60 // INTERVAL
+    price = PRICE
+    rates = []
+    for epoch in range(until - (count - 1) * seconds, until + 1, seconds):
+        price = max(1, price + random.randint(-25, 25))
+        rates.append((epoch, price))
+    conn = database.connect(filename)
+    database.init_schema(conn, [SYMBOL])
+    database.backfill_rates(conn, SYMBOL, rates)
+    database.close(filename)
+    return until
+
+
+def write_config(template: str, filename: str, values: dict):
+    """
+    Writes a copy of a configuration template with the values replaced
+    """
+    config = configparser.RawConfigParser()
+    config.read(template)
+    for key, value in values.items():
+        config['config'][key] = value
+    with open(filename, 'w') as file:
+        config.write(file)
+
+
+def create_exchange():
+    """
+    :return a mocked bitmex exchange, sufficient for the report
+    """
+    exchange = MagicMock()
+    exchange.fetch_ticker.return_value = {'bid': PRICE, 'ask': PRICE + 1}
+    exchange.fetch_balance.return_value = {'BTC': {'free': 0.5, 'used': 0.5, 'total': 1.0},
+                                           'info': [{'marginLeverage': 1.2, 'walletBalance': 100000000}]}
+    exchange.private_get_position.return_value = [{'avgEntryPrice': PRICE, 'currentQty': 5000}]
+    exchange.private_get_user_wallet.return_value = {'deposited': 100000000, 'withdrawn': 0}
+    return exchange
+
+
+def configure(directory: str, filename: str):
+    """
+    Points the modules at the database, as if the bot and mamaster had been started in the directory
+    """
+    source = os.path.dirname(os.path.abspath(__file__))
+    write_config(os.path.join(source, 'config.txt'), 'benchmark.txt', {'exchange': '"bitmex"'})
+    write_config(os.path.join(source, 'mamaster.txt'), 'benchmark_master.txt',
+                 {'exchange': '"bitmex"', 'db_name': '"{}"'.format(filename)})
+    with open('benchmark.act', 'w') as file:
+        file.write('BUY (since {} UTC)'.format(datetime.datetime.utcnow().replace(microsecond=0)))
+    log = logging.getLogger('benchmark')
+    log.disabled = True
+
+    maverage.INSTANCE = 'benchmark'
+    maverage.CONF = maverage.ExchangeConfig()
+    maverage.CONF.database = filename
+    maverage.CONF.rate_buffer = os.path.join(directory, 'missing.buf')
+    maverage.CONF.daily_report = False
+    maverage.LOG = log
+    maverage.EXCHANGE = create_exchange()
+    maverage.STATS = None
+    maverage.MAS = None
+    maverage.RATE_BUFFER = None
+    maverage.RATE_SYMBOL = None
+    maverage.ACCOUNT = None
+    maverage.TICKERS.clear()
+
+    mamaster.INSTANCE = 'benchmark_master'
+    mamaster.CONF = mamaster.ExchangeConfig()
+    mamaster.LOG = log
+
+
+def measure(function, repeat: int):
+    """
+    Times a function, calling it as often per run as needed to last at least 0.2 s
+    :return dict: calls per run, min, median and mean in milliseconds per call
+    """
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    return summarize(timer.repeat(repeat, number), number)
+
+
+def measure_with_setup(function, setup, repeat: int):
+    """
+    Times a function that changes its input, calling setup (not timed) before every call
+    :return dict: calls per run, min, median and mean in milliseconds per call
+    """
+    timings = []
+    for _ in range(repeat):
+        argument = setup()
+        start = time.perf_counter()
+        function(argument)
+        timings.append(time.perf_counter() - start)
+    return summarize(timings, 1)
+
+
+def summarize(timings: list, number: int):
+    calls = [timing / number * 1000 for timing in timings]
+    return {'number': number, 'min_ms': round(min(calls), 4), 'median_ms': round(statistics.median(calls), 4),
+            'mean_ms': round(statistics.mean(calls), 4)}
+
+
+def run_benchmarks(directory: str, weeks: int, repeat: int):
+    """
+    Runs all benchmarks on a database of x weeks
+    :return dict: benchmark name: timings
+    """
+    filename = os.path.join(directory, 'mamaster-{}w.db'.format(weeks))
+    newest = create_database(filename, weeks)
+    configure(directory, filename)
+    size = maverage.calculate_fetch_size(maverage.CONF.ma_minutes_long)
+    rates = maverage.get_last_rates(size)
+    results = {'rates': weeks * 7 * 24 * 60 // INTERVAL}
+
+    results['get_last_rates'] = measure(lambda: maverage.get_last_rates(size), repeat)
+    results['calculate_ma'] = measure(lambda: maverage.calculate_ma(rates, len(rates)), repeat)
+
+    def get_mas_cold():
+        maverage.MAS = None
+        maverage.get_mas()
+    results['get_mas_cold'] = measure(get_mas_cold, repeat)
+    maverage.get_mas()
+    results['get_mas'] = measure(maverage.get_mas, repeat)
+
+    epochs = iter(range(newest + INTERVAL * 60, newest + 10 ** 9, INTERVAL * 60))
+    results['persist_rate'] = measure(lambda: mamaster.persist_rates({SYMBOL: PRICE}, to_datetime(next(epochs))),
+                                      repeat)
+    database.close(filename)
+
+    copy = os.path.join(directory, 'purge.db')
+    oldest = newest - (results['rates'] - 1) * INTERVAL * 60
+    purge = to_datetime(oldest + (newest - oldest) // 10)
+
+    def copy_database():
+        database.close(copy)
+        shutil.copyfile(filename, copy)
+        return database.connect(copy)
+    results['delete_rates_older_than'] = measure_with_setup(
+        lambda conn: database.delete_rates_older_than(conn, purge), copy_database, repeat)
+    database.close(copy)
+
+    export = os.path.join(directory, 'export.csv')
+    results['export_rates'] = measure(lambda: maverage.export_rates(export), max(1, repeat // 2))
+    with patch.object(maverage, 'sleep_for'), patch.object(maverage.requests, 'get', side_effect=ValueError('n/a')), \
+            patch.object(maverage, 'connect_report_exchange', create_exchange):
+        maverage.TICKERS.clear()
+        results['create_mail_content'] = measure(lambda: maverage.create_mail_content(True), repeat)
+    database.close()
+    return results
+
+
+def run(weeks: list, repeat: int):
+    """
+    Runs the benchmarks in a temporary directory
+    :return dict: environment and results per number of weeks
+    """
+    report = {'created': datetime.datetime.utcnow().replace(microsecond=0).isoformat(),
+              'python': platform.python_version(), 'sqlite': sqlite3.sqlite_version, 'repeat': repeat, 'results': {}}
+    cwd = os.getcwd()
+    directory = tempfile.mkdtemp(prefix='benchmark')
+    try:
+        os.chdir(directory)
+        for week in weeks:
+            print('Benchmarking {} weeks'.format(week))
+            report['results'][str(week)] = run_benchmarks(directory, week, repeat)
+    finally:
+        os.chdir(cwd)
+        database.close()
+        shutil.rmtree(directory)
+    return report
+
+
+def compare(baseline: dict, report: dict, threshold: float):
+    """
+    Compares the medians of the benchmarks present in both reports
+    :param threshold: slowdown in percent considered a regression
+    :return list of (weeks, name, baseline ms, current ms, change in percent, regression)
+    """
+    rows = []
+    for weeks, results in report['results'].items():
+        before = baseline['results'].get(weeks, {})
+        for name, result in results.items():
+            if not isinstance(result, dict) or not isinstance(before.get(name), dict):
+                continue
+            old = before[name]['median_ms']
+            new = result['median_ms']
+            change = (new / old - 1) * 100 if old else 0.0
+            rows.append((weeks, name, old, new, round(change, 1), change > threshold))
+    return rows
+
+
+def print_report(report: dict):
+    print('{:>5} {:<24} {:>12} {:>12}'.format('weeks', 'benchmark', 'median ms', 'min ms'))
+    for weeks, results in report['results'].items():
+        for name, result in results.items():
+            if isinstance(result, dict):
+                print('{:>5} {:<24} {:>12.4f} {:>12.4f}'.format(weeks, name, result['median_ms'], result['min_ms']))
+
+
+def print_comparison(rows: list):
+    print('{:>5} {:<24} {:>12} {:>12} {:>9}'.format('weeks', 'benchmark', 'baseline ms', 'current ms', 'change'))
+    for weeks, name, old, new, change, regression in rows:
+        print('{:>5} {:<24} {:>12.4f} {:>12.4f} {:>+8.1f}%{}'.format(weeks, name, old, new, change,
+                                                                    ' REGRESSION' if regression else ''))
+
+
+if __name__ == '__main__':
+    OPTIONS = parse_arguments(sys.argv[1:])
+    REPORT = run(OPTIONS['weeks'], OPTIONS['repeat'])
+    with open(OPTIONS['output'], 'w') as FILE:
+        json.dump(REPORT, FILE, indent=2)
+    print_report(REPORT)
+    print('Results written to ' + OPTIONS['output'])
+    if OPTIONS['compare']:
+        with open(OPTIONS['compare']) as FILE:
+            ROWS = compare(json.load(FILE), REPORT, OPTIONS['threshold'])
+        print_comparison(ROWS)
+        if any(row[5] for row in ROWS):
+            sys.exit(1)
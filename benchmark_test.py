@@ -0,0 +1,46 @@
+import os
+import tempfile
+import unittest
+
+import benchmark
+import database
+
+
+class BenchmarkTest(unittest.TestCase):
+
+    def test_parse_arguments(self):
+        options = benchmark.parse_arguments(['weeks=1,4', 'repeat=3', 'compare=baseline.json', 'threshold=10'])
+
+        self.assertEqual([1, 4], options['weeks'])
+        self.assertEqual(3, options['repeat'])
+        self.assertEqual('baseline.json', options['compare'])
+        self.assertEqual(10.0, options['threshold'])
+        self.assertEqual('benchmark.json', options['output'])
+
+    def test_create_database(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'bench.db')
+
+            newest = benchmark.create_database(filename, 1, 1600000200)
+
+            conn = database.connect(filename, True)
+            rates = database.last_rates(conn, 2000)
+            database.close(filename)
+        self.assertEqual(1600000200, newest)
+        self.assertEqual(1008, len(rates))
+        self.assertEqual(1600000200, rates[0][1])
+        self.assertEqual(1600000200 - 1007 * 600, rates[-1][1])
+
+    def test_compare(self):
+        baseline = {'results': {'1': {'rates': 1008, 'get_mas': {'median_ms': 0.02}, 'dump_to_csv': {'median_ms': 40}},
+                                '12': {'get_mas': {'median_ms': 0.02}}}}
+        report = {'results': {'1': {'rates': 1008, 'get_mas': {'median_ms': 0.03}, 'dump_to_csv': {'median_ms': 36},
+                                    'calculate_ma': {'median_ms': 0.06}}}}
+
+        rows = benchmark.compare(baseline, report, 20)
+
+        self.assertEqual([('1', 'get_mas', 0.02, 0.03, 50.0, True), ('1', 'dump_to_csv', 40, 36, -10.0, False)], rows)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,592 @@
+"""
+Shared access to the rate database written by mamaster and read by the MAverage instances.
+Every process keeps one long-lived connection per database. The writer switches the database to WAL journaling,
+so readers never block mamaster and vice versa. Bots open it read only.
+
+Schema versions (PRAGMA user_version):
+    0   legacy, rates keyed by date_time TEXT ('%Y-%m-%d %H:%M:%S')
+    1   rates keyed by epoch seconds in a WITHOUT ROWID table
+    2   hourly and daily rollups (count, sum, min, max, first, last) maintained with every insert
+    3   every rate carries its sequence number and the cumulative sum of all rates up to it (prefix sum)
+    4   rates and rollups are keyed by symbol ('exchange:pair'), the ingested symbols are listed in the symbols table
+    5   rates repeating the previous price because the current one could not be fetched are flagged as synthetic
+Readers detect the version on every query, so they keep working while mamaster migrates the database.
+"""
+import datetime
+import sqlite3
+from functools import lru_cache
+from urllib.parse import quote
+
+from ratebuffer import to_datetime, to_epoch
+
+CONNECTIONS = {}
+BUSY_TIMEOUT_MS = 10000
+MMAP_SIZE = 256 * 1024 * 1024
+CACHED_STATEMENTS = 64
+LEGACY_SCHEMA = 0
+EPOCH_SCHEMA = 1
+ROLLUP_SCHEMA = 2
+PREFIX_SUM_SCHEMA = 3
+SYMBOL_SCHEMA = 4
+SYNTHETIC_SCHEMA = 5
+SCHEMA_VERSION = SYNTHETIC_SCHEMA
+MIGRATION_CHUNK = 100000
+EXPORT_CHUNK = 10000
+# rollup table and bucket length in seconds
+ROLLUPS = (('rates_daily', 86400), ('rates_hourly', 3600))
+
+LEGACY_QUERIES = {
+    'insert': "INSERT INTO rates VALUES (?, ?)",
+    'delete': "DELETE FROM rates WHERE date_time < ?",
+    'last': "SELECT price, date_time FROM rates ORDER BY date_time DESC LIMIT ?",
+    'since': "SELECT price, date_time FROM rates WHERE date_time > ? ORDER BY date_time DESC LIMIT ?",
+    'from': "SELECT price, date_time FROM rates WHERE date_time >= ? ORDER BY date_time LIMIT ?",
+    'export': "SELECT date_time, price FROM rates WHERE date_time >= ? AND date_time < ? ORDER BY date_time",
+}
+# {columns}, {values}, {symbol} and {where} are filled in with the symbol clauses from schema version 4 on
+QUERIES = {
+    'insert': "INSERT INTO rates ({columns}epoch, price) VALUES ({values}?, ?)",
+    'insert_sum': "INSERT INTO rates ({columns}epoch, price, seq, cum) VALUES ({values}?, ?, ?, ?)",
+    'delete': "DELETE FROM rates WHERE epoch < ?",
+    'last': "SELECT price, epoch FROM rates {where} ORDER BY epoch DESC LIMIT ?",
+    'since': "SELECT price, epoch FROM rates WHERE {symbol}epoch > ? ORDER BY epoch DESC LIMIT ?",
+    'from': "SELECT price, epoch FROM rates WHERE {symbol}epoch >= ? ORDER BY epoch LIMIT ?",
+    'range': "SELECT price, epoch FROM rates WHERE {symbol}epoch >= ? AND epoch < ? ORDER BY epoch DESC LIMIT ?",
+    'export': "SELECT datetime(epoch, 'unixepoch'), price FROM rates WHERE {symbol}epoch >= ? AND epoch < ? ORDER BY epoch",
+    'newest_sum': "SELECT price, epoch, seq, cum FROM rates {where} ORDER BY epoch DESC LIMIT 1",
+    'oldest_sum': "SELECT price, epoch, seq, cum FROM rates {where} ORDER BY epoch LIMIT 1",
+    'seq_sum': "SELECT price, epoch, seq, cum FROM rates WHERE {symbol}seq = ?",
+    'previous_sum': "SELECT seq, cum FROM rates WHERE {symbol}epoch < ? ORDER BY epoch DESC LIMIT 1",
+    'rates_after': "SELECT epoch, price FROM rates WHERE {symbol}epoch >= ? ORDER BY epoch",
+    'rates_between': "SELECT epoch, price FROM rates WHERE {symbol}epoch >= ? AND epoch < ? ORDER BY epoch",
+    'reset_sums': "UPDATE rates SET seq = NULL WHERE {symbol}epoch >= ?",
+    'update_sum': "UPDATE rates SET seq = ?, cum = ? WHERE {symbol}epoch = ?",
+    'rollups': "SELECT bucket, count, sum FROM {table} WHERE {symbol}bucket >= ? AND bucket < ? ORDER BY bucket DESC",
+    'closes': "SELECT bucket, last FROM {table} WHERE {symbol}bucket >= ? ORDER BY bucket",
+    'delete_rollups': "DELETE FROM {table} WHERE {symbol}bucket >= ? AND bucket < ?",
+    'purge_rollups': "DELETE FROM {table} WHERE bucket < ?",
+    'insert_rollup': "INSERT INTO {table} ({columns}bucket, count, sum, min, max, first, last) "
+                     "VALUES ({values}?, ?, ?, ?, ?, ?, ?)",
+    'add_to_rollup': "INSERT INTO {table} ({columns}bucket, count, sum, min, max, first, last) "
+                     "VALUES ({values}?, 1, ?, ?, ?, ?, ?) ON CONFLICT({columns}bucket) DO UPDATE SET count = count + 1, "
+                     "sum = sum + excluded.sum, min = min(min, excluded.min), max = max(max, excluded.max), "
+                     "last = excluded.last",
+}
+SYMBOL_CLAUSES = {'columns': 'symbol, ', 'values': '?, ', 'symbol': 'symbol = ? AND ', 'where': 'WHERE symbol = ?'}
+PLAIN_CLAUSES = {'columns': '', 'values': '', 'symbol': '', 'where': ''}
+
+
+def connect(name: str, read_only: bool = False):
+    """
+    Returns the connection of this process to the database, opening and tuning it on first use
+    :param name: filename of the database
+    :param read_only: open the database read only (bots)
+    :return sqlite3.Connection
+    """
+    key = (name, read_only)
+    conn = CONNECTIONS.get(key)
+    if conn is None:
+        if read_only:
+            conn = sqlite3.connect('file:{}?mode=ro'.format(quote(name)), uri=True,
+                                   cached_statements=CACHED_STATEMENTS)
+        else:
+            conn = sqlite3.connect(name, cached_statements=CACHED_STATEMENTS)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA busy_timeout={}'.format(BUSY_TIMEOUT_MS))
+        conn.execute('PRAGMA mmap_size={}'.format(MMAP_SIZE))
+        CONNECTIONS[key] = conn
+    return conn
+
+
+def close(name: str = None):
+    """
+    Closes the connections to the database or to all databases
+    :param name: filename of the database, optional
+    """
+    for key in list(CONNECTIONS):
+        if name is None or key[0] == name:
+            CONNECTIONS.pop(key).close()
+
+
+def schema_version(conn: sqlite3.Connection):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+@lru_cache(maxsize=None)
+def sql(version: int, name: str, table: str = None):
+    """
+    :return the statement of the query for the schema version
+    """
+    if version == LEGACY_SCHEMA:
+        return LEGACY_QUERIES[name]
+    clauses = SYMBOL_CLAUSES if version >= SYMBOL_SCHEMA else PLAIN_CLAUSES
+    return QUERIES[name].format(table=table, **clauses)
+
+
+def execute(conn: sqlite3.Connection, version: int, name: str, symbol: str = None, params: tuple = (),
+            table: str = None):
+    """
+    Executes the query for the schema version, passing the symbol (the default one if None) from version 4 on
+    """
+    if version >= SYMBOL_SCHEMA:
+        params = (symbol or default_symbol(conn),) + params
+    return conn.execute(sql(version, name, table), params)
+
+
+def to_key(date_time, version: int):
+    """
+    Converts a datetime, a date_time string or epoch seconds into the key of the rates table
+    :param date_time: datetime (UTC), str or int
+    :param version: schema version of the database
+    :return str or int key
+    """
+    if version == LEGACY_SCHEMA:
+        if isinstance(date_time, int):
+            date_time = to_datetime(date_time)
+        return str(date_time)
+    return to_epoch(date_time)
+
+
+def init_schema(conn: sqlite3.Connection, symbols: list):
+    """
+    Creates the rates table with the current schema unless there is one already and registers the ingested symbols
+    :param symbols: the ingested symbols ('exchange:pair'), the first one is the default for the bots
+    :return int: the schema version of the database
+    """
+    if conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'rates'").fetchone() is None:
+        conn.execute("CREATE TABLE rates (epoch INTEGER NOT NULL PRIMARY KEY, price INTEGER) WITHOUT ROWID")
+        conn.execute('PRAGMA user_version = {}'.format(EPOCH_SCHEMA))
+        conn.commit()
+    version = upgrade(conn, symbols)
+    if version >= SYMBOL_SCHEMA:
+        with conn:
+            conn.execute("UPDATE symbols SET position = NULL")
+            conn.executemany("INSERT OR REPLACE INTO symbols VALUES (?, ?)",
+                             [(symbol, position) for position, symbol in enumerate(symbols)])
+    return version
+
+
+def upgrade(conn: sqlite3.Connection, symbols: list):
+    """
+    Applies the pending schema changes to a database with the epoch schema
+    :param symbols: the ingested symbols, the existing rates are assigned to the first one
+    :return int: the schema version of the database
+    """
+    version = schema_version(conn)
+    if version == LEGACY_SCHEMA:
+        return version
+    for new_version, step in ((ROLLUP_SCHEMA, _add_rollups), (PREFIX_SUM_SCHEMA, _add_prefix_sums),
+                              (SYMBOL_SCHEMA, _add_symbols), (SYNTHETIC_SCHEMA, _add_synthetic_flags)):
+        if version < new_version:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                step(conn, symbols)
+                conn.execute('PRAGMA user_version = {}'.format(new_version))
+                conn.commit()
+            except sqlite3.Error:
+                conn.rollback()
+                raise
+            version = new_version
+    return version
+
+
+def _add_rollups(conn: sqlite3.Connection, _):
+    for table, _ in ROLLUPS:
+        conn.execute("CREATE TABLE IF NOT EXISTS {} (bucket INTEGER NOT NULL PRIMARY KEY, count INTEGER, sum INTEGER, "
+                     "min INTEGER, max INTEGER, first INTEGER, last INTEGER) WITHOUT ROWID".format(table))
+    rebuild_rollups(conn, ROLLUP_SCHEMA)
+
+
+def _add_prefix_sums(conn: sqlite3.Connection, _):
+    conn.execute("ALTER TABLE rates ADD COLUMN seq INTEGER")
+    conn.execute("ALTER TABLE rates ADD COLUMN cum INTEGER")
+    conn.execute("CREATE UNIQUE INDEX rates_seq ON rates (seq)")
+    rebuild_prefix_sums(conn, PREFIX_SUM_SCHEMA)
+
+
+def _add_symbols(conn: sqlite3.Connection, symbols: list):
+    conn.execute("CREATE TABLE symbols (symbol TEXT NOT NULL PRIMARY KEY, position INTEGER) WITHOUT ROWID")
+    conn.execute("CREATE TABLE rates_symbol (symbol TEXT NOT NULL, epoch INTEGER NOT NULL, price INTEGER, seq INTEGER, "
+                 "cum INTEGER, PRIMARY KEY (symbol, epoch)) WITHOUT ROWID")
+    conn.execute("INSERT INTO rates_symbol SELECT ?, epoch, price, seq, cum FROM rates", (symbols[0],))
+    conn.execute("DROP TABLE rates")
+    conn.execute("ALTER TABLE rates_symbol RENAME TO rates")
+    conn.execute("CREATE UNIQUE INDEX rates_seq ON rates (symbol, seq)")
+    for table, _ in ROLLUPS:
+        conn.execute("CREATE TABLE {}_symbol (symbol TEXT NOT NULL, bucket INTEGER NOT NULL, count INTEGER, sum INTEGER, "
+                     "min INTEGER, max INTEGER, first INTEGER, last INTEGER, PRIMARY KEY (symbol, bucket)) WITHOUT ROWID"
+                     .format(table))
+        conn.execute("INSERT INTO {0}_symbol SELECT ?, * FROM {0}".format(table), (symbols[0],))
+        conn.execute("DROP TABLE {}".format(table))
+        conn.execute("ALTER TABLE {0}_symbol RENAME TO {0}".format(table))
+    conn.execute("INSERT INTO symbols VALUES (?, 0)", (symbols[0],))
+
+
+def _add_synthetic_flags(conn: sqlite3.Connection, _):
+    conn.execute("ALTER TABLE rates ADD COLUMN synthetic INTEGER NOT NULL DEFAULT 0")
+
+
+def symbols(conn: sqlite3.Connection):
+    """
+    :return list of the ingested symbols, the default one first
+    """
+    if schema_version(conn) < SYMBOL_SCHEMA:
+        return []
+    return [row[0] for row in conn.execute("SELECT symbol FROM symbols ORDER BY position IS NULL, position")]
+
+
+def default_symbol(conn: sqlite3.Connection):
+    """
+    :return the symbol the bots use unless they are configured otherwise
+    """
+    row = conn.execute("SELECT symbol FROM symbols ORDER BY position IS NULL, position LIMIT 1").fetchone()
+    return row[0] if row else None
+
+
+def migrate(conn: sqlite3.Connection, symbols: list, chunk: int = MIGRATION_CHUNK):
+    """
+    Migrates a legacy database to the epoch schema. The rates are copied in chunks into a new table and every chunk is
+    committed, so an interrupted migration resumes where it stopped. Finally the new table replaces the old one.
+    :param symbols: the ingested symbols, the migrated rates are assigned to the first one
+    :param chunk: number of rates copied per transaction
+    :return int: number of migrated rates
+    """
+    if schema_version(conn) != LEGACY_SCHEMA:
+        return 0
+    conn.execute("CREATE TABLE IF NOT EXISTS rates_epoch (epoch INTEGER NOT NULL PRIMARY KEY, price INTEGER) WITHOUT ROWID")
+    migrated = 0
+    copied = chunk
+    while copied == chunk:
+        with conn:
+            copied = _copy_legacy_rates(conn, chunk)
+        migrated += copied
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        migrated += _copy_legacy_rates(conn, -1)
+        conn.execute("DROP TABLE rates")
+        conn.execute("ALTER TABLE rates_epoch RENAME TO rates")
+        conn.execute('PRAGMA user_version = {}'.format(EPOCH_SCHEMA))
+        conn.commit()
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+    init_schema(conn, symbols)
+    conn.execute('VACUUM')
+    return migrated
+
+
+def _copy_legacy_rates(conn: sqlite3.Connection, limit: int):
+    last = conn.execute("SELECT max(epoch) FROM rates_epoch").fetchone()[0]
+    start = str(to_datetime(last)) if last is not None else ''
+    return conn.execute("INSERT OR IGNORE INTO rates_epoch SELECT CAST(strftime('%s', date_time) AS INTEGER), price "
+                        "FROM rates WHERE date_time > ? ORDER BY date_time LIMIT ?", (start, limit)).rowcount
+
+
+def rebuild(conn: sqlite3.Connection):
+    """
+    Recalculates the rollups and the prefix sums of all rates, e.g. after manual repairs
+    """
+    version = schema_version(conn)
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        for symbol in symbols(conn) or [None]:
+            if version >= ROLLUP_SCHEMA:
+                rebuild_rollups(conn, version, symbol)
+            if version >= PREFIX_SUM_SCHEMA:
+                rebuild_prefix_sums(conn, version, symbol)
+        conn.commit()
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+
+
+def rebuild_prefix_sums(conn: sqlite3.Connection, version: int, symbol: str = None, since: int = 0):
+    """
+    Renumbers the rates and recalculates their prefix sums. Has to be called within a transaction.
+    :param version: schema version of the database
+    :param symbol: symbol of the rates
+    :param since: epoch seconds, the rates starting with it are recalculated
+    """
+    previous = execute(conn, version, 'previous_sum', symbol, (since,)).fetchone()
+    seq, cum = previous if previous and previous[0] is not None else (0, 0)
+    rates = execute(conn, version, 'rates_after', symbol, (since,)).fetchall()
+    execute(conn, version, 'reset_sums', symbol, (since,))
+    updates = []
+    for epoch, price in rates:
+        seq += 1
+        cum += price
+        updates.append((seq, cum, epoch) if version < SYMBOL_SCHEMA else (seq, cum, symbol, epoch))
+    conn.executemany(sql(version, 'update_sum'), updates)
+
+
+def rebuild_rollups(conn: sqlite3.Connection, version: int, symbol: str = None, since: int = 0, until: int = 2 ** 62):
+    """
+    Recalculates the rollups from the rates. Has to be called within a transaction.
+    :param version: schema version of the database
+    :param symbol: symbol of the rates
+    :param since: epoch seconds, the buckets containing or following it are recalculated
+    :param until: epoch seconds, the buckets starting with or after it are left as they are
+    """
+    buckets = {}
+    for table, length in ROLLUPS:
+        execute(conn, version, 'delete_rollups', symbol, (since - since % length, until), table)
+        buckets[table] = {}
+    # the rates of the longest buckets cover the ones of the shorter buckets
+    longest = ROLLUPS[0][1]
+    end = min(until - 1 - (until - 1) % longest + longest, 2 ** 62)
+    for epoch, price in execute(conn, version, 'rates_between', symbol, (since - since % longest, end)):
+        for table, length in ROLLUPS:
+            bucket = epoch - epoch % length
+            if bucket < since - since % length or bucket >= until:
+                continue
+            rollup = buckets[table].get(bucket)
+            if rollup is None:
+                buckets[table][bucket] = [bucket, 1, price, price, price, price, price]
+            else:
+                rollup[1] += 1
+                rollup[2] += price
+                rollup[3] = min(rollup[3], price)
+                rollup[4] = max(rollup[4], price)
+                rollup[6] = price
+    for table, _ in ROLLUPS:
+        rollups = buckets[table].values()
+        if version >= SYMBOL_SCHEMA:
+            rollups = [[symbol] + rollup for rollup in rollups]
+        conn.executemany(sql(version, 'insert_rollup', table), rollups)
+
+
+def _add_to_rollups(conn: sqlite3.Connection, version: int, symbol: str, epoch: int, price):
+    for table, length in ROLLUPS:
+        execute(conn, version, 'add_to_rollup', symbol, (epoch - epoch % length, price, price, price, price, price), table)
+
+
+def insert_rate(conn: sqlite3.Connection, date_time, price, symbol: str = None):
+    """
+    Persists a rate
+    :param date_time: datetime (UTC) of the rate
+    :param price: the rate
+    :param symbol: symbol of the rate
+    """
+    insert_rates(conn, date_time, {symbol: price})
+
+
+def insert_rates(conn: sqlite3.Connection, date_time, prices: dict, synthetic: set = ()):
+    """
+    Persists the rates of several symbols within one transaction.
+    Databases older than schema version 4 hold a single series, so only the first symbol is persisted.
+    :param date_time: datetime (UTC) of the rates
+    :param prices: dict symbol: price
+    :param synthetic: symbols whose price repeats the previous one, as the current one could not be fetched
+    """
+    version = schema_version(conn)
+    key = to_key(date_time, version)
+    if version < SYMBOL_SCHEMA:
+        prices = dict(list(prices.items())[:1])
+    with conn:
+        for symbol, price in prices.items():
+            if version >= SYMBOL_SCHEMA:
+                symbol = symbol or default_symbol(conn)
+            if version >= PREFIX_SUM_SCHEMA:
+                _insert_with_prefix_sum(conn, version, symbol, key, price)
+            else:
+                execute(conn, version, 'insert', symbol, (key, price))
+            if version >= ROLLUP_SCHEMA:
+                _add_to_rollups(conn, version, symbol, key, price)
+            if version >= SYNTHETIC_SCHEMA and symbol in synthetic:
+                conn.execute("UPDATE rates SET synthetic = 1 WHERE symbol = ? AND epoch = ?", (symbol, key))
+
+
+def _insert_with_prefix_sum(conn: sqlite3.Connection, version: int, symbol: str, epoch: int, price):
+    previous = execute(conn, version, 'newest_sum', symbol).fetchone()
+    if previous is None or previous[1] < epoch:
+        seq, cum = (previous[2], previous[3]) if previous else (0, 0)
+        execute(conn, version, 'insert_sum', symbol, (epoch, price, seq + 1, cum + price))
+    else:
+        # older than the newest rate, the following ones need to be renumbered
+        execute(conn, version, 'insert', symbol, (epoch, price))
+        rebuild_prefix_sums(conn, version, symbol, epoch)
+
+
+def find_gaps(conn: sqlite3.Connection, symbol: str, since: int, until: int, interval: int):
+    """
+    Finds the interval boundaries without a rate. Rates persisted off the boundaries by older versions are tolerated.
+    :param symbol: symbol of the rates
+    :param since: epoch seconds, start of the examined period
+    :param until: epoch seconds, end of the examined period
+    :param interval: sampling interval in seconds
+    :return list of epoch seconds of the missing boundaries
+    """
+    first = -(-since // interval) * interval
+    missing = []
+    previous = first - interval
+    for epoch, in conn.execute("SELECT epoch FROM rates WHERE symbol = ? AND epoch >= ? AND epoch <= ? ORDER BY epoch",
+                               (symbol, first - interval // 2, until)):
+        if epoch - previous > interval * 3 // 2:
+            missing.extend(range(previous + interval, epoch - interval // 2, interval))
+        previous = epoch - epoch % interval if epoch % interval <= interval // 2 else epoch - epoch % interval + interval
+    missing.extend(range(previous + interval, until + 1, interval))
+    return missing
+
+
+def synthetic_rates(conn: sqlite3.Connection, symbol: str, since: int):
+    """
+    :return list of epoch seconds of the synthetic rates of the symbol since the epoch seconds
+    """
+    if schema_version(conn) < SYNTHETIC_SCHEMA:
+        return []
+    return [row[0] for row in conn.execute("SELECT epoch FROM rates WHERE symbol = ? AND epoch >= ? AND synthetic = 1",
+                                           (symbol, since))]
+
+
+def backfill_rates(conn: sqlite3.Connection, symbol: str, rates: list):
+    """
+    Inserts historic rates within one transaction, replacing synthetic ones, and recalculates the derived sums
+    :param symbol: symbol of the rates
+    :param rates: list of (epoch seconds, price)
+    :return int: number of inserted or replaced rates
+    """
+    version = schema_version(conn)
+    if not rates or version < SYNTHETIC_SCHEMA:
+        return 0
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        changes = conn.total_changes
+        conn.executemany("INSERT INTO rates (symbol, epoch, price) VALUES (?, ?, ?) ON CONFLICT (symbol, epoch) "
+                         "DO UPDATE SET price = excluded.price, synthetic = 0 WHERE synthetic = 1",
+                         [(symbol, epoch, price) for epoch, price in rates])
+        inserted = conn.total_changes - changes
+        since = min(rate[0] for rate in rates)
+        rebuild_rollups(conn, version, symbol, since, max(rate[0] for rate in rates) + 1)
+        rebuild_prefix_sums(conn, version, symbol, since)
+        conn.commit()
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+    return inserted
+
+
+def delete_rates_older_than(conn: sqlite3.Connection, date_time):
+    """
+    Purges the rates of all symbols older than the datetime
+    """
+    version = schema_version(conn)
+    key = to_key(date_time, version)
+    with conn:
+        conn.execute(sql(version, 'delete'), (key,))
+        if version >= ROLLUP_SCHEMA:
+            for table, length in ROLLUPS:
+                conn.execute(sql(version, 'purge_rollups', table), (key - key % length,))
+            # only the buckets containing the cut lose rates
+            for symbol in symbols(conn) or [None]:
+                rebuild_rollups(conn, version, symbol, key, key + 1)
+
+
+def last_rates(conn: sqlite3.Connection, limit: int, symbol: str = None):
+    """
+    :return the last x rates (price, key) ordered newest first
+    """
+    return execute(conn, schema_version(conn), 'last', symbol, (limit,)).fetchall()
+
+
+def rates_since(conn: sqlite3.Connection, date_time, limit: int, symbol: str = None):
+    """
+    :return at most x rates (price, key) newer than the datetime ordered newest first
+    """
+    version = schema_version(conn)
+    return execute(conn, version, 'since', symbol, (to_key(date_time, version), limit)).fetchall()
+
+
+def rates_from(conn: sqlite3.Connection, date_time, limit: int, symbol: str = None):
+    """
+    :return x rates (price, key) starting with the datetime ordered oldest first
+    """
+    version = schema_version(conn)
+    return execute(conn, version, 'from', symbol, (to_key(date_time, version), limit)).fetchall()
+
+
+def sum_last_rates(conn: sqlite3.Connection, limit: int, symbol: str = None):
+    """
+    Sums up the last x rates. With rollups only the buckets entirely within the window are read, plus the raw rates of
+    the hour the window starts in. The result is exactly the same as summing up the raw rates.
+    With prefix sums it takes just two indexed lookups: cum[n] - cum[n - x].
+    :param limit: number of rates
+    :param symbol: symbol of the rates
+    :return tuple: count, total, oldest rate (price, key) within the window, newest rate (price, key)
+    """
+    version = schema_version(conn)
+    if version >= PREFIX_SUM_SCHEMA:
+        return _sum_from_prefix_sums(conn, version, symbol, limit)
+    if version < ROLLUP_SCHEMA:
+        rates = last_rates(conn, limit)
+        return len(rates), sum(rate[0] for rate in rates), rates[-1] if rates else None, rates[0] if rates else None
+    return _sum_from_rollups(conn, version, symbol, limit)
+
+
+def _sum_from_rollups(conn: sqlite3.Connection, version: int, symbol: str, limit: int):
+    newest = execute(conn, version, 'last', symbol, (1,)).fetchone()
+    count = total = 0
+    # oldest bucket entirely within the window
+    start = None
+    first = None
+    # range of the buckets to walk through, narrowed down to the day and then to the hour the window starts in
+    buckets = (0, 2 ** 62)
+    for table, length in ROLLUPS:
+        partial = None
+        for bucket, bucket_count, bucket_sum in execute(conn, version, 'rollups', symbol, buckets, table):
+            if count + bucket_count > limit:
+                partial = bucket
+                break
+            count += bucket_count
+            total += bucket_sum
+            start = bucket
+        if partial is None:
+            break
+        buckets = (partial, partial + length)
+    else:
+        rates = execute(conn, version, 'range', symbol, buckets + (limit - count,)).fetchall()
+        count += len(rates)
+        total += sum(rate[0] for rate in rates)
+        first = rates[-1] if rates else None
+    if first is None and start is not None:
+        first = execute(conn, version, 'from', symbol, (start, 1)).fetchone()
+    return count, total, first, newest
+
+
+def _sum_from_prefix_sums(conn: sqlite3.Connection, version: int, symbol: str, limit: int):
+    newest = execute(conn, version, 'newest_sum', symbol).fetchone()
+    if newest is None or limit < 1:
+        return 0, 0, None, newest[:2] if newest else None
+    first = execute(conn, version, 'seq_sum', symbol, (newest[2] - limit + 1,)).fetchone()
+    if first is None:
+        first = execute(conn, version, 'oldest_sum', symbol).fetchone()
+    return newest[2] - first[2] + 1, newest[3] - first[3] + first[0], first[:2], newest[:2]
+
+
+def daily_closes(conn: sqlite3.Connection, since: int, symbol: str = None):
+    """
+    :param since: epoch seconds of the first day
+    :return list of (day in epoch seconds, last rate of the day) ordered oldest first, empty before schema version 2
+    """
+    version = schema_version(conn)
+    if version < ROLLUP_SCHEMA:
+        return []
+    return execute(conn, version, 'closes', symbol, (since,), ROLLUPS[0][0]).fetchall()
+
+
+def export_rates(conn: sqlite3.Connection, since=None, until=None, symbol: str = None, chunk: int = EXPORT_CHUNK):
+    """
+    Iterates over the rates within the range chunk by chunk, so the memory used does not grow with the database
+    :param since: datetime of the first rate, the oldest if None
+    :param until: datetime after the last rate, the newest if None
+    :param symbol: symbol of the rates, the default one if None
+    :param chunk: number of rates fetched at once
+    :return generator of lists of entries (date_time, price) ordered oldest first
+    """
+    version = schema_version(conn)
+    params = (to_key(since or 0, version), to_key(until or datetime.datetime.max.replace(microsecond=0), version))
+    cursor = execute(conn, version, 'export', symbol, params)
+    rows = cursor.fetchmany(chunk)
+    while rows:
+        yield rows
+        rows = cursor.fetchmany(chunk)
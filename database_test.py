@@ -0,0 +1,187 @@
+import datetime
+import os
+import sqlite3
+import tempfile
+import unittest
+
+import database
+
+
+def exported(conn: sqlite3.Connection, symbol: str = None):
+    return [entry for chunk in database.export_rates(conn, symbol=symbol) for entry in chunk]
+
+
+class DatabaseTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.name = os.path.join(self.directory.name, 'mamaster.db')
+        self.conn = database.connect(self.name)
+        database.init_schema(self.conn, ['bitmex:BTC/USD'])
+        start = datetime.datetime(2020, 5, 1)
+        for i in range(6):
+            database.insert_rate(self.conn, start + datetime.timedelta(minutes=10 * i), 9000 + i)
+
+    def tearDown(self):
+        database.close()
+        self.directory.cleanup()
+
+    def test_connect_reuses_tuned_connection(self):
+        self.assertIs(self.conn, database.connect(self.name))
+        self.assertEqual('wal', self.conn.execute('PRAGMA journal_mode').fetchone()[0])
+        self.assertEqual(database.BUSY_TIMEOUT_MS, self.conn.execute('PRAGMA busy_timeout').fetchone()[0])
+
+    def test_read_only_connection(self):
+        reader = database.connect(self.name, True)
+
+        self.assertIsNot(self.conn, reader)
+        self.assertEqual([(9005, 1588294200)], database.last_rates(reader, 1))
+        with self.assertRaises(sqlite3.OperationalError):
+            database.insert_rate(reader, datetime.datetime(2020, 5, 2), 1)
+
+    def test_rates_since(self):
+        rates = database.rates_since(self.conn, '2020-05-01 00:30:00', 10)
+
+        self.assertEqual([(9005, 1588294200), (9004, 1588293600)], rates)
+
+    def test_rates_from_epoch(self):
+        rates = database.rates_from(self.conn, 1588292400, 2)
+
+        self.assertEqual([(9002, 1588292400), (9003, 1588293000)], rates)
+
+    def test_delete_rates_older_than(self):
+        database.delete_rates_older_than(self.conn, datetime.datetime(2020, 5, 1, 0, 30))
+
+        self.assertEqual(3, len(exported(self.conn)))
+        self.assertEqual(('2020-05-01 00:50:00', 9005), exported(self.conn)[-1])
+
+    def test_delete_rates_older_than_rebuilds_only_buckets_at_cut(self):
+        start = datetime.datetime(2020, 5, 2)
+        for i in range(3 * 144):
+            database.insert_rate(self.conn, start + datetime.timedelta(minutes=10 * i), 9000 + i % 7)
+        # marks all rollups, only the ones containing the cut must be recalculated
+        for table, _ in database.ROLLUPS:
+            self.conn.execute("UPDATE {} SET sum = -1".format(table))
+        self.conn.commit()
+
+        database.delete_rates_older_than(self.conn, datetime.datetime(2020, 5, 2, 15, 25))
+
+        hourly = self.conn.execute("SELECT bucket, count, sum FROM rates_hourly ORDER BY bucket").fetchall()
+        self.assertEqual((1588431600, 3, 9002 + 9003 + 9004), hourly[0])
+        self.assertEqual({-1}, {rollup[2] for rollup in hourly[1:]})
+        self.assertEqual(9 + 2 * 24, len(hourly))
+        daily = self.conn.execute("SELECT bucket, count, sum FROM rates_daily ORDER BY bucket").fetchall()
+        rates = [price for date_time, price in exported(self.conn) if date_time < '2020-05-03']
+        self.assertEqual([(1588377600, len(rates), sum(rates)), (1588464000, 144, -1), (1588550400, 144, -1)], daily)
+
+    def test_export_rates(self):
+        chunks = list(database.export_rates(self.conn, datetime.datetime(2020, 5, 1, 0, 10),
+                                            datetime.datetime(2020, 5, 1, 0, 50), chunk=3))
+
+        self.assertEqual([3, 1], [len(chunk) for chunk in chunks])
+        self.assertEqual(('2020-05-01 00:10:00', 9001), chunks[0][0])
+        self.assertEqual(('2020-05-01 00:40:00', 9004), chunks[1][0])
+        self.assertEqual(6, sum(len(chunk) for chunk in database.export_rates(self.conn)))
+
+    def test_sum_last_rates_from_rollups(self):
+        self.assert_sum_last_rates(lambda limit: database._sum_from_rollups(self.conn, database.SCHEMA_VERSION, None,
+                                                                             limit))
+
+    def test_sum_last_rates_from_prefix_sums(self):
+        self.assert_sum_last_rates(lambda limit: database.sum_last_rates(self.conn, limit))
+
+    def test_multiple_symbols(self):
+        database.init_schema(self.conn, ['kraken:ETH/USD', 'bitmex:BTC/USD'])
+        for i in range(3):
+            database.insert_rates(self.conn, datetime.datetime(2020, 5, 1, 1, 10 * i),
+                                  {'bitmex:BTC/USD': 9100 + i, 'kraken:ETH/USD': 200.5 + i})
+
+        self.assertEqual(['kraken:ETH/USD', 'bitmex:BTC/USD'], database.symbols(self.conn))
+        self.assertEqual([(202.5, 1588296000)], database.last_rates(self.conn, 1))
+        self.assertEqual([(9102, 1588296000)], database.last_rates(self.conn, 1, 'bitmex:BTC/USD'))
+        self.assertEqual((3, 604.5, (200.5, 1588294800), (202.5, 1588296000)), database.sum_last_rates(self.conn, 5))
+        self.assertEqual((2, 9101 + 9102, (9101, 1588295400), (9102, 1588296000)),
+                         database.sum_last_rates(self.conn, 2, 'bitmex:BTC/USD'))
+        self.assertEqual([(201.5, 1588295400)], database.rates_from(self.conn, 1588294801, 1, 'kraken:ETH/USD'))
+
+        database.delete_rates_older_than(self.conn, datetime.datetime(2020, 5, 1, 1, 5))
+
+        self.assertEqual(2, len(exported(self.conn, 'kraken:ETH/USD')))
+        self.assertEqual(2, len(exported(self.conn, 'bitmex:BTC/USD')))
+        self.assertEqual((2, 9101 + 9102, 9101, 9102), self.conn.execute(
+            "SELECT count, sum, first, last FROM rates_hourly WHERE symbol = 'bitmex:BTC/USD'").fetchone())
+
+    def test_prefix_sums_after_inserting_older_rate_and_rebuild(self):
+        database.insert_rate(self.conn, datetime.datetime(2020, 4, 30, 23, 50), 8999)
+        database.insert_rate(self.conn, datetime.datetime(2020, 5, 1, 0, 25), 9999)
+
+        self.assertEqual((4, 9003 + 9999 + 9004 + 9005, (9999, 1588292700), (9005, 1588294200)),
+                         database.sum_last_rates(self.conn, 4))
+        self.assertEqual((8, 8999 + 6 * 9000 + 15 + 9999, (8999, 1588290600), (9005, 1588294200)),
+                         database.sum_last_rates(self.conn, 10))
+
+        self.conn.execute("UPDATE rates SET cum = 0")
+        self.conn.commit()
+        database.rebuild(self.conn)
+
+        self.assertEqual((1, 8, 8999), self.conn.execute("SELECT min(seq), count(seq), min(cum) FROM rates").fetchone())
+        self.assertEqual((4, 9003 + 9999 + 9004 + 9005, (9999, 1588292700), (9005, 1588294200)),
+                         database.sum_last_rates(self.conn, 4))
+
+    def assert_sum_last_rates(self, sum_last_rates):
+        start = datetime.datetime(2020, 5, 2)
+        for i in range(500):
+            database.insert_rate(self.conn, start + datetime.timedelta(minutes=10 * i), (i * 7919) % 10007)
+        database.delete_rates_older_than(self.conn, start + datetime.timedelta(minutes=10 * 33 + 5))
+        rates = database.last_rates(self.conn, 1000)
+
+        for limit in (1, 5, 6, 7, 144, 145, 300, 466, 467, 1000):
+            window = rates[:limit]
+            expected = (len(window), sum(rate[0] for rate in window), window[-1], rates[0])
+            self.assertEqual(expected, sum_last_rates(limit))
+
+    def test_find_gaps(self):
+        database.insert_rate(self.conn, datetime.datetime(2020, 5, 1, 1, 20, 7), 9008)
+
+        self.assertEqual([1588290600, 1588294800, 1588295400, 1588296600],
+                         database.find_gaps(self.conn, 'bitmex:BTC/USD', 1588290500, 1588296600, 600))
+
+    def test_backfill_rates_replaces_synthetic_rates(self):
+        database.insert_rates(self.conn, datetime.datetime(2020, 5, 1, 1), {'bitmex:BTC/USD': 9005}, {'bitmex:BTC/USD'})
+        database.insert_rate(self.conn, datetime.datetime(2020, 5, 1, 1, 20), 9007)
+
+        self.assertEqual([1588294800], database.synthetic_rates(self.conn, 'bitmex:BTC/USD', 0))
+        self.assertEqual(2, database.backfill_rates(self.conn, 'bitmex:BTC/USD',
+                                                    [(1588291200, 1), (1588294800, 9006), (1588295400, 9008)]))
+
+        self.assertEqual([], database.synthetic_rates(self.conn, 'bitmex:BTC/USD', 0))
+        self.assertEqual([(9007, 1588296000), (9008, 1588295400), (9006, 1588294800), (9005, 1588294200)],
+                         database.last_rates(self.conn, 4))
+        self.assertEqual((9, 9000 * 9 + 15 + 6 + 7 + 8, (9000, 1588291200), (9007, 1588296000)),
+                         database.sum_last_rates(self.conn, 10))
+        self.assertEqual((9, 9000 * 9 + 15 + 6 + 7 + 8), self.conn.execute(
+            "SELECT count, sum FROM rates_daily WHERE symbol = 'bitmex:BTC/USD'").fetchone())
+
+    def test_legacy_schema_and_migration(self):
+        name = os.path.join(self.directory.name, 'legacy.db')
+        conn = database.connect(name)
+        conn.execute("CREATE TABLE rates (date_time TEXT NOT NULL PRIMARY KEY, price INTEGER)")
+        start = datetime.datetime(2020, 5, 1)
+        for i in range(7):
+            database.insert_rate(conn, start + datetime.timedelta(minutes=10 * i), 9000 + i)
+        reader = database.connect(name, True)
+        self.assertEqual(database.LEGACY_SCHEMA, database.init_schema(conn, ['bitmex:BTC/USD']))
+        self.assertEqual([(9006, '2020-05-01 01:00:00')], database.last_rates(reader, 1))
+        self.assertEqual([(9006, '2020-05-01 01:00:00')], database.rates_since(reader, 1588294200, 5))
+
+        self.assertEqual(7, database.migrate(conn, ['bitmex:BTC/USD'], 3))
+
+        self.assertEqual(database.SCHEMA_VERSION, database.schema_version(reader))
+        self.assertEqual([(9006, 1588294800)], database.rates_since(reader, '2020-05-01 00:50:00', 5))
+        self.assertEqual(7, len(exported(reader)))
+        self.assertEqual(['bitmex:BTC/USD'], database.symbols(reader))
+        self.assertEqual(0, database.migrate(conn, ['bitmex:BTC/USD']))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+"""
+Append-only journal of the state transitions of a MAverage instance (<instance>.jnl).
+Every line is a JSON object holding the changed keys, replaying the lines in order restores the state.
+Lines are flushed right away but synced to disk in batches: every SYNC_RECORDS records, on sync() or for a durable
+record. Once the journal holds COMPACT_RECORDS records it is replaced by a single snapshot of the state.
+A partially written last line (the process died while appending) is cut off when the journal is opened.
+"""
+import json
+import os
+
+SYNC_RECORDS = 16
+COMPACT_RECORDS = 1000
+
+
+def replay(filename: str):
+    """
+    Reads the journal up to the last complete record
+    :return tuple: state, number of records, size in bytes of the complete records
+    """
+    state = {}
+    records = 0
+    size = 0
+    try:
+        with open(filename, 'rb') as file:
+            for line in file:
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    changes = json.loads(line)
+                except ValueError:
+                    break
+                state.update(changes)
+                records += 1
+                size += len(line)
+    except FileNotFoundError:
+        pass
+    return state, records, size
+
+
+class Journal:
+    """
+    Journal of the state, holding the state replayed so far
+    """
+
+    def __init__(self, filename: str, sync_records: int = SYNC_RECORDS, compact_records: int = COMPACT_RECORDS):
+        self.filename = filename
+        self.sync_records = sync_records
+        self.compact_records = compact_records
+        self.state, self.records, size = replay(filename)
+        self.file = open(filename, 'ab')
+        self.file.truncate(size)
+        self.unsynced = 0
+
+    def append(self, changes: dict, durable: bool = False):
+        """
+        Appends a record of the changed keys
+        :param durable: sync the journal to disk before returning, e.g. after an order has been created
+        """
+        self.state.update(changes)
+        self.file.write(json.dumps(changes, separators=(',', ':')).encode() + b'\n')
+        self.file.flush()
+        self.records += 1
+        self.unsynced += 1
+        if durable or self.unsynced >= self.sync_records:
+            self.sync()
+
+    def sync(self):
+        """
+        Syncs the records appended since the last sync to disk, compacting the journal if it has grown too long
+        """
+        if self.records >= self.compact_records:
+            self.compact()
+        elif self.unsynced:
+            os.fsync(self.file.fileno())
+        self.unsynced = 0
+
+    def compact(self):
+        """
+        Replaces the journal by a snapshot of the state
+        """
+        temporary = self.filename + '.tmp'
+        with open(temporary, 'wb') as file:
+            file.write(json.dumps(self.state, separators=(',', ':')).encode() + b'\n')
+            file.flush()
+            os.fsync(file.fileno())
+        self.file.close()
+        os.replace(temporary, self.filename)
+        directory = os.open(os.path.dirname(os.path.abspath(self.filename)), os.O_RDONLY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+        self.file = open(self.filename, 'ab')
+        self.records = 1
+        self.unsynced = 0
+
+    def close(self):
+        self.sync()
+        self.file.close()
@@ -0,0 +1,69 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import journal
+
+
+class JournalTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.directory.name, 'test.jnl')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_replay_restores_last_values(self):
+        state = journal.Journal(self.filename)
+        state.append({'last_action': 'BUY', 'order': {'id': '1'}})
+        state.append({'order': None, 'stop_loss_price': 9000})
+        state.close()
+
+        self.assertEqual({'last_action': 'BUY', 'order': None, 'stop_loss_price': 9000},
+                         journal.Journal(self.filename).state)
+
+    def test_torn_record_is_cut_off(self):
+        state = journal.Journal(self.filename)
+        state.append({'last_action': 'BUY'})
+        state.close()
+        with open(self.filename, 'ab') as file:
+            file.write(b'{"last_action":"SE')
+
+        state = journal.Journal(self.filename)
+        state.append({'stop_loss_price': 1})
+        state.close()
+
+        self.assertEqual(({'last_action': 'BUY', 'stop_loss_price': 1}, 2, os.path.getsize(self.filename)),
+                         journal.replay(self.filename))
+
+    @patch('journal.os.fsync')
+    def test_sync_is_batched(self, mock_fsync):
+        state = journal.Journal(self.filename, sync_records=3)
+        state.append({'a': 1})
+        state.append({'a': 2})
+        mock_fsync.assert_not_called()
+
+        state.append({'a': 3})
+        state.append({'a': 4}, True)
+        state.sync()
+
+        self.assertEqual(2, mock_fsync.call_count)
+        state.close()
+
+    def test_compaction(self):
+        state = journal.Journal(self.filename, compact_records=5)
+        for i in range(6):
+            state.append({'a': i, 'b' + str(i % 2): i})
+        state.sync()
+        state.append({'c': 1})
+        state.close()
+
+        self.assertEqual(({'a': 5, 'b0': 4, 'b1': 5, 'c': 1}, 2, os.path.getsize(self.filename)),
+                         journal.replay(self.filename))
+        self.assertFalse(os.path.exists(self.filename + '.tmp'))
+
+
+if __name__ == '__main__':
+    unittest.main()
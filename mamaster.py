@@ -1,16 +1,33 @@
 #!/usr/bin/python3
+import asyncio
 import configparser
 import inspect
 import logging
 import datetime
 import os
-import sqlite3
 import sys
+import time
 
 from logging.handlers import RotatingFileHandler
 from time import sleep
 
 import ccxt
+import ccxt.async_support as ccxt_async
+
+import database
+from ratebuffer import RateBuffer, buffer_name, to_datetime, to_epoch
+
+RATES = {}
+EXCHANGES = {}
+SEMAPHORES = {}
+# gap repair running in the background of the asyncio ingest mode
+REPAIR = None
+# epoch seconds of the last sampled boundary
+SAMPLED = None
+JITTER = {'count': 0, 'total': 0.0, 'max': 0.0}
+# OHLCV timeframes used for backfilling, shortest first
+TIMEFRAMES = (('1m', 60), ('5m', 300), ('15m', 900), ('30m', 1800), ('1h', 3600))
+BACKFILL_LIMIT = 500
 
 
 class ExchangeConfig:
@@ -21,9 +38,18 @@ class ExchangeConfig:
         try:
             props = dict(config.items('config'))
             self.exchange = props['exchange'].strip('"').lower()
+            # symbols 'exchange:pair' to be ingested, the first one is the default for the bots
+            pairs = props.get('pairs', '').strip('"').replace(' ', '')
+            self.symbols = pairs.split(',') if pairs else [self.exchange + ':BTC/USD']
+            self.symbols = [symbol if ':' in symbol else self.exchange + ':' + symbol for symbol in self.symbols]
             self.db_name = props['db_name'].strip('"')
             self.interval = abs(int(props['interval']))
+            # optional sub-minute sampling, overrides the interval in minutes
+            self.interval_seconds = abs(int(props.get('interval_seconds', 0))) or self.interval * 60
             self.max_weeks = abs(int(props['max_weeks']))
+            self.rate_buffer = os.path.splitext(self.db_name)[0] + '.buf'
+            # concurrent requests per exchange, 0 fetches the tickers one after another
+            self.concurrency = abs(int(props.get('concurrency', 0)))
         except (configparser.NoSectionError, KeyError):
             raise SystemExit('Invalid configuration for ' + INSTANCE)
 
@@ -49,48 +75,161 @@ def function_logger(console_level: int, log_filename: str, file_level: int = Non
     return logger
 
 
-def get_current_price(tries: int = 0):
+def get_current_prices(exchange_name: str, pairs: list, tries: int = 0):
     """
-    Fetches the current BTC/USD exchange rate
+    Fetches the current exchange rates of the pairs traded on the exchange, with a single request if supported
     In case of failure, the function calls itself again until the max retry limit of 6 is reached
+    :param exchange_name: name of the exchange
+    :param pairs: the pairs to be fetched
     :param tries:
-    :return: int current market price
+    :return: dict pair: current market price or None
     """
     if tries > 5:
-        LOG.error('Failed fetching current price, giving up after 6 attempts')
+        LOG.error('Failed fetching current prices from %s, giving up after 6 attempts', exchange_name)
         return None
+    exchange = EXCHANGES[exchange_name]
     try:
-        return int(EXCHANGE.fetch_ticker('BTC/USD')['bid'])
+        if len(pairs) > 1 and exchange.has.get('fetchTickers'):
+            tickers = exchange.fetch_tickers(pairs)
+        else:
+            tickers = {pair: exchange.fetch_ticker(pair) for pair in pairs}
+        return to_prices(tickers, pairs)
 
     except (ccxt.ExchangeError, ccxt.NetworkError) as error:
         LOG.debug('Got an error %s %s, retrying in 5 seconds...', type(error).__name__, str(error.args))
         sleep(5)
-        get_current_price(tries + 1)
+        return get_current_prices(exchange_name, pairs, tries + 1)
+
+
+async def get_current_prices_async(exchange_name: str, pairs: list, tries: int = 0):
+    """
+    Fetches the current exchange rates of the pairs traded on the exchange without blocking the other exchanges.
+    The pairs are fetched with a single request if supported, otherwise concurrently up to the configured limit.
+    In case of failure, the function calls itself again until the max retry limit of 6 is reached
+    :param exchange_name: name of the exchange
+    :param pairs: the pairs to be fetched
+    :param tries:
+    :return: dict pair: current market price or None
+    """
+    if tries > 5:
+        LOG.error('Failed fetching current prices from %s, giving up after 6 attempts', exchange_name)
+        return None
+    exchange = EXCHANGES[exchange_name]
+    semaphore = SEMAPHORES[exchange_name]
+
+    async def fetch_ticker(pair: str):
+        async with semaphore:
+            return pair, await exchange.fetch_ticker(pair)
+
+    try:
+        if len(pairs) > 1 and exchange.has.get('fetchTickers'):
+            async with semaphore:
+                tickers = await exchange.fetch_tickers(pairs)
+        else:
+            tickers = dict(await asyncio.gather(*[fetch_ticker(pair) for pair in pairs]))
+        return to_prices(tickers, pairs)
+
+    except (ccxt.ExchangeError, ccxt.NetworkError) as error:
+        LOG.debug('Got an error %s %s, retrying in 5 seconds...', type(error).__name__, str(error.args))
+        await asyncio.sleep(5)
+        return await get_current_prices_async(exchange_name, pairs, tries + 1)
+
+
+def to_prices(tickers: dict, pairs: list):
+    """
+    :return: dict pair: rate of the fetched tickers
+    """
+    return {pair: to_rate(tickers[pair]['bid']) for pair in pairs if pair in tickers}
+
+
+def to_rate(price: float):
+    """
+    Rates are persisted as integers, unless that would lose the significant digits (e.g. ETH/BTC)
+    """
+    return int(price) if price >= 100 else price
+
+
+def get_pairs_by_exchange():
+    """
+    :return: dict exchange name: pairs to be fetched from it
+    """
+    pairs = {}
+    for symbol in CONF.symbols:
+        exchange_name, pair = symbol.split(':', 1)
+        pairs.setdefault(exchange_name, []).append(pair)
+    return pairs
 
 
-def connect_to_exchange():
-    exchanges = {'bitmex': ccxt.bitmex,
-                 'kraken': ccxt.kraken}
+def fetch_rates():
+    """
+    Fetches the current market prices of all symbols, exchange by exchange.
+    :return: dict symbol: price, set of the symbols with synthetic rates
+    """
+    return complete_rates({exchange_name: get_current_prices(exchange_name, pairs)
+                           for exchange_name, pairs in get_pairs_by_exchange().items()})
 
-    return exchanges[CONF.exchange]({
+
+async def fetch_rates_async():
+    """
+    Fetches the current market prices of all symbols from all exchanges concurrently,
+    so a cycle takes as long as the slowest exchange
+    :return: dict symbol: price, set of the symbols with synthetic rates
+    """
+    pairs = get_pairs_by_exchange()
+    prices = await asyncio.gather(*[get_current_prices_async(exchange_name, exchange_pairs)
+                                    for exchange_name, exchange_pairs in pairs.items()])
+    return complete_rates(dict(zip(pairs, prices)))
+
+
+def complete_rates(prices: dict):
+    """
+    Maps the fetched prices onto the symbols.
+    The last persisted rate is used for symbols whose price could not be fetched, these rates are synthetic.
+    :param prices: dict exchange name: dict pair: price or None
+    :return: dict symbol: price, set of the symbols with synthetic rates
+    """
+    rates = {}
+    synthetic = set()
+    for symbol in CONF.symbols:
+        exchange_name, pair = symbol.split(':', 1)
+        price = (prices.get(exchange_name) or {}).get(pair)
+        if price is None:
+            last = get_last_rates(1, symbol)
+            if last:
+                price = last[0][0]
+                synthetic.add(symbol)
+        if price is not None:
+            rates[symbol] = price
+    return rates, synthetic
+
+
+def connect_to_exchanges(library=ccxt):
+    """
+    Creates one connection per configured exchange
+    :param library: ccxt or ccxt.async_support
+    :return: dict exchange name: exchange
+    """
+    exchanges = {'bitmex': library.bitmex,
+                 'kraken': library.kraken}
+
+    return {exchange_name: exchanges[exchange_name]({
         'enableRateLimit': True,
-    })
+    }) for exchange_name in get_pairs_by_exchange()}
 
 
-def persist_rate(price: int):
+def persist_rates(rates: dict, now: datetime = None, synthetic: set = ()):
     """
-    Adds the current market price with the actual datetime to the database
-    :param price: The price to be persisted
+    Adds the current market prices with the sampling datetime to the database, all symbols within one transaction
+    :param rates: dict symbol: price
+    :param now: datetime (UTC) of the sample, the actual datetime if None
+    :param synthetic: symbols whose rate repeats the previous one
     """
-    now = datetime.datetime.utcnow().replace(microsecond=0)
-    conn = sqlite3.connect(CONF.db_name)
-    curs = conn.cursor()
-    query = "INSERT INTO rates VALUES ('{}', {})".format(now, price)
-    curs.execute(query)
-    conn.commit()
-    curs.close()
-    conn.close()
-    LOG.info(query)
+    now = now or datetime.datetime.utcnow().replace(microsecond=0)
+    database.insert_rates(database.connect(CONF.db_name), now, rates, synthetic)
+    LOG.info('Persisted rates %s %s', now, ' '.join('{} {}'.format(symbol, price) for symbol, price in rates.items()))
+    for symbol, price in rates.items():
+        if symbol in RATES:
+            RATES[symbol].append(to_epoch(now), price)
 
 
 def cleanup():
@@ -101,55 +240,406 @@ def cleanup():
 
 
 def delete_rates_older_than(date_time: datetime):
-    sql_date = date_time.replace(microsecond=0)
-    conn = sqlite3.connect(CONF.db_name, detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES)
-    curs = conn.cursor()
-    try:
-        curs.execute("DELETE FROM rates WHERE date_time < '{}' ".format(sql_date))
-        conn.commit()
-    finally:
-        curs.close()
-        conn.close()
+    database.delete_rates_older_than(database.connect(CONF.db_name), date_time.replace(microsecond=0))
 
 
 def init_database():
-    conn = sqlite3.connect(CONF.db_name)
-    curs = conn.cursor()
-    curs.execute("CREATE TABLE IF NOT EXISTS rates (date_time TEXT NOT NULL PRIMARY KEY, price INTEGER)")
-    conn.commit()
-    curs.close()
-    conn.close()
+    if database.init_schema(database.connect(CONF.db_name), CONF.symbols) == database.LEGACY_SCHEMA:
+        LOG.warning('%s uses the legacy schema, consider migrating it with: mamaster.py %s -migrate', CONF.db_name,
+                    INSTANCE)
+        if len(CONF.symbols) > 1:
+            LOG.warning('Only %s is persisted until the database is migrated', CONF.symbols[0])
+
+
+def migrate_database():
+    """
+    Migrates the rates to the integer epoch schema. An interrupted migration continues where it stopped.
+    """
+    LOG.info('Migrating %s', CONF.db_name)
+    migrated = database.migrate(database.connect(CONF.db_name), CONF.symbols)
+    LOG.info('Migrated %d rates', migrated)
+
+
+def rebuild_database():
+    """
+    Recalculates the rollups and the prefix sums of the rates, e.g. after manual repairs
+    """
+    LOG.info('Rebuilding %s', CONF.db_name)
+    database.rebuild(database.connect(CONF.db_name))
+    LOG.info('Finished')
 
 
-def get_last_rates(limit: int):
+def get_last_rates(limit: int, symbol: str = None):
     """
     Fetches the last x rates from the database
     :param limit: Number of rates to be fetched
+    :param symbol: symbol of the rates, the default one if None
     :return: The fetched results
     """
-    conn = sqlite3.connect(CONF.db_name, detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES)
-    curs = conn.cursor()
-    try:
-        return curs.execute("SELECT price FROM rates ORDER BY date_time DESC LIMIT {}".format(limit)).fetchall()
-    finally:
-        curs.close()
-        conn.close()
+    return database.last_rates(database.connect(CONF.db_name), limit, symbol)
+
+
+def get_rate_buffer_name(symbol: str):
+    """
+    :return: filename of the rate buffer of the symbol, the default symbol keeps the plain name
+    """
+    return CONF.rate_buffer if symbol == CONF.symbols[0] else buffer_name(CONF.rate_buffer, symbol)
+
+
+def init_rate_buffers():
+    """
+    Opens the shared rate buffers read by the bot instances and fills them from the database if they are out of date
+    :return dict: symbol: RateBuffer
+    """
+    capacity = CONF.max_weeks * 7 * 24 * 60 * 60 // CONF.interval_seconds
+    buffers = {}
+    for symbol in CONF.symbols:
+        buffer = RateBuffer(get_rate_buffer_name(symbol), capacity)
+        rates = get_last_rates(capacity, symbol)
+        newest = buffer.last(1)
+        if rates and (not newest or newest[0][1] != to_epoch(rates[0][1])):
+            buffer = replace_rate_buffer(buffer, rates)
+        buffers[symbol] = buffer
+    return buffers
+
+
+def fill_rate_buffer(buffer: RateBuffer, rates: list):
+    """
+    Replaces the content of the rate buffer
+    :param buffer: the rate buffer
+    :param rates: list of (price, key) ordered newest first
+    """
+    LOG.info('Filling rate buffer %s with %d rates', buffer.filename, len(rates))
+    buffer.clear()
+    for rate in reversed(rates):
+        buffer.append(to_epoch(rate[1]), rate[0])
+
+
+def replace_rate_buffer(buffer: RateBuffer, rates: list):
+    """
+    Fills a new rate buffer file and swaps it in. Rates within the windows of the bots may have changed, the bots
+    notice the replaced file via is_stale() and recalculate their moving averages.
+    :param buffer: the rate buffer, it is closed
+    :param rates: list of (price, key) ordered newest first
+    :return RateBuffer: the new rate buffer
+    """
+    filename = buffer.filename
+    capacity = buffer.capacity
+    staging = RateBuffer(filename + '.new', capacity)
+    fill_rate_buffer(staging, rates)
+    staging.close()
+    buffer.close()
+    os.replace(filename + '.new', filename)
+    return RateBuffer(filename, capacity)
+
+
+def get_timeframe(exchange):
+    """
+    Chooses the longest OHLCV timeframe of the exchange the sampling interval is a multiple of
+    :return: timeframe and its length in seconds or None if there is none
+    """
+    timeframes = [(timeframe, seconds) for timeframe, seconds in TIMEFRAMES
+                  if timeframe in (exchange.timeframes or {}) and CONF.interval_seconds % seconds == 0]
+    return timeframes[-1] if timeframes else None
+
 
+def fetch_historic_rates(exchange, pair: str, epochs: list):
+    """
+    Fetches the opening prices of the candles starting at the given boundaries, in as few requests as possible
+    :param exchange: the exchange
+    :param pair: the pair to be fetched
+    :param epochs: ordered list of epoch seconds of the boundaries
+    :return: list of (epoch seconds, price)
+    """
+    timeframe = get_timeframe(exchange)
+    if timeframe is None:
+        LOG.warning('%s offers no OHLCV data for an interval of %d seconds', exchange.id, CONF.interval_seconds)
+        return []
+    wanted = set(epochs)
+    rates = []
+    index = 0
+    while index < len(epochs):
+        try:
+            candles = exchange.fetch_ohlcv(pair, timeframe[0], epochs[index] * 1000, BACKFILL_LIMIT)
+        except (ccxt.ExchangeError, ccxt.NetworkError) as error:
+            LOG.warning('Failed fetching OHLCV data of %s %s %s', pair, type(error).__name__, str(error.args))
+            break
+        index = add_candles(rates, wanted, epochs, index, candles, timeframe[1])
+    return rates
+
+
+async def fetch_historic_rates_async(exchange_name: str, pair: str, epochs: list):
+    """
+    Like fetch_historic_rates, but with the async exchange, so the samples of the other exchanges are not held up
+    :param exchange_name: name of the exchange
+    :param pair: the pair to be fetched
+    :param epochs: ordered list of epoch seconds of the boundaries
+    :return: list of (epoch seconds, price)
+    """
+    exchange = EXCHANGES[exchange_name]
+    timeframe = get_timeframe(exchange)
+    if timeframe is None:
+        LOG.warning('%s offers no OHLCV data for an interval of %d seconds', exchange.id, CONF.interval_seconds)
+        return []
+    wanted = set(epochs)
+    rates = []
+    index = 0
+    while index < len(epochs):
+        try:
+            async with SEMAPHORES[exchange_name]:
+                candles = await exchange.fetch_ohlcv(pair, timeframe[0], epochs[index] * 1000, BACKFILL_LIMIT)
+        except (ccxt.ExchangeError, ccxt.NetworkError) as error:
+            LOG.warning('Failed fetching OHLCV data of %s %s %s', pair, type(error).__name__, str(error.args))
+            break
+        index = add_candles(rates, wanted, epochs, index, candles, timeframe[1])
+    return rates
+
+
+def add_candles(rates: list, wanted: set, epochs: list, index: int, candles: list, length: int):
+    """
+    Adds the opening prices of the candles starting at the wanted boundaries to the rates
+    :param rates: list of (epoch seconds, price) to be extended
+    :param wanted: set of the epoch seconds of the wanted boundaries
+    :param epochs: ordered list of epoch seconds of the wanted boundaries
+    :param index: index of the boundary the candles have been fetched from
+    :param candles: the received candles
+    :param length: length of the candles in seconds
+    :return: int index of the first boundary not covered by the received candles
+    """
+    rates.extend((candle[0] // 1000, to_rate(candle[1])) for candle in candles if candle[0] // 1000 in wanted)
+    start = epochs[index]
+    covered = candles[-1][0] // 1000 if candles else start + BACKFILL_LIMIT * length
+    while index < len(epochs) and epochs[index] <= max(covered, start):
+        index += 1
+    return index
+
+
+def find_repairs(conn, weeks: int = None):
+    """
+    :param weeks: period to be repaired, by default the whole retention period
+    :return: list of (symbol, ordered list of epoch seconds of its missing and synthetic rates)
+    """
+    until = next_boundary(time.time()) - CONF.interval_seconds
+    since = until - (weeks or CONF.max_weeks) * 7 * 24 * 60 * 60
+    repairs = []
+    for symbol in CONF.symbols:
+        epochs = sorted(database.find_gaps(conn, symbol, since, until, CONF.interval_seconds) +
+                        database.synthetic_rates(conn, symbol, since))
+        if epochs:
+            LOG.info('Repairing %d rates of %s', len(epochs), symbol)
+            repairs.append((symbol, epochs))
+    return repairs
+
+
+def store_repairs(conn, symbol: str, rates: list):
+    """
+    Persists the fetched historic rates and replaces the rate buffer of the symbol if rates have been repaired
+    :return: int number of repaired rates
+    """
+    count = database.backfill_rates(conn, symbol, rates)
+    LOG.info('Repaired %d rates of %s', count, symbol)
+    if count and symbol in RATES:
+        RATES[symbol] = replace_rate_buffer(RATES[symbol], get_last_rates(RATES[symbol].capacity, symbol))
+    return count
 
-def do_work():
+
+def repair_gaps(weeks: int = None):
+    """
+    Fills the missing intervals and replaces the synthetic rates with the OHLCV data of the exchanges.
+    A newly added pair gets its whole history.
+    :param weeks: period to be repaired, by default the whole retention period
+    :return: int number of repaired rates
+    """
+    conn = database.connect(CONF.db_name)
+    if database.schema_version(conn) < database.SYNTHETIC_SCHEMA:
+        return 0
+    repairs = find_repairs(conn, weeks)
+    exchanges = connect_to_exchanges() if repairs else {}
+    repaired = 0
+    for symbol, epochs in repairs:
+        exchange_name, pair = symbol.split(':', 1)
+        repaired += store_repairs(conn, symbol, fetch_historic_rates(exchanges[exchange_name], pair, epochs))
+    return repaired
+
+
+async def repair_gaps_async(weeks: int = None):
+    """
+    Like repair_gaps, but fetches the OHLCV data with the async exchanges of the main loop.
+    It runs as a task beside the sampling, the rates are persisted from the event loop like the samples.
+    :param weeks: period to be repaired, by default the whole retention period
+    :return: int number of repaired rates
+    """
+    conn = database.connect(CONF.db_name)
+    if database.schema_version(conn) < database.SYNTHETIC_SCHEMA:
+        return 0
+    repaired = 0
+    for symbol, epochs in find_repairs(conn, weeks):
+        exchange_name, pair = symbol.split(':', 1)
+        repaired += store_repairs(conn, symbol, await fetch_historic_rates_async(exchange_name, pair, epochs))
+    return repaired
+
+
+def log_repair_failure(task: asyncio.Task):
+    if not task.cancelled() and task.exception() is not None:
+        LOG.error('Failed repairing gaps %s', repr(task.exception()))
+
+
+def do_work(boundary: int):
     """
-    Fetches the current market price, persists it and waits for a minute.
-    It is called from the main loop every X minutes
-    If the current market price can not be fetched, then it writes the previous price with the actual datetime,
-    preventing gaps in the database.
+    Fetches the current market prices and persists them with the datetime of the interval boundary.
+    It is called from the main loop at every interval boundary
+    If a current market price can not be fetched, then it writes the previous price with the sampling datetime,
+    preventing gaps in the database. Such synthetic rates and real gaps of the last week are repaired once a day.
     Every first day of the month old entries are purged from the database
+    :param boundary: epoch seconds of the interval boundary
     """
-    rate = get_current_price()
-    if rate is None:
-        rate = get_last_rates(1)[0][0]
-    persist_rate(rate)
+    global NOW, SAMPLED
+
+    NOW = to_datetime(boundary)
+    new_day = is_new_day(boundary)
+    SAMPLED = boundary
+    rates, synthetic = fetch_rates()
+    if rates:
+        persist_rates(rates, NOW, synthetic)
     cleanup()
-    sleep(60)
+    if new_day:
+        repair_gaps(1)
+
+
+async def do_work_async(boundary: int):
+    """
+    Like do_work, but fetches the prices of all exchanges concurrently.
+    The daily gap repair runs as a task beside the sampling instead of holding it up.
+    """
+    global NOW, REPAIR, SAMPLED
+
+    NOW = to_datetime(boundary)
+    new_day = is_new_day(boundary)
+    SAMPLED = boundary
+    rates, synthetic = await fetch_rates_async()
+    if rates:
+        persist_rates(rates, NOW, synthetic)
+    cleanup()
+    if new_day and (REPAIR is None or REPAIR.done()):
+        REPAIR = asyncio.create_task(repair_gaps_async(1))
+        REPAIR.add_done_callback(log_repair_failure)
+
+
+def is_new_day(boundary: int):
+    """
+    Tells whether the boundary is the first one sampled on its day (UTC), also if the interval does not divide a day
+    or the sample at midnight has been skipped
+    :param boundary: epoch seconds of the interval boundary
+    :return: True if the day rolled over since the last sampled boundary
+    """
+    return SAMPLED is not None and boundary // 86400 != SAMPLED // 86400
+
+
+def next_boundary(timestamp: float):
+    """
+    :param timestamp: epoch seconds
+    :return: int epoch seconds of the first interval boundary after the timestamp
+    """
+    return int(timestamp // CONF.interval_seconds + 1) * CONF.interval_seconds
+
+
+def schedule(previous: int):
+    """
+    Determines the next boundary to be sampled. If the last cycle overran the following boundary,
+    the most recent missed boundary is returned to be caught up immediately.
+    :param previous: epoch seconds of the last sampled boundary
+    :return: int epoch seconds of the boundary
+    """
+    following = previous + CONF.interval_seconds
+    now = time.time()
+    if now < following:
+        return following
+    missed = int((now - previous) // CONF.interval_seconds)
+    if missed > 1:
+        LOG.warning('Skipped %d samples', missed - 1)
+    LOG.info('Catching up sample of %s', to_datetime(previous + missed * CONF.interval_seconds))
+    return previous + missed * CONF.interval_seconds
+
+
+def get_deadline(boundary: int):
+    """
+    :return: float seconds until the wall clock reaches the boundary, as a deadline on the monotonic clock
+    """
+    return time.monotonic() + boundary - time.time()
+
+
+def sleep_until(boundary: int):
+    """
+    Sleeps until the boundary is reached. The deadline is measured with the monotonic clock,
+    so adjustments of the system clock do not shorten or stretch the sleep.
+    :param boundary: epoch seconds of the interval boundary
+    """
+    deadline = get_deadline(boundary)
+    remaining = deadline - time.monotonic()
+    while remaining > 0:
+        sleep(remaining)
+        remaining = deadline - time.monotonic()
+    record_jitter(boundary)
+
+
+async def sleep_until_async(boundary: int):
+    deadline = get_deadline(boundary)
+    remaining = deadline - time.monotonic()
+    while remaining > 0:
+        await asyncio.sleep(remaining)
+        remaining = deadline - time.monotonic()
+    record_jitter(boundary)
+
+
+def record_jitter(boundary: int):
+    """
+    Records how late the sample is taken, reporting mean and max with the first sample of a day.
+    It is called before the sample is taken, so the day rollover is detected against the previous sample.
+    :param boundary: epoch seconds of the interval boundary
+    """
+    jitter = time.time() - boundary
+    JITTER['count'] += 1
+    JITTER['total'] += jitter
+    JITTER['max'] = max(JITTER['max'], jitter)
+    LOG.debug('Sampling jitter %.3f s', jitter)
+    if is_new_day(boundary):
+        LOG.info('Sampling jitter mean/max: %.3f/%.3f s of %d samples', JITTER['total'] / JITTER['count'],
+                 JITTER['max'], JITTER['count'])
+        JITTER.update({'count': 0, 'total': 0.0, 'max': 0.0})
+
+
+def run():
+    """
+    Main loop, samples at every interval boundary
+    """
+    global EXCHANGES
+
+    EXCHANGES = connect_to_exchanges()
+    boundary = next_boundary(time.time())
+    while 1:
+        sleep_until(boundary)
+        do_work(boundary)
+        boundary = schedule(boundary)
+
+
+async def run_async():
+    """
+    Main loop of the asyncio ingest mode
+    """
+    global EXCHANGES, SEMAPHORES
+
+    EXCHANGES = connect_to_exchanges(ccxt_async)
+    SEMAPHORES = {exchange_name: asyncio.Semaphore(CONF.concurrency) for exchange_name in EXCHANGES}
+    try:
+        boundary = next_boundary(time.time())
+        while 1:
+            await sleep_until_async(boundary)
+            await do_work_async(boundary)
+            boundary = schedule(boundary)
+    finally:
+        if REPAIR is not None:
+            REPAIR.cancel()
+        await asyncio.gather(*[exchange.close() for exchange in EXCHANGES.values()])
 
 
 def write_control_file():
@@ -167,13 +657,20 @@ if __name__ == "__main__":
     LOG.info('-------------------------------')
     write_control_file()
     CONF = ExchangeConfig()
-    EXCHANGE = connect_to_exchange()
-
+    if len(sys.argv) > 2 and sys.argv[2] == '-migrate':
+        migrate_database()
+        sys.exit(0)
+    if len(sys.argv) > 2 and sys.argv[2] == '-rebuild':
+        rebuild_database()
+        sys.exit(0)
     init_database()
-
-    while 1:
-        NOW = datetime.datetime.utcnow()
-        MINUTE = NOW.minute
-        if MINUTE % CONF.interval == 0:
-            do_work()
-        sleep(10)
+    if len(sys.argv) > 2 and sys.argv[2] == '-backfill':
+        LOG.info('Backfilled %d rates', repair_gaps())
+        sys.exit(0)
+    RATES = init_rate_buffers()
+    repair_gaps()
+
+    if CONF.concurrency:
+        asyncio.run(run_async())
+    else:
+        run()
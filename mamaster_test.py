@@ -1,6 +1,10 @@
+import asyncio
 import unittest
 import datetime
-from unittest.mock import patch
+import os
+import sqlite3
+import tempfile
+from unittest.mock import AsyncMock, patch
 
 import mamaster
 
@@ -8,20 +12,76 @@ import mamaster
 class MamasterTest(unittest.TestCase):
 
     @patch('ccxt.bitmex')
-    def test_get_current_price(self, mock_bitmex):
+    def test_get_current_prices(self, mock_bitmex):
         mamaster.CONF = self.create_default_conf()
-        mamaster.EXCHANGE = mock_bitmex
-        mamaster.get_current_price()
+        mamaster.EXCHANGES = {'bitmex': mock_bitmex}
+        mock_bitmex.fetch_ticker.return_value = {'bid': 9000.5}
 
-        mock_bitmex.fetch_ticker.assert_called()
+        self.assertEqual({'BTC/USD': 9000}, mamaster.get_current_prices('bitmex', ['BTC/USD']))
+        mock_bitmex.fetch_ticker.assert_called_with('BTC/USD')
 
+    @patch('ccxt.kraken')
+    def test_get_current_prices_batched(self, mock_kraken):
+        mamaster.EXCHANGES = {'kraken': mock_kraken}
+        mock_kraken.has = {'fetchTickers': True}
+        mock_kraken.fetch_tickers.return_value = {'BTC/USD': {'bid': 9000.5}, 'ETH/BTC': {'bid': 0.025}}
+
+        prices = mamaster.get_current_prices('kraken', ['BTC/USD', 'ETH/BTC'])
+
+        self.assertEqual({'BTC/USD': 9000, 'ETH/BTC': 0.025}, prices)
+        mock_kraken.fetch_tickers.assert_called_once_with(['BTC/USD', 'ETH/BTC'])
+        mock_kraken.fetch_ticker.assert_not_called()
+
+    @patch('mamaster.get_last_rates')
     @patch('mamaster.logging')
-    def test_get_current_price_too_may_times(self, mock_logging):
+    def test_fetch_rates_async(self, mock_logging, mock_get_last_rates):
+        mamaster.CONF = self.create_default_conf()
+        mamaster.CONF.symbols = ['bitmex:BTC/USD', 'bitmex:ETH/USD', 'kraken:BTC/USD', 'kraken:ETH/USD']
         mamaster.LOG = mock_logging
-        mamaster.get_current_price(7)
+        bitmex = AsyncMock()
+        bitmex.has = {'fetchTickers': False}
+        bitmex.fetch_ticker.side_effect = lambda pair: {'bid': {'BTC/USD': 9000.5, 'ETH/USD': 200.25}[pair]}
+        kraken = AsyncMock()
+        kraken.has = {'fetchTickers': True}
+        kraken.fetch_tickers.side_effect = mamaster.ccxt.NetworkError('timeout')
+        mock_get_last_rates.side_effect = lambda limit, symbol: [(8999, 1588291200)] if symbol == 'kraken:BTC/USD' else []
+        mamaster.EXCHANGES = {'bitmex': bitmex, 'kraken': kraken}
+
+        async def fetch_rates():
+            mamaster.SEMAPHORES = {'bitmex': asyncio.Semaphore(1), 'kraken': asyncio.Semaphore(1)}
+            with patch('mamaster.asyncio.sleep', AsyncMock()):
+                return await mamaster.fetch_rates_async()
+
+        rates, synthetic = asyncio.run(fetch_rates())
 
+        self.assertEqual({'bitmex:BTC/USD': 9000, 'bitmex:ETH/USD': 200, 'kraken:BTC/USD': 8999}, rates)
+        self.assertEqual({'kraken:BTC/USD'}, synthetic)
+        self.assertEqual(2, bitmex.fetch_ticker.await_count)
+        self.assertEqual(6, kraken.fetch_tickers.await_count)
         mock_logging.error.assert_called()
 
+    @patch('mamaster.logging')
+    def test_get_current_prices_too_may_times(self, mock_logging):
+        mamaster.LOG = mock_logging
+        mamaster.get_current_prices('bitmex', ['BTC/USD'], 7)
+
+        mock_logging.error.assert_called()
+
+    @patch('mamaster.get_last_rates')
+    @patch('mamaster.get_current_prices')
+    def test_fetch_rates(self, mock_get_current_prices, mock_get_last_rates):
+        mamaster.CONF = self.create_default_conf()
+        mamaster.CONF.symbols = ['bitmex:BTC/USD', 'kraken:BTC/USD', 'kraken:ETH/USD']
+        mock_get_current_prices.side_effect = lambda exchange, pairs: {'bitmex': None, 'kraken': {'BTC/USD': 9001}}[
+            exchange]
+        mock_get_last_rates.side_effect = lambda limit, symbol: [(8999, 1588291200)] if symbol == 'bitmex:BTC/USD' else []
+
+        rates, synthetic = mamaster.fetch_rates()
+
+        self.assertEqual({'bitmex:BTC/USD': 8999, 'kraken:BTC/USD': 9001}, rates)
+        self.assertEqual({'bitmex:BTC/USD'}, synthetic)
+        mock_get_current_prices.assert_any_call('kraken', ['BTC/USD', 'ETH/USD'])
+
     @patch('mamaster.logging')
     @patch('mamaster.delete_rates_older_than')
     def test_cleanup(self, mock_delete_rates_older_than, mock_logging):
@@ -44,11 +104,233 @@ class MamasterTest(unittest.TestCase):
 
         mock_delete_rates_older_than.assert_not_called()
 
+    @patch('mamaster.logging')
+    def test_init_rate_buffers(self, mock_logging):
+        mamaster.CONF = self.create_default_conf()
+        mamaster.LOG = mock_logging
+        with tempfile.TemporaryDirectory() as directory:
+            mamaster.CONF.db_name = os.path.join(directory, 'mamaster.db')
+            mamaster.CONF.rate_buffer = os.path.join(directory, 'mamaster.buf')
+            conn = sqlite3.connect(mamaster.CONF.db_name)
+            conn.execute("CREATE TABLE rates (date_time TEXT NOT NULL PRIMARY KEY, price INTEGER)")
+            conn.executemany("INSERT INTO rates VALUES (?, ?)", [('2020-05-01 00:00:00', 9000), ('2020-05-01 00:10:00', 9100)])
+            conn.commit()
+            conn.close()
+
+            buffers = mamaster.init_rate_buffers()
+
+            self.assertEqual([(9100, 1588291800), (9000, 1588291200)], buffers['bitmex:BTC/USD'].last(2))
+            buffers['bitmex:BTC/USD'].close()
+            mamaster.database.close(mamaster.CONF.db_name)
+
+    @patch('mamaster.logging')
+    def test_replace_rate_buffer(self, mock_logging):
+        mamaster.LOG = mock_logging
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'mamaster.buf')
+            buffer = mamaster.RateBuffer(filename, 4)
+            buffer.append(1588291200, 9000)
+            buffer.append(1588291800, 9000)
+            reader = mamaster.RateBuffer(filename)
+
+            buffer = mamaster.replace_rate_buffer(buffer, [(9200, 1588291800), (9100, 1588291200)])
+
+            self.assertTrue(reader.is_stale())
+            self.assertEqual([(9200, 1588291800), (9100, 1588291200)], buffer.last(2))
+            self.assertFalse(os.path.exists(filename + '.new'))
+            reader.close()
+            buffer.close()
+
+    @patch('mamaster.logging')
+    def test_persist_rates_of_several_symbols(self, mock_logging):
+        mamaster.CONF = self.create_default_conf()
+        mamaster.CONF.symbols = ['bitmex:BTC/USD', 'kraken:ETH/USD']
+        mamaster.LOG = mock_logging
+        with tempfile.TemporaryDirectory() as directory:
+            mamaster.CONF.db_name = os.path.join(directory, 'mamaster.db')
+            mamaster.CONF.rate_buffer = os.path.join(directory, 'mamaster.buf')
+            mamaster.init_database()
+            mamaster.RATES = mamaster.init_rate_buffers()
+
+            mamaster.persist_rates({'bitmex:BTC/USD': 9000, 'kraken:ETH/USD': 200.5})
+
+            self.assertEqual(9000, mamaster.get_last_rates(1)[0][0])
+            self.assertEqual(200.5, mamaster.get_last_rates(1, 'kraken:ETH/USD')[0][0])
+            self.assertTrue(os.path.isfile(os.path.join(directory, 'mamaster-kraken-ETH-USD.buf')))
+            self.assertEqual(200.5, mamaster.RATES['kraken:ETH/USD'].last(1)[0][0])
+            for buffer in mamaster.RATES.values():
+                buffer.close()
+            mamaster.RATES = {}
+            mamaster.database.close(mamaster.CONF.db_name)
+
+    @patch('ccxt.kraken')
+    @patch('mamaster.logging')
+    def test_fetch_historic_rates(self, mock_logging, mock_kraken):
+        mamaster.CONF = self.create_default_conf()
+        mamaster.LOG = mock_logging
+        mamaster.BACKFILL_LIMIT = 4
+        mock_kraken.timeframes = {'1m': '1', '5m': '5', '1h': '60'}
+        start = 1588291200
+        candles = [[(start + 300 * i) * 1000, 9000 + i, 0, 0, 0, 0] for i in range(40)]
+        mock_kraken.fetch_ohlcv.side_effect = lambda pair, timeframe, since, limit: [
+            candle for candle in candles if candle[0] >= since][:limit]
+
+        rates = mamaster.fetch_historic_rates(mock_kraken, 'BTC/USD', [start, start + 600, start + 6000, start + 6600])
+
+        self.assertEqual([(start, 9000), (start + 600, 9002), (start + 6000, 9020), (start + 6600, 9022)], rates)
+        self.assertEqual(2, mock_kraken.fetch_ohlcv.call_count)
+        mock_kraken.fetch_ohlcv.assert_called_with('BTC/USD', '5m', (start + 6000) * 1000, 4)
+        mamaster.BACKFILL_LIMIT = 500
+
+    @patch('mamaster.logging')
+    def test_fetch_historic_rates_async(self, mock_logging):
+        mamaster.CONF = self.create_default_conf()
+        mamaster.LOG = mock_logging
+        mamaster.BACKFILL_LIMIT = 4
+        kraken = AsyncMock()
+        kraken.timeframes = {'1m': '1', '5m': '5', '1h': '60'}
+        start = 1588291200
+        candles = [[(start + 300 * i) * 1000, 9000 + i, 0, 0, 0, 0] for i in range(40)]
+        kraken.fetch_ohlcv.side_effect = lambda pair, timeframe, since, limit: [
+            candle for candle in candles if candle[0] >= since][:limit]
+        mamaster.EXCHANGES = {'kraken': kraken}
+
+        async def fetch_historic_rates():
+            mamaster.SEMAPHORES = {'kraken': asyncio.Semaphore(1)}
+            return await mamaster.fetch_historic_rates_async('kraken', 'BTC/USD', [start, start + 600, start + 6000])
+
+        rates = asyncio.run(fetch_historic_rates())
+
+        self.assertEqual([(start, 9000), (start + 600, 9002), (start + 6000, 9020)], rates)
+        self.assertEqual(2, kraken.fetch_ohlcv.await_count)
+        mamaster.BACKFILL_LIMIT = 500
+
+    @patch('mamaster.repair_gaps_async')
+    @patch('mamaster.persist_rates')
+    @patch('mamaster.fetch_rates_async')
+    @patch('mamaster.logging')
+    def test_do_work_async_repairs_gaps_beside_sampling(self, mock_logging, mock_fetch_rates_async,
+                                                         mock_persist_rates, mock_repair_gaps_async):
+        mamaster.CONF = self.create_default_conf()
+        mamaster.LOG = mock_logging
+        mock_fetch_rates_async.return_value = ({'bitmex:BTC/USD': 9000}, set())
+        repairing = {}
+
+        async def repair_gaps(weeks):
+            repairing['event'] = asyncio.Event()
+            await repairing['event'].wait()
+            return 1
+
+        mock_repair_gaps_async.side_effect = repair_gaps
+
+        mamaster.SAMPLED = 1588291200 - 600
+
+        async def work():
+            await mamaster.do_work_async(1588291200)
+            await asyncio.sleep(0)
+            task = mamaster.REPAIR
+            self.assertFalse(task.done())
+            await mamaster.do_work_async(1588377600)
+            self.assertIs(task, mamaster.REPAIR)
+            self.assertEqual(2, mock_persist_rates.call_count)
+            repairing['event'].set()
+            return await task
+
+        self.assertEqual(1, asyncio.run(work()))
+        mock_repair_gaps_async.assert_called_once_with(1)
+        mamaster.REPAIR = None
+        mamaster.SAMPLED = None
+
+    @patch('mamaster.repair_gaps')
+    @patch('mamaster.cleanup')
+    @patch('mamaster.fetch_rates', return_value=({}, set()))
+    def test_do_work_repairs_gaps_on_day_rollover(self, mock_fetch_rates, mock_cleanup, mock_repair_gaps):
+        mamaster.CONF = self.create_default_conf()
+        mamaster.CONF.interval_seconds = 420
+        midnight = 1588291200
+        repaired = []
+        mock_repair_gaps.side_effect = lambda weeks: repaired.append(mamaster.NOW)
+
+        for boundary in range(midnight - 86400, midnight + 86400, 420):
+            mamaster.do_work(boundary)
+
+        # 420 seconds do not divide a day, the first sample of the day is taken 2 minutes after midnight
+        self.assertEqual([datetime.datetime(2020, 5, 1, 0, 2)], repaired)
+        mock_repair_gaps.assert_called_once_with(1)
+        mamaster.CONF.interval_seconds = 600
+        mamaster.SAMPLED = None
+
+    def test_next_boundary(self):
+        mamaster.CONF = self.create_default_conf()
+
+        self.assertEqual(1588291800, mamaster.next_boundary(1588291200))
+        self.assertEqual(1588291800, mamaster.next_boundary(1588291799.9))
+
+        mamaster.CONF.interval_seconds = 30
+
+        self.assertEqual(1588291230, mamaster.next_boundary(1588291201.5))
+        mamaster.CONF.interval_seconds = 600
+
+    @patch('mamaster.time')
+    @patch('mamaster.logging')
+    def test_schedule(self, mock_logging, mock_time):
+        mamaster.CONF = self.create_default_conf()
+        mamaster.LOG = mock_logging
+        mock_time.time.return_value = 1588291200 + 20
+
+        self.assertEqual(1588291800, mamaster.schedule(1588291200))
+        mock_logging.info.assert_not_called()
+
+        mock_time.time.return_value = 1588291200 + 1900
+
+        self.assertEqual(1588292900, mamaster.schedule(1588291200 + 500))
+        mock_logging.warning.assert_called_with('Skipped %d samples', 1)
+        mock_logging.info.assert_called()
+
+    @patch('mamaster.sleep')
+    @patch('mamaster.time')
+    @patch('mamaster.logging')
+    def test_sleep_until_records_jitter(self, mock_logging, mock_time, mock_sleep):
+        mamaster.LOG = mock_logging
+        mamaster.JITTER = {'count': 0, 'total': 0.0, 'max': 0.0}
+        clock = {'monotonic': 100.0, 'time': 1588291795.0}
+
+        def sleep(seconds):
+            clock['monotonic'] += seconds
+            clock['time'] += seconds + 0.25
+
+        mock_sleep.side_effect = sleep
+        mock_time.monotonic.side_effect = lambda: clock['monotonic']
+        mock_time.time.side_effect = lambda: clock['time']
+
+        mamaster.sleep_until(1588291800)
+
+        mock_sleep.assert_called_once_with(5.0)
+        self.assertEqual({'count': 1, 'total': 0.25, 'max': 0.25}, mamaster.JITTER)
+        mock_logging.info.assert_not_called()
+
+    @patch('mamaster.time')
+    @patch('mamaster.logging')
+    def test_record_jitter_reports_on_day_rollover(self, mock_logging, mock_time):
+        mamaster.LOG = mock_logging
+        mamaster.JITTER = {'count': 0, 'total': 0.0, 'max': 0.0}
+        mamaster.SAMPLED = 1588291200 - 300
+        mock_time.time.return_value = 1588291200 + 120.5
+
+        mamaster.record_jitter(1588291200 + 120)
+
+        mock_logging.info.assert_called_once()
+        self.assertEqual({'count': 0, 'total': 0.0, 'max': 0.0}, mamaster.JITTER)
+        mamaster.SAMPLED = None
+
     @staticmethod
     def create_default_conf():
         conf = mamaster.ExchangeConfig
         conf.exchange = 'bitmex'
+        conf.symbols = ['bitmex:BTC/USD']
         conf.max_weeks = 52
+        conf.interval = 10
+        conf.interval_seconds = 600
         return conf
 
 
@@ -1,36 +1,111 @@
 #!/usr/bin/python3
+import base64
+import concurrent.futures
 import configparser
+import copy
 import datetime
+import functools
+import gzip
+import importlib.util
 import inspect
+import json
 import logging
 import os
 import pickle
 import random
-import smtplib
+import shutil
 import socket
 import sqlite3
 import sys
+import threading
 import time
+import zlib
 from math import floor
 from time import sleep
-from email import encoders
-from email.mime.base import MIMEBase
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
 from logging.handlers import RotatingFileHandler
 
-import ccxt
-import requests
+import database
+import journal
+import orders
+from ratebuffer import RateBuffer, buffer_name, to_datetime, to_epoch
+
+
+def lazy_import(name: str):
+    """
+    Registers a module whose import is deferred until one of its attributes is accessed
+    :param name: name of the module
+    :return the module
+    """
+    module = sys.modules.get(name)
+    if module is None:
+        spec = importlib.util.find_spec(name)
+        spec.loader = importlib.util.LazyLoader(spec.loader)
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[name] = module
+        spec.loader.exec_module(module)
+    return module
+
+
+# ccxt loads all its exchanges at once, the bot only needs it to trade or to report
+ccxt = lazy_import('ccxt')
+requests = lazy_import('requests')
 
 MIN_ORDER_SIZE = 0.001
 STATE = {'last_action': None, 'order': None, 'stop_loss_order': None, 'stop_loss_price': None}
+JOURNAL = None
 STATS = None
+MAS = None
+# attempts to read both moving average windows ending with the same rate before falling back to the database
+MA_SEED_ATTEMPTS = 3
+RATE_BUFFER = None
+RATE_SYMBOL = None
+# responses of the private account endpoints, shared within a loop iteration or a report
+ACCOUNT = None
+# pair: (monotonic time, ticker)
+TICKERS = {}
+TICKER_STATS = {'hits': 0, 'misses': 0}
 EMAIL_SENT = False
 EMAIL_ONLY = False
 RESET = False
 STOP_ERRORS = ['nsufficient', 'too low', 'not_enough', 'margin_below', 'liquidation price', 'closed_already', 'zero margin']
 ACCOUNT_ERRORS = ['account has been disabled', 'key is disabled', 'authentication failed', 'permission denied']
 RETRY_MESSAGE = 'Got an error %s %s, retrying in about 5 seconds...'
+# seconds the report waits for its data, per part if listed
+REPORT_TIMEOUT = 30
+REPORT_TIMEOUTS = {'mayer': 15}
+# deadline of the report part collected by the current thread, the retries stop once it has passed
+REPORT_DEADLINE = threading.local()
+# exchange connection of the report threads, separate from the one of the main loop
+REPORT_EXCHANGE = threading.local()
+MAYER_URL = 'https://mayermultiple.info/current.json'
+MAYER_DAYS = 200
+# seconds the Mayer multiple of mayermultiple.info is cached
+MAYER_TTL = 6 * 60 * 60
+# deviation of the local from the remote Mayer multiple that is logged
+MAYER_TOLERANCE = 0.05
+# seconds per SMTP operation, an unused connection is kept open and the first and the longest delay of a retry
+MAIL_TIMEOUT = 30
+MAIL_IDLE = 60
+MAIL_BACKOFF = (30, 3600)
+MAIL_WAKEUP = threading.Event()
+MAIL_WORKER = None
+# closed orders fetched per request when the order ledger is synced
+ORDER_PAGE = 100
+FLEET_STORE = 'fleet'
+# the fleet reports are collected in slots spread over 14 minutes from 12:01 UTC and consolidated from 12:18 UTC
+FLEET_SLOTS = 14 * 60
+FLEET_AGGREGATION = datetime.time(12, 18, 0)
+FLEET_AGGREGATED = None
+ACCOUNT_LOCKS = {}
+ACCOUNT_LOCK = threading.Lock()
+# modules loaded on demand, see profile_startup
+DEFERRED_MODULES = ('ccxt', 'requests', 'smtplib', 'email.mime.multipart')
+
+
+class ReportTimeout(Exception):
+    """
+    Raised instead of retrying in a thread collecting report data the report no longer waits for
+    """
 
 
 class ExchangeConfig:
@@ -65,6 +140,18 @@ class ExchangeConfig:
             self.base = currency[0]
             self.quote = currency[1]
             self.database = 'mamaster.db'
+            self.rate_buffer = 'mamaster.buf'
+            # rates ingested by mamaster ('exchange:pair') the moving averages are calculated from
+            self.rate_symbol = str(props.get('rate_symbol', '')).strip('"')
+            self.rate_buffer_name = self.rate_buffer
+            # seconds a fetched ticker is reused
+            self.ticker_max_age = abs(float(str(props.get('ticker_max_age', '1')).strip('"')))
+            # seconds the cached market metadata is used before it is refreshed in the background
+            self.markets_max_age = abs(int(str(props.get('markets_max_age', '86400')).strip('"')))
+            # compare the Mayer multiple calculated from the rates with the one of mayermultiple.info
+            self.mayer_cross_check = bool(str(props.get('mayer_cross_check', 'false')).strip('"').lower() == 'true')
+            # consolidate the daily reports of all instances sharing the working directory
+            self.fleet_report = bool(str(props.get('fleet_report', 'false')).strip('"').lower() == 'true')
             self.interval = 10
             self.satoshi_factor = 0.00000001
             self.recipient_addresses = str(props['recipient_addresses']).strip('"').replace(' ', '').split(",")
@@ -136,8 +223,69 @@ class Stats:
         return None
 
 
+class MovingAverage:
+    """
+    Holds the running sum of the last rates within a moving average window
+    """
+    __slots__ = 'size', 'total', 'count', 'first'
+
+    def __init__(self, size: int, count: int, total: int, first: []):
+        """
+        :param size: window size in number of rates
+        :param count: number of rates within the window
+        :param total: sum of the rates within the window
+        :param first: oldest rate (price, date_time) still within the window
+        """
+        self.size = size
+        self.count = count
+        self.total = total
+        self.first = first
+
+    @classmethod
+    def from_rates(cls, size: int, rates: [[]]):
+        """
+        :param size: window size in number of rates
+        :param rates: the last rates (price, date_time) ordered newest first
+        """
+        window = rates[:size]
+        return cls(size, len(window), sum(rate[0] for rate in window), window[-1] if window else None)
+
+    def add(self, rates: [[]]):
+        """
+        Adds the new rates to the running sum and subtracts those which dropped out of the window
+        :param rates: the new rates (price, date_time) ordered newest first
+        :return bool: False if the window could not be advanced and needs to be recalculated
+        """
+        if not rates:
+            return True
+        self.total += sum(rate[0] for rate in rates)
+        self.count += len(rates)
+        if self.first is None:
+            self.first = rates[-1]
+        expired = self.count - self.size
+        if expired > 0:
+            oldest = get_rates_from(self.first[1], expired + 1)
+            if len(oldest) <= expired:
+                return False
+            self.total -= sum(rate[0] for rate in oldest[:expired])
+            self.first = oldest[expired]
+            self.count = self.size
+        return True
+
+    def value(self, current: int = 0):
+        """
+        Calculates the moving average, optionally replacing the oldest rate by the current market price
+        :param current: current market price, optional
+        :return float: moving average
+        """
+        if current and self.count == self.size:
+            return (self.total - self.first[0] + current) / self.size
+        return (self.total + current) / self.size
+
+
 def function_logger(console_level: int, log_file: str, file_level: int = None):
-    function_name = inspect.stack()[1][3]
+    # the caller's frame only, inspect.stack() would read the source of every frame and load deferred modules
+    function_name = inspect.currentframe().f_back.f_code.co_name
     logger = logging.getLogger(function_name)
     # By default log all messages
     logger.setLevel(logging.DEBUG)
@@ -157,20 +305,170 @@ def function_logger(console_level: int, log_file: str, file_level: int = None):
     return logger
 
 
-def fetch_mayer(tries: int = 0):
+def fetch_account(endpoint: str, params: dict = None):
+    """
+    Calls a private account endpoint. Within an account snapshot every endpoint is called at most once,
+    further calls are served from the snapshot.
+    :param endpoint: name of the ccxt method, e.g. fetch_balance
+    :param params: parameters of the call
+    :return a copy of the response
+    """
+    method = getattr(get_exchange(), endpoint)
+    account = ACCOUNT
+    if account is None:
+        return method(params) if params else method()
+    key = (endpoint, tuple(sorted(params.items())) if params else None)
+    # concurrent report calls of the same endpoint wait for the first one
+    with ACCOUNT_LOCK:
+        lock = ACCOUNT_LOCKS.setdefault(key, threading.Lock())
+    with lock:
+        if key not in account:
+            account[key] = method(params) if params else method()
+        return copy.deepcopy(account[key])
+
+
+def account_snapshot(function):
+    """
+    Serves the account endpoints called by the decorated function from one snapshot, unless one is active already
+    """
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        global ACCOUNT
+
+        if ACCOUNT is not None:
+            return function(*args, **kwargs)
+        ACCOUNT = {}
+        try:
+            return function(*args, **kwargs)
+        finally:
+            ACCOUNT = None
+    return wrapper
+
+
+def invalidate_account():
+    """
+    Discards the account snapshot after an order has been placed, canceled or filled
+    """
+    if ACCOUNT is not None:
+        ACCOUNT.clear()
+
+
+def get_mayer():
+    """
+    Calculates the Mayer multiple from the BTC rates of mamaster, falls back to mayermultiple.info without enough
+    history or without a BTC pair.
+    The remote value is used as cross-check if mayer_cross_check is set.
+    :return dict: current, average or None
+    """
     try:
-        req = requests.get('https://mayermultiple.info/current.json')
+        mayer = calculate_mayer()
+    except sqlite3.Error as error:
+        LOG.warning('Failed to calculate Mayer multiple %s', str(error.args))
+        mayer = None
+    if mayer is None:
+        return fetch_mayer()
+    if CONF.mayer_cross_check:
+        remote = fetch_mayer()
+        if remote and abs(mayer['current'] / remote['current'] - 1) > MAYER_TOLERANCE:
+            LOG.warning('Mayer multiple %.2f differs from %.2f of mayermultiple.info', mayer['current'],
+                        remote['current'])
+    return mayer
+
+
+def calculate_mayer():
+    """
+    Calculates the Mayer multiple of BTC, the last rate divided by the 200 day moving average of the daily closes.
+    The average multiple of all completed days is updated incrementally and kept in <instance>.may
+    :return dict: current, average or None if there are not enough daily closes of a BTC pair
+    """
+    symbol = get_rate_symbol()
+    if symbol is None:
+        if not is_btc_pair(CONF.pair):
+            return None
+    elif not is_btc_pair(symbol.split(':', 1)[1]):
+        symbol = get_btc_symbol()
+        if symbol is None:
+            return None
+    state = load_mayer_state()
+    if state is None or state['symbol'] != symbol:
+        state = {'symbol': symbol, 'until': 0, 'count': 0, 'sum': 0.0}
+    today = int(time.time()) // 86400 * 86400
+    closes = database.daily_closes(database.connect(CONF.database, True),
+                                   max(0, state['until'] - MAYER_DAYS * 86400), symbol)
+    if len(closes) < MAYER_DAYS:
+        return None
+    prices = [close[1] for close in closes]
+    window = sum(prices[:MAYER_DAYS - 1])
+    updated = False
+    for i in range(MAYER_DAYS - 1, len(closes)):
+        window += prices[i]
+        if state['until'] < closes[i][0] < today:
+            state['sum'] += prices[i] / (window / MAYER_DAYS)
+            state['count'] += 1
+            state['until'] = closes[i][0]
+            updated = True
+        window -= prices[i - MAYER_DAYS + 1]
+    if updated:
+        persist_mayer_state(state)
+    if not state['count']:
+        return None
+    return {'current': prices[-1] / (sum(prices[-MAYER_DAYS:]) / MAYER_DAYS), 'average': state['sum'] / state['count']}
+
+
+def is_btc_pair(pair: str):
+    return pair.split('/')[0].upper() in ('BTC', 'XBT')
+
+
+def get_btc_symbol():
+    """
+    Looks for an ingested BTC pair, preferably one of the exchange of this bot
+    :return str: 'exchange:pair' or None if there is none
+    """
+    symbols = [symbol for symbol in database.symbols(database.connect(CONF.database, True))
+               if is_btc_pair(symbol.split(':', 1)[1])]
+    symbols.sort(key=lambda symbol: not symbol.startswith(CONF.exchange + ':'))
+    return symbols[0] if symbols else None
+
+
+def load_mayer_state():
+    try:
+        with open(INSTANCE + '.may', 'r') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def persist_mayer_state(state: dict):
+    with open(INSTANCE + '.may', 'w') as file:
+        json.dump(state, file)
+
+
+def fetch_mayer():
+    """
+    Fetches the Mayer multiple from mayermultiple.info, cached in mayer.json for MAYER_TTL seconds and shared by the
+    instances. The cached value is used if the site is not available.
+    :return dict: current, average or None
+    """
+    cache = None
+    try:
+        with open('mayer.json', 'r') as file:
+            cache = json.load(file)
+        if time.time() - cache['timestamp'] < MAYER_TTL:
+            return cache['mayer']
+    except (OSError, ValueError, KeyError, TypeError):
+        cache = None
+    try:
+        req = requests.get(MAYER_URL, timeout=10)
         if req.text:
             mayer = req.json()['data']
-            return {'current': float(mayer['current_mayer_multiple']), 'average': float(mayer['average_mayer_multiple'])}
+            mayer = {'current': float(mayer['current_mayer_multiple']), 'average': float(mayer['average_mayer_multiple'])}
+            with open('mayer.json', 'w') as file:
+                json.dump({'timestamp': time.time(), 'mayer': mayer}, file)
+            return mayer
     except (requests.exceptions.ConnectionError, requests.exceptions.Timeout, requests.exceptions.ReadTimeout,
-            ValueError) as error:
-        LOG.error(RETRY_MESSAGE, type(error).__name__, str(error.args))
-    if tries < 4:
-        sleep_for(4, 6)
-        return fetch_mayer(tries + 1)
-    LOG.warning('Failed to fetch Mayer multiple, giving up after 4 attempts')
-    return None
+            ValueError, KeyError, OSError) as error:
+        LOG.warning('Failed to fetch Mayer multiple %s %s', type(error).__name__, str(error.args))
+    return cache['mayer'] if cache else None
 
 
 def evaluate_mayer(mayer: dict = None):
@@ -183,8 +481,7 @@ def evaluate_mayer(mayer: dict = None):
     return 'HOLD'
 
 
-def append_mayer(part: dict):
-    mayer = fetch_mayer()
+def append_mayer(part: dict, mayer: dict):
     advice = evaluate_mayer(mayer)
     if mayer is None:
         part['mail'].append("Mayer multiple: {:>19} (n/a)".format(advice))
@@ -199,19 +496,118 @@ def append_mayer(part: dict):
 
 def daily_report(immediately: bool = False):
     """
-    Creates a daily report email around 12:02 UTC or immediately if told to do so
+    Creates a daily report email around 12:02 UTC or immediately if told to do so.
+    In fleet mode the report is collected in the slot of the instance and consolidated with the others.
     """
     global EMAIL_SENT
 
     if CONF.daily_report:
         now = datetime.datetime.utcnow().replace(microsecond=0)
-        if immediately or EMAIL_SENT != now.day and datetime.time(12, 22, 0) > now.time() > datetime.time(12, 1, 0):
+        if immediately or EMAIL_SENT != now.day and datetime.time(12, 22, 0) > now.time() > get_report_time():
             subject = "Daily MAverage report {}".format(INSTANCE)
             content = create_mail_content(True)
             filename_csv = INSTANCE + '.csv'
             write_csv(content['csv'], filename_csv)
-            send_mail(subject, content['text'], filename_csv)
+            if immediately or not CONF.fleet_report or not publish_report(now.date(), content):
+                send_mail(subject, content['text'], filename_csv)
             EMAIL_SENT = now.day
+            LOG.info('Ticker cache hits/misses: %d/%d', TICKER_STATS['hits'], TICKER_STATS['misses'])
+        if CONF.fleet_report and FLEET_AGGREGATED != now.date() and now.time() > FLEET_AGGREGATION:
+            aggregate_reports(now.date())
+
+
+def get_report_time():
+    """
+    :return datetime.time: start of the daily report, in fleet mode delayed by the collection slot of the instance
+    """
+    start = datetime.datetime(2012, 1, 17, 12, 1)
+    if CONF.fleet_report:
+        start += datetime.timedelta(seconds=zlib.crc32(INSTANCE.encode()) % FLEET_SLOTS)
+    return start.time()
+
+
+def get_fleet_store(day: datetime.date):
+    return os.path.join(FLEET_STORE, day.isoformat())
+
+
+def publish_report(day: datetime.date, content: dict):
+    """
+    Writes the report data of the instance to the shared store, where it is picked up by the aggregator
+    :param content: text and csv of the report
+    :return bool: False if the reports of the day have already been consolidated
+    """
+    store = get_fleet_store(day)
+    marker = os.path.join(store, 'aggregated')
+    if os.path.isfile(marker):
+        return False
+    os.makedirs(store, exist_ok=True)
+    filename = os.path.join(store, INSTANCE + '.json')
+    report = {'instance': INSTANCE, 'recipients': CONF.recipient_addresses, 'text': content['text'],
+              'csv': content['csv']}
+    with open(filename + '.tmp', 'w') as file:
+        json.dump(report, file)
+    os.replace(filename + '.tmp', filename)
+    if os.path.isfile(marker):
+        # the aggregator started meanwhile, the report is sent separately unless it has been claimed already
+        try:
+            os.remove(filename)
+            return False
+        except FileNotFoundError:
+            pass
+    return True
+
+
+def aggregate_reports(day: datetime.date):
+    """
+    Consolidates the published reports of the day into one email and CSV per recipient.
+    Only the first instance claiming the day does so, reports published later are sent separately.
+    """
+    global FLEET_AGGREGATED
+
+    FLEET_AGGREGATED = day
+    store = get_fleet_store(day)
+    os.makedirs(store, exist_ok=True)
+    try:
+        os.close(os.open(os.path.join(store, 'aggregated'), os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+    except FileExistsError:
+        return
+    reports = {}
+    for name in sorted(os.listdir(store)):
+        if not name.endswith('.json'):
+            continue
+        filename = os.path.join(store, name)
+        claimed = filename[:-len('.json')] + '.sent'
+        try:
+            os.replace(filename, claimed)
+            with open(claimed, 'r') as file:
+                report = json.load(file)
+        except FileNotFoundError:
+            continue
+        except ValueError as error:
+            LOG.error('Skipping invalid report %s %s', filename, str(error.args))
+            continue
+        for recipient in report['recipients']:
+            if recipient:
+                reports.setdefault(recipient, []).append(report)
+    filename_csv = os.path.join(store, 'fleet.csv')
+    for recipient, own in reports.items():
+        subject = "Daily MAverage fleet report ({} bots)".format(len(own))
+        text = '\n'.join("{}\n{}\n\n{}".format(report['instance'], '=' * len(report['instance']), report['text'])
+                         for report in own)
+        with open(filename_csv, 'w') as file:
+            file.write(''.join(report['csv'] for report in own))
+        send_mail(subject, text, filename_csv, [recipient])
+    LOG.info('Consolidated %d reports', len({report['instance'] for own in reports.values() for report in own}))
+    remove_fleet_stores(day)
+
+
+def remove_fleet_stores(day: datetime.date):
+    """
+    Removes the shared stores of the days before
+    """
+    for name in os.listdir(FLEET_STORE):
+        if name < day.isoformat():
+            shutil.rmtree(os.path.join(FLEET_STORE, name), ignore_errors=True)
 
 
 def trade_report(prefix: str):
@@ -224,6 +620,7 @@ def trade_report(prefix: str):
         send_mail(subject, content['text'])
 
 
+@account_snapshot
 def create_mail_content(daily: bool = False):
     """
     Fetches and formats the data required for the daily report email
@@ -232,8 +629,9 @@ def create_mail_content(daily: bool = False):
     if not daily:
         order = STATE['order'] if STATE['order'] else STATE['stop_loss_order']
         trade_part = create_report_part_trade(order)
-    performance_part = create_report_part_performance(daily)
-    advice_part = create_report_part_advice()
+    data = collect_report_data()
+    performance_part = create_report_part_performance(daily, data)
+    advice_part = create_report_part_advice(data['mayer'])
     settings_part = create_report_part_settings()
     general_part = create_mail_part_general()
 
@@ -258,6 +656,69 @@ def create_mail_content(daily: bool = False):
     return {'text': text, 'csv': csv}
 
 
+def collect_report_data():
+    """
+    Fetches the data of the report concurrently, the exchange calls remain spaced by its rate limiter.
+    Data not available within the timeout of its part is None and reported as n/a.
+    :return dict: margin_balance, net_deposits, price, wallet_balance, leverage, used_balance, mayer
+    """
+    tasks = {'margin_balance': get_margin_balance, 'net_deposits': get_net_deposits, 'price': get_current_price,
+             'wallet_balance': get_wallet_balance, 'leverage': get_margin_leverage, 'used_balance': get_used_balance,
+             'mayer': get_mayer}
+    start = time.monotonic()
+    exchange = connect_report_exchange()
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=len(tasks))
+    futures = {name: executor.submit(run_report_task, task, start + REPORT_TIMEOUTS.get(name, REPORT_TIMEOUT),
+                                     exchange) for name, task in tasks.items()}
+    # a call exceeding its timeout must not hold up the report
+    executor.shutdown(wait=False)
+    data = {}
+    for name, future in futures.items():
+        timeout = REPORT_TIMEOUTS.get(name, REPORT_TIMEOUT)
+        try:
+            data[name] = future.result(max(0.0, start + timeout - time.monotonic()))
+        except (concurrent.futures.TimeoutError, ReportTimeout):
+            LOG.warning('No %s for the report within %d seconds', name, timeout)
+            data[name] = None
+    return data
+
+
+def run_report_task(task, deadline: float, exchange=None):
+    """
+    Runs a task collecting report data, its retries end with ReportTimeout once the deadline has passed
+    :param deadline: time.monotonic() the report stops waiting for the data
+    :param exchange: connection of the report threads, the one of the main loop if None
+    """
+    REPORT_DEADLINE.value = deadline
+    REPORT_EXCHANGE.value = exchange
+    try:
+        return task()
+    finally:
+        REPORT_DEADLINE.value = None
+        REPORT_EXCHANGE.value = None
+
+
+def connect_report_exchange():
+    """
+    Opens a connection of its own for the report threads. A call still running after the report gave up on it does
+    not share the HTTP session and the response state with the trading calls of the main loop.
+    The rate limiter and the markets are shared.
+    """
+    exchange = connect_to_exchange()
+    exchange.throttle = EXCHANGE.throttle
+    if EXCHANGE.markets:
+        exchange.set_markets(EXCHANGE.markets, EXCHANGE.currencies)
+    return exchange
+
+
+def get_exchange():
+    """
+    :return the exchange connection of the current thread
+    """
+    exchange = getattr(REPORT_EXCHANGE, 'value', None)
+    return exchange if exchange is not None else EXCHANGE
+
+
 def create_report_part_settings():
     return {'mail': ["Daily report: {:>21}".format(str('Y' if CONF.daily_report is True else 'N')),
                      "Trade report: {:>21}".format(str('Y' if CONF.trade_report is True else 'N')),
@@ -294,29 +755,25 @@ def create_mail_part_general():
     return general
 
 
-def create_report_part_advice():
-    relevant_rates = get_last_rates(calculate_fetch_size(CONF.ma_minutes_long))
-    ma_short = calculate_ma(relevant_rates, calculate_fetch_size(CONF.ma_minutes_short))
-    ma_long = calculate_ma(relevant_rates, calculate_fetch_size(CONF.ma_minutes_long))
+def create_report_part_advice(mayer: dict):
+    mas = update_moving_averages()
+    ma_short = mas['short'].value()
+    ma_long = mas['long'].value()
     moving_average = str(round(ma_long)) + '/' + str(round(ma_short)) + ' = ' + read_action()
     padding = 13 - len(str(CONF.ma_minutes_long)) - len(str(CONF.ma_minutes_short)) + len(moving_average)
     part = {'mail': [
         "Moving average {}/{}: {:>{}}".format(CONF.ma_minutes_long, CONF.ma_minutes_short, moving_average, padding)],
             'csv': []}
-    append_mayer(part)
+    append_mayer(part, mayer)
     return part
 
 
-def create_report_part_performance(daily: bool):
+def create_report_part_performance(daily: bool, data: dict):
     part = {'mail': [], 'csv': []}
-    margin_balance = get_margin_balance()
-    net_deposits = get_net_deposits()
-    sleep_for(0, 1)
-    price = get_current_price()
-    append_performance(part, margin_balance['total'], net_deposits, price)
-    wallet_balance = get_wallet_balance()
-    sleep_for(0, 1)
-    append_balances(part, margin_balance, wallet_balance, price, daily)
+    margin_balance = data['margin_balance']
+    append_performance(part, margin_balance['total'] if margin_balance else None, data['net_deposits'], data['price'])
+    append_balances(part, margin_balance, data['wallet_balance'], data['price'], daily, data['leverage'],
+                    data['used_balance'])
     return part
 
 
@@ -326,34 +783,193 @@ def create_report_part_trade(last_order: Order):
     return part
 
 
-def send_mail(subject: str, text: str, attachment: str = None):
-    recipients = ", ".join(CONF.recipient_addresses)
+def send_mail(subject: str, text: str, attachment: str = None, recipients: list = None):
+    """
+    Queues an email on disk, it is sent by the mail worker
+    :param attachment: filename of the attachment, its current content is queued
+    :param recipients: addresses, the configured recipient addresses if None
+    """
+    message = {'subject': subject, 'text': text, 'attachment': None, 'content': None, 'recipients': recipients}
+    if attachment and os.path.isfile(attachment):
+        with open(attachment, 'rb') as file:
+            message['attachment'] = os.path.basename(attachment)
+            message['content'] = base64.b64encode(file.read()).decode('ascii')
+    queue = get_mail_queue()
+    os.makedirs(queue, exist_ok=True)
+    filename = os.path.join(queue, '{}.json'.format(time.time_ns()))
+    with open(filename + '.tmp', 'w') as file:
+        json.dump(message, file)
+    os.replace(filename + '.tmp', filename)
+    MAIL_WAKEUP.set()
+
+
+def get_mail_queue():
+    return 'mail{}{}'.format(os.path.sep, INSTANCE)
+
+
+def get_dead_letters():
+    """
+    :return directory of the emails that can not be sent, within the queue
+    """
+    return os.path.join(get_mail_queue(), 'failed')
+
+
+def get_queued_mails():
+    """
+    :return list of the filenames of the queued emails, oldest first
+    """
+    queue = get_mail_queue()
+    if not os.path.isdir(queue):
+        return []
+    return [os.path.join(queue, name) for name in sorted(os.listdir(queue)) if name.endswith('.json')]
+
+
+def create_message(message: dict):
+    from email import encoders
+    from email.mime.base import MIMEBase
+    from email.mime.multipart import MIMEMultipart
+    from email.mime.text import MIMEText
+
     msg = MIMEMultipart()
-    msg['Subject'] = subject
+    msg['Subject'] = message['subject']
     msg['From'] = CONF.sender_address
-    msg['To'] = recipients
+    msg['To'] = ", ".join(message.get('recipients') or CONF.recipient_addresses)
 
     readable_part = MIMEMultipart('alternative')
-    readable_part.attach(MIMEText(text, 'plain', 'utf-8'))
-    html = '<html><body><pre style="font:monospace">' + text + '</pre></body></html>'
+    readable_part.attach(MIMEText(message['text'], 'plain', 'utf-8'))
+    html = '<html><body><pre style="font:monospace">' + message['text'] + '</pre></body></html>'
     readable_part.attach(MIMEText(html, 'html', 'utf-8'))
     msg.attach(readable_part)
 
-    if attachment and os.path.isfile(attachment):
+    if message['attachment']:
         part = MIMEBase('application', 'octet-stream')
-        with open(attachment, "rb") as file:
-            part.set_payload(file.read())
+        part.set_payload(base64.b64decode(message['content']))
         encoders.encode_base64(part)
-        part.add_header('Content-Disposition', "attachment; filename={}".format(attachment))
+        part.add_header('Content-Disposition', "attachment; filename={}".format(message['attachment']))
         msg.attach(part)
+    return msg
+
+
+def connect_to_mail_server():
+    import smtplib
 
-    server = smtplib.SMTP_SSL(CONF.mail_server, 465)
+    server = smtplib.SMTP_SSL(CONF.mail_server, 465, timeout=MAIL_TIMEOUT)
     # server.starttls()
     server.set_debuglevel(0)
     server.login(CONF.sender_address, CONF.sender_password)
-    server.send_message(msg, None, None, mail_options=(), rcpt_options=())
-    server.quit()
-    LOG.info("Sent email to %s", recipients)
+    return server
+
+
+def close_mail_server(server):
+    import smtplib
+
+    if server is not None:
+        try:
+            server.quit()
+        except (smtplib.SMTPException, OSError):
+            server.close()
+
+
+def send_queued_mails(server):
+    """
+    Sends the queued emails oldest first, removing every one once it has been sent.
+    Unreadable emails and the ones the mail server rejects permanently are moved to the dead letters, so they do not
+    hold up the following ones.
+    :param server: open SMTP connection or None
+    :return the SMTP connection if an email has been sent, otherwise the one passed in
+    """
+    import smtplib
+
+    for filename in get_queued_mails():
+        try:
+            with open(filename, 'r') as file:
+                message = json.load(file)
+            content = create_message(message)
+        except (ValueError, KeyError, TypeError) as error:
+            move_to_dead_letters(filename, error)
+            continue
+        if server is None:
+            server = connect_to_mail_server()
+        try:
+            server.send_message(content, None, None, mail_options=(), rcpt_options=())
+        except (smtplib.SMTPRecipientsRefused, smtplib.SMTPDataError) as error:
+            if not is_permanent_rejection(error):
+                raise
+            move_to_dead_letters(filename, error)
+            continue
+        os.remove(filename)
+        LOG.info("Sent email to %s", ", ".join(message.get('recipients') or CONF.recipient_addresses))
+    return server
+
+
+def is_permanent_rejection(error):
+    """
+    :return bool: True if the mail server rejected the email with a 5xx reply, for all its recipients
+    """
+    import smtplib
+
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(reply[0] >= 500 for reply in error.recipients.values())
+    return error.smtp_code >= 500
+
+
+def move_to_dead_letters(filename: str, error: Exception):
+    dead_letters = get_dead_letters()
+    os.makedirs(dead_letters, exist_ok=True)
+    os.replace(filename, os.path.join(dead_letters, os.path.basename(filename)))
+    LOG.error('Moved email %s to %s %s %s', os.path.basename(filename), dead_letters, type(error).__name__,
+              str(error.args))
+
+
+def run_mail_worker():
+    """
+    Sends the queued emails whenever one is queued, reusing the SMTP connection until it has been unused for
+    MAIL_IDLE seconds. Failed attempts are retried with an increasing delay, whatever the error.
+    """
+    server = None
+    backoff = MAIL_BACKOFF[0]
+    while True:
+        MAIL_WAKEUP.clear()
+        try:
+            server = send_queued_mails(server)
+            backoff = MAIL_BACKOFF[0]
+            timeout = MAIL_IDLE if server else None
+        except Exception as error:
+            # not only SMTP and network errors, the worker must keep running e.g. on a queue that can not be read
+            LOG.warning('Failed to send email %s %s, retrying in %d seconds', type(error).__name__, str(error.args),
+                        backoff)
+            close_mail_server(server)
+            server = None
+            timeout = backoff
+            backoff = min(backoff * 2, MAIL_BACKOFF[1])
+        if not MAIL_WAKEUP.wait(timeout) and server is not None:
+            close_mail_server(server)
+            server = None
+
+
+def start_mail_worker():
+    """
+    Starts the mail worker, which sends the emails left over from a previous run first
+    """
+    global MAIL_WORKER
+
+    if MAIL_WORKER is None:
+        MAIL_WORKER = threading.Thread(target=run_mail_worker, name='mail', daemon=True)
+        MAIL_WORKER.start()
+
+
+def flush_mails(timeout: float):
+    """
+    Waits until the queued emails have been sent, e.g. before exiting
+    :param timeout: seconds to wait at most
+    :return bool: True if all emails have been sent
+    """
+    deadline = time.monotonic() + timeout
+    while get_queued_mails():
+        if time.monotonic() > deadline:
+            return False
+        sleep(0.1)
+    return True
 
 
 def append_performance(part: dict, margin_balance: float, net_deposits: float, price: float):
@@ -368,6 +984,10 @@ def append_performance(part: dict, margin_balance: float, net_deposits: float, p
     else:
         part['mail'].append("Net deposits {}: {:>20.4f}".format(CONF.base, net_deposits))
         part['csv'].append("Net deposits {}:;{:.4f}".format(CONF.base, net_deposits))
+        if margin_balance is None:
+            part['mail'].append("Overall performance in {}: {:>7}".format(CONF.base, 'n/a'))
+            part['csv'].append("Overall performance in {}:;{}".format(CONF.base, 'n/a'))
+            return
         absolute_performance = margin_balance - net_deposits
         if net_deposits > 0 and absolute_performance != 0:
             relative_performance = round(100 / (net_deposits / absolute_performance), 2)
@@ -382,29 +1002,49 @@ def append_performance(part: dict, margin_balance: float, net_deposits: float, p
             part['csv'].append("Overall performance in {}:;{:.4f};% n/a".format(CONF.base, absolute_performance))
 
 
-def append_balances(part: dict, margin_balance: dict, wallet_balance: dict, price: float, daily: bool):
+def append_balances(part: dict, margin_balance: dict, wallet_balance: dict, price: float, daily: bool,
+                    actual_leverage: float, used_balance: float):
     """
-    Appends price, wallet balance, margin balance (including stats), used margin and leverage information
+    Appends price, wallet balance, margin balance (including stats), used margin and leverage information,
+    n/a for the values not available
     """
-    if wallet_balance['crypto'] == 0 and wallet_balance['fiat'] > 0:
-        wallet_balance['crypto'] = wallet_balance['fiat'] / price
-    part['mail'].append("Wallet balance {}: {:>18.4f}".format(CONF.base, wallet_balance['crypto']))
-    part['csv'].append("Wallet balance {}:;{:.4f}".format(CONF.base, wallet_balance['crypto']))
-    today = calculate_daily_statistics(margin_balance['total'], price, daily)
-    append_margin_change(part, today, CONF.base)
-    append_price_change(part, today, price)
-    used_margin = calculate_used_margin_percentage(margin_balance)
-    part['mail'].append("Used margin: {:>23.2f}%".format(used_margin))
-    part['csv'].append("Used margin:;{:.2f}%".format(used_margin))
-    if CONF.exchange == 'kraken':
-        actual_leverage = get_margin_leverage()
+    if wallet_balance is None:
+        part['mail'].append("Wallet balance {}: {:>18}".format(CONF.base, 'n/a'))
+        part['csv'].append("Wallet balance {}:;{}".format(CONF.base, 'n/a'))
+    else:
+        if wallet_balance['crypto'] == 0 and wallet_balance.get('fiat', 0) > 0 and price:
+            wallet_balance['crypto'] = wallet_balance['fiat'] / price
+        part['mail'].append("Wallet balance {}: {:>18.4f}".format(CONF.base, wallet_balance['crypto']))
+        part['csv'].append("Wallet balance {}:;{:.4f}".format(CONF.base, wallet_balance['crypto']))
+    if margin_balance is not None and price:
+        today = calculate_daily_statistics(margin_balance['total'], price, daily)
+        append_margin_change(part, today, CONF.base)
+    else:
+        today = {}
+        part['mail'].append("Margin balance {}: {:>18}".format(CONF.base, 'n/a'))
+        part['csv'].append("Margin balance {}:;{}".format(CONF.base, 'n/a'))
+    if price:
+        append_price_change(part, today, price)
+    else:
+        part['mail'].append("{} price {}: {:>21}".format(CONF.base, CONF.quote, 'n/a'))
+        part['csv'].append("{} price {}:;{}".format(CONF.base, CONF.quote, 'n/a'))
+    if margin_balance is not None:
+        used_margin = calculate_used_margin_percentage(margin_balance)
+        part['mail'].append("Used margin: {:>23.2f}%".format(used_margin))
+        part['csv'].append("Used margin:;{:.2f}%".format(used_margin))
+    else:
+        used_margin = 'n/a'
+        part['mail'].append("Used margin: {:>24}".format(used_margin))
+        part['csv'].append("Used margin:;{}".format(used_margin))
+    if actual_leverage is None:
+        part['mail'].append("Actual leverage: {:>20}".format('n/a'))
+        part['csv'].append("Actual leverage:;{}".format('n/a'))
+    elif CONF.exchange == 'kraken':
         part['mail'].append("Actual leverage: {:>19.2f}%".format(actual_leverage))
-        part['csv'].append("Actual leverage:;{:.2f}%".format(used_margin))
+        part['csv'].append("Actual leverage:;{:.2f}%".format(actual_leverage))
     else:
-        actual_leverage = get_margin_leverage()
         part['mail'].append("Actual leverage: {:>19.2f}x".format(actual_leverage))
         part['csv'].append("Actual leverage:;{:.2f}".format(actual_leverage))
-    used_balance = get_used_balance()
     if used_balance is None:
         used_balance = 'n/a'
         part['mail'].append("Position {}: {:>22}".format(CONF.quote, used_balance))
@@ -522,9 +1162,9 @@ def get_margin_balance():
     """
     try:
         if CONF.exchange == 'bitmex':
-            bal = EXCHANGE.fetch_balance()[CONF.base]
+            bal = fetch_account('fetch_balance')[CONF.base]
         elif CONF.exchange == 'kraken':
-            bal = EXCHANGE.private_post_tradebalance({'asset': CONF.base})['result']
+            bal = fetch_account('private_post_tradebalance', {'asset': CONF.base})['result']
             bal['free'] = float(bal['mf'])
             bal['total'] = float(bal['e'])
             bal['used'] = float(bal['m'])
@@ -543,9 +1183,9 @@ def get_margin_leverage():
     """
     try:
         if CONF.exchange == 'bitmex':
-            return EXCHANGE.fetch_balance()['info'][0]['marginLeverage']
+            return fetch_account('fetch_balance')['info'][0]['marginLeverage']
         if CONF.exchange == 'kraken':
-            result = EXCHANGE.private_post_tradebalance()['result']
+            result = fetch_account('private_post_tradebalance')['result']
             if hasattr(result, 'ml'):
                 return float(result['ml'])
             return 0
@@ -560,6 +1200,7 @@ def get_margin_leverage():
 def get_net_deposits():
     """
     Get deposits and withdraws to calculate the net deposits in crypto.
+    On kraken only the entries booked since the last call are fetched and added to the local ledger.
     return: net deposits
     """
     if CONF.net_deposits_in_base_currency:
@@ -567,17 +1208,14 @@ def get_net_deposits():
     try:
         currency = CONF.base if CONF.base != 'BTC' else 'XBt'
         if CONF.exchange == 'bitmex':
-            result = EXCHANGE.private_get_user_wallet({'currency': currency})
+            result = get_exchange().private_get_user_wallet({'currency': currency})
             return (result['deposited'] - result['withdrawn']) * CONF.satoshi_factor
         if CONF.exchange == 'kraken':
-            net_deposits = 0
-            deposits = EXCHANGE.fetch_deposits(CONF.base)
-            for deposit in deposits:
-                net_deposits += deposit['amount']
-            ledgers = EXCHANGE.private_post_ledgers({'asset': currency, 'type': 'withdrawal'})['result']['ledger']
-            for withdrawal_id in ledgers:
-                net_deposits += float(ledgers[withdrawal_id]['amount'])
-            return net_deposits
+            ledger = load_ledger()
+            sync_deposits(ledger)
+            sync_withdrawals(ledger, currency)
+            persist_ledger(ledger)
+            return ledger['net_deposits']
         LOG.error("get_net_deposit() not yet implemented for %s", CONF.exchange)
         return None
 
@@ -588,19 +1226,82 @@ def get_net_deposits():
         get_net_deposits()
 
 
+def load_ledger():
+    """
+    Loads the local ledger of the deposits and withdrawals, a new one if there is none for the exchange and currency
+    :return dict: deposits and withdrawals by id, their sync cursors and the net deposits
+    """
+    account = '{}:{}'.format(CONF.exchange, CONF.base)
+    try:
+        with open(INSTANCE + '.led', 'r') as file:
+            ledger = json.load(file)
+        if ledger['account'] == account:
+            return ledger
+    except (OSError, ValueError, KeyError):
+        pass
+    return {'account': account, 'deposits': {}, 'deposits_since': None, 'withdrawals': {}, 'withdrawals_start': None,
+            'net_deposits': 0}
+
+
+def persist_ledger(ledger: dict):
+    filename = INSTANCE + '.led'
+    with open(filename + '.tmp', 'w') as file:
+        json.dump(ledger, file)
+    os.replace(filename + '.tmp', filename)
+
+
+def sync_deposits(ledger: dict):
+    """
+    Adds the deposits made since the newest one in the ledger. The cursor is inclusive, known ids are skipped.
+    """
+    since = ledger['deposits_since']
+    for deposit in get_exchange().fetch_deposits(CONF.base, since):
+        deposit_id = str(deposit['id'] or deposit['txid'])
+        if deposit_id not in ledger['deposits']:
+            ledger['deposits'][deposit_id] = deposit['amount']
+            ledger['net_deposits'] += deposit['amount']
+        if deposit['timestamp']:
+            since = max(since or 0, deposit['timestamp'])
+    ledger['deposits_since'] = since
+
+
+def sync_withdrawals(ledger: dict, currency: str):
+    """
+    Adds the withdrawals booked since the newest one in the ledger, page by page
+    """
+    start = ledger['withdrawals_start']
+    params = {'asset': currency, 'type': 'withdrawal'}
+    if start:
+        # the start is exclusive, withdrawals of the same second are skipped by their id
+        params['start'] = start - 1
+    offset = 0
+    while True:
+        result = get_exchange().private_post_ledgers(dict(params, ofs=offset))['result']
+        entries = result['ledger']
+        for withdrawal_id, entry in entries.items():
+            if withdrawal_id not in ledger['withdrawals']:
+                ledger['withdrawals'][withdrawal_id] = float(entry['amount'])
+                ledger['net_deposits'] += float(entry['amount'])
+            start = max(start or 0, int(float(entry['time'])))
+        offset += len(entries)
+        if not entries or offset >= int(result.get('count', 0)):
+            break
+    ledger['withdrawals_start'] = start
+
+
 def get_position_info():
     """
     Fetch position information
     """
     try:
         if CONF.exchange == 'bitmex':
-            response = EXCHANGE.private_get_position()
+            response = fetch_account('private_get_position')
             if response and response[0] and response[0]['avgEntryPrice']:
                 return response[0]
             return None
         if CONF.exchange == 'kraken':
             # in crypto
-            response = EXCHANGE.private_post_tradebalance({'asset': CONF.base})
+            response = fetch_account('private_post_tradebalance', {'asset': CONF.base})
             return response['result']
 
     except (ccxt.ExchangeError, ccxt.NetworkError) as error:
@@ -616,10 +1317,10 @@ def get_wallet_balance():
     """
     try:
         if CONF.exchange == 'bitmex':
-            return {'crypto': EXCHANGE.fetch_balance()['info'][0]['walletBalance'] * CONF.satoshi_factor}
+            return {'crypto': fetch_account('fetch_balance')['info'][0]['walletBalance'] * CONF.satoshi_factor}
         if CONF.exchange == 'kraken':
             asset = CONF.base if CONF.base != 'BTC' else 'XBt'
-            return {'crypto': float(EXCHANGE.private_post_tradebalance({'asset': asset})['result']['tb'])}
+            return {'crypto': float(fetch_account('private_post_tradebalance', {'asset': asset})['result']['tb'])}
 
     except (ccxt.ExchangeError, ccxt.NetworkError) as error:
         handle_account_errors(str(error.args))
@@ -662,16 +1363,21 @@ def update_stop_loss_trade(trade_id: str, stop_loss_price: float):
     return True
 
 
+def get_order_ledger():
+    return orders.connect(INSTANCE + '.orders.db')
+
+
 def get_open_order():
     """
-    Gets current open order
+    Gets current open order, updating the open orders of the order ledger
     :return Order
     """
     try:
-        result = EXCHANGE.fetch_open_orders(CONF.pair, since=None, limit=3, params={'reverse': True})
-        if result is not None and len(result) > 0:
-            return Order(result[-1])
-        return None
+        result = EXCHANGE.fetch_open_orders(CONF.pair)
+        ledger = get_order_ledger()
+        orders.store_open(ledger, CONF.pair, result or [])
+        order = orders.newest(ledger, CONF.pair)
+        return Order(order) if order else None
 
     except (ccxt.ExchangeError, ccxt.NetworkError) as error:
         handle_account_errors(str(error.args))
@@ -680,16 +1386,33 @@ def get_open_order():
         get_open_order()
 
 
+def fetch_open_orders():
+    """
+    Fetches all open orders, updating the open orders of the order ledger
+    :return list: the open orders, oldest first
+    """
+    try:
+        result = EXCHANGE.fetch_open_orders(CONF.pair) or []
+        orders.store_open(get_order_ledger(), CONF.pair, result)
+        return [Order(o) for o in sorted(result, key=lambda o: o.get('timestamp') or 0)]
+
+    except (ccxt.ExchangeError, ccxt.NetworkError) as error:
+        handle_account_errors(str(error.args))
+        LOG.error(RETRY_MESSAGE, type(error).__name__, str(error.args))
+        sleep_for(4, 6)
+        return fetch_open_orders()
+
+
 def get_closed_order():
     """
-    Gets the last closed order
+    Gets the last closed order from the order ledger, after syncing the orders closed meanwhile
     :return Order
     """
     try:
-        result = EXCHANGE.fetch_closed_orders(CONF.pair, since=None, limit=3, params={'reverse': True})
-        if result is not None and len(result) > 0:
-            orders = sorted(result, key=lambda order: order['datetime'])
-            last_order = Order(orders[-1])
+        sync_closed_orders()
+        order = orders.newest(get_order_ledger(), CONF.pair, True)
+        if order:
+            last_order = Order(order)
             LOG.info('Last %s', str(last_order))
             return last_order
         return None
@@ -701,18 +1424,73 @@ def get_closed_order():
         get_closed_order()
 
 
-def get_current_price(limit: int = None, attempts: int = 0):
+def sync_closed_orders():
+    """
+    Adds the orders closed or canceled since the cursor of the order ledger, page by page. The orders no longer open
+    but still not settled then are fetched one by one. An empty ledger starts with the last closed orders.
+    """
+    ledger = get_order_ledger()
+    since = orders.closed_cursor(ledger, CONF.pair)
+    if since is None:
+        orders.store(ledger, CONF.pair, EXCHANGE.fetch_closed_orders(CONF.pair, since=None, limit=3,
+                                                                     params={'reverse': True}))
+        return
+    while True:
+        result = fetch_orders_since(since)
+        orders.store(ledger, CONF.pair, result)
+        newest = max((order['timestamp'] or 0 for order in result), default=since)
+        if len(result) < ORDER_PAGE or newest <= since:
+            break
+        since = newest
+    for order_id in orders.unsettled(ledger, CONF.pair):
+        try:
+            orders.store(ledger, CONF.pair, [EXCHANGE.fetch_order(order_id)])
+        except ccxt.OrderNotFound:
+            orders.settle(ledger, order_id, 'not found')
+
+
+def fetch_orders_since(since: int):
+    """
+    Fetches a page of the orders since the timestamp. Where the exchange lists the orders of all statuses (bitmex), they
+    are fetched unfiltered, so a short page is the last one. kraken lists the closed and canceled orders.
+    :param since: milliseconds
+    :return list of ccxt orders
+    """
+    if EXCHANGE.has.get('fetchOrders'):
+        return EXCHANGE.fetch_orders(CONF.pair, since=since, limit=ORDER_PAGE)
+    return EXCHANGE.fetch_closed_orders(CONF.pair, since=since, limit=ORDER_PAGE)
+
+
+def fetch_ticker(pair: str, fresh: bool = False):
+    """
+    Fetches the ticker of the pair. It is served from the cache as long as it is not older than ticker_max_age.
+    :param pair: the pair
+    :param fresh: bypass the cache, e.g. for pricing orders
+    :return the ticker
+    """
+    cached = TICKERS.get(pair)
+    if not fresh and cached and time.monotonic() - cached[0] <= CONF.ticker_max_age:
+        TICKER_STATS['hits'] += 1
+        return cached[1]
+    TICKER_STATS['misses'] += 1
+    ticker = get_exchange().fetch_ticker(pair)
+    TICKERS[pair] = (time.monotonic(), ticker)
+    return ticker
+
+
+def get_current_price(limit: int = None, attempts: int = 0, fresh: bool = False):
     """
     Fetches the current BTC/USD exchange rate
     In case of failure, the function calls itself again until success
+    :param fresh: bypass the ticker cache, e.g. for pricing orders
     :return int current market price
     """
     try:
-        price = EXCHANGE.fetch_ticker(CONF.pair)['bid']
+        price = fetch_ticker(CONF.pair, fresh)['bid']
         if not price:
             LOG.warning('Price was None')
             sleep_for(1, 2)
-            get_current_price(limit, attempts)
+            get_current_price(limit, attempts, True)
         else:
             return int(price)
 
@@ -722,38 +1500,138 @@ def get_current_price(limit: int = None, attempts: int = 0):
         attempts += 1
         if not limit or attempts < limit:
             sleep_for(4, 6)
-            get_current_price(limit, attempts)
+            get_current_price(limit, attempts, fresh)
         else:
             return 0
 
 
+def get_rate_symbol():
+    """
+    Resolves the symbol of the rates the moving averages are calculated from: the configured rate_symbol or the
+    pair of this bot on its exchange, if mamaster ingests it, otherwise the default symbol of the database
+    :return str: 'exchange:pair' or None if the database holds a single series
+    """
+    global RATE_SYMBOL
+
+    if RATE_SYMBOL is None:
+        try:
+            symbols = database.symbols(database.connect(CONF.database, True))
+        except sqlite3.Error as error:
+            LOG.warning('Rate symbols not available %s', str(error.args))
+            return None
+        if symbols:
+            wanted = CONF.rate_symbol or '{}:{}'.format(CONF.exchange, CONF.pair)
+            if wanted not in symbols:
+                LOG.warning('%s is not ingested, using %s', wanted, symbols[0])
+                wanted = symbols[0]
+            RATE_SYMBOL = wanted
+            CONF.rate_buffer_name = CONF.rate_buffer if wanted == symbols[0] else buffer_name(CONF.rate_buffer, wanted)
+    return RATE_SYMBOL
+
+
+def is_own_rate_symbol():
+    """
+    :return bool: True if the moving averages are calculated from the rates of the pair traded by this bot
+    """
+    symbol = get_rate_symbol()
+    if symbol is None:
+        return CONF.pair == "BTC/USD"
+    return symbol.split(':', 1)[1] == CONF.pair
+
+
+def get_rate_buffer():
+    """
+    Opens the rate buffer published by mamaster, reopening it if mamaster has replaced it
+    :return RateBuffer or None if there is none
+    """
+    global RATE_BUFFER
+
+    if RATE_BUFFER is not None and RATE_BUFFER.is_stale():
+        RATE_BUFFER.close()
+        RATE_BUFFER = None
+    filename = CONF.rate_buffer_name if get_rate_symbol() else CONF.rate_buffer
+    if RATE_BUFFER is None and os.path.isfile(filename):
+        try:
+            RATE_BUFFER = RateBuffer(filename)
+        except (OSError, ValueError) as error:
+            LOG.warning('Rate buffer not available %s', str(error.args))
+    return RATE_BUFFER
+
+
 def get_last_rates(limit: int):
     """
-    Fetches the last x rates from the database
+    Fetches the last x rates from the rate buffer or from the database
     :param limit: Number of rates to be fetched
     :return The fetched results
     """
-    conn = sqlite3.connect(CONF.database, detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES)
-    curs = conn.cursor()
-    try:
-        return curs.execute("SELECT price FROM rates ORDER BY date_time DESC LIMIT {}".format(limit)).fetchall()
-    finally:
-        curs.close()
-        conn.close()
+    buffer = get_rate_buffer()
+    if buffer is not None:
+        rates = buffer.last(limit)
+        if rates is not None:
+            return rates
+    return database.last_rates(database.connect(CONF.database, True), limit, get_rate_symbol())
 
 
-def get_all_entries():
+def get_rates_sum(size: int):
     """
-    Fetches all entries from the database
-    :return The fetched results
+    Sums up the last x rates from the rate buffer or from the rollups of the database
+    :param size: Number of rates to be summed up
+    :return tuple: count, total, oldest rate within the window, newest rate
+    """
+    buffer = get_rate_buffer()
+    if buffer is not None:
+        rates = buffer.last(size)
+        if rates is not None:
+            return len(rates), sum(rate[0] for rate in rates), rates[-1] if rates else None, rates[0] if rates else None
+    return database.sum_last_rates(database.connect(CONF.database, True), size, get_rate_symbol())
+
+
+def get_database_rates_sums(*sizes: int):
+    """
+    Sums up the last x rates for several window sizes within one read transaction of the database, so all the windows
+    end with the same rate
+    :param sizes: numbers of rates to be summed up
+    :return list of tuples: count, total, oldest rate within the window, newest rate
     """
-    conn = sqlite3.connect(CONF.database, detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES)
-    curs = conn.cursor()
+    symbol = get_rate_symbol()
+    conn = database.connect(CONF.database, True)
+    conn.execute('BEGIN')
     try:
-        return curs.execute("SELECT date_time, price FROM rates ORDER BY date_time DESC").fetchall()
+        return [database.sum_last_rates(conn, size, symbol) for size in sizes]
     finally:
-        curs.close()
-        conn.close()
+        conn.execute('COMMIT')
+
+
+def get_rates_since(date_time, limit: int):
+    """
+    Fetches the rates newer than the given datetime from the rate buffer or from the database
+    :param date_time: datetime of the last known rate
+    :param limit: maximal number of rates to be fetched
+    :return The fetched results ordered newest first
+    """
+    buffer = get_rate_buffer()
+    if buffer is not None:
+        rates = buffer.since(to_epoch(date_time), limit)
+        if rates is not None:
+            return rates
+    return database.rates_since(database.connect(CONF.database, True), date_time, limit,
+                                  get_rate_symbol())
+
+
+def get_rates_from(date_time, limit: int):
+    """
+    Fetches the rates starting with the given datetime from the rate buffer or from the database
+    :param date_time: datetime of the first rate to be fetched
+    :param limit: number of rates to be fetched
+    :return The fetched results ordered oldest first
+    """
+    buffer = get_rate_buffer()
+    if buffer is not None:
+        rates = buffer.starting_at(to_epoch(date_time), limit)
+        if rates is not None:
+            return rates
+    return database.rates_from(database.connect(CONF.database, True), date_time, limit,
+                                 get_rate_symbol())
 
 
 def calculate_ma(rates: [[]], size: int, current: int = 0):
@@ -773,13 +1651,56 @@ def calculate_ma(rates: [[]], size: int, current: int = 0):
     return total / size
 
 
-def dump_to_csv(entries: [[]]):
-    buffer = []
-    for entry in entries:
-        buffer.append("{};{}".format(entry[0], entry[1]))
-    content = '\n'.join(buffer)
-    with open(CONF.database + '.csv', 'w') as file:
-        file.write(content)
+def export_rates(filename: str, since=None, until=None, compress: bool = False, incremental: bool = False):
+    """
+    Streams the rates into a CSV file (date_time;price) ordered oldest first.
+    In incremental mode only the rates newer than those of the previous export are appended,
+    the datetime of the last exported rate is kept in <filename>.last
+    :param filename: name of the CSV file
+    :param since: datetime of the first rate to be exported, optional
+    :param until: datetime after the last rate to be exported, optional
+    :param compress: write gzip
+    :param incremental: append the rates since the previous export
+    :return int: number of exported rates
+    """
+    marker = filename + '.last'
+    last = None
+    if incremental and os.path.isfile(marker) and os.path.isfile(filename):
+        with open(marker, 'r') as file:
+            last = file.read().strip()
+        resume = to_datetime(to_epoch(last) + 1)
+        since = max(since, resume) if since else resume
+    opener = gzip.open if compress else open
+    count = 0
+    with opener(filename, 'at' if last else 'wt') as file:
+        for rows in database.export_rates(database.connect(CONF.database, True), since, until, get_rate_symbol()):
+            file.writelines('{};{}\n'.format(date_time, price) for date_time, price in rows)
+            count += len(rows)
+            last = rows[-1][0]
+    if incremental and last:
+        with open(marker, 'w') as file:
+            file.write(last)
+    return count
+
+
+def parse_export_arguments(arguments: list):
+    """
+    Parses the options of -csv: --since=<date> --until=<date> (ISO format, UTC, until excluded) --gzip --incremental
+    :return dict: since, until, gzip, incremental
+    """
+    options = {'since': None, 'until': None, 'gzip': False, 'incremental': False}
+    for argument in arguments:
+        key, _, value = argument.partition('=')
+        if key in ('--since', '--until') and value:
+            try:
+                options[key[2:]] = datetime.datetime.fromisoformat(value)
+            except ValueError:
+                raise SystemExit('Invalid date ' + value)
+        elif key in ('--gzip', '--incremental'):
+            options[key[2:]] = True
+        else:
+            raise SystemExit('Unknown argument ' + argument)
+    return options
 
 
 def connect_to_exchange():
@@ -799,9 +1720,97 @@ def connect_to_exchange():
         else:
             raise SystemExit('Test not supported by %s', CONF.exchange)
 
+    return serialize_throttle(exchange)
+
+
+def serialize_throttle(exchange):
+    """
+    Makes the rate limiter of the exchange thread safe, so concurrent calls keep their spacing
+    """
+    lock = threading.Lock()
+    throttle = exchange.throttle
+
+    def locked_throttle(cost=None):
+        with lock:
+            throttle(cost)
+            exchange.lastRestRequestTimestamp = exchange.milliseconds()
+    exchange.throttle = locked_throttle
     return exchange
 
 
+def get_markets_filename():
+    """
+    :return str: filename of the market metadata cache, shared by all instances on the same exchange
+    """
+    return 'markets-{}{}.json'.format(CONF.exchange, '-test' if CONF.test else '')
+
+
+def read_markets_cache(filename: str):
+    """
+    :return dict: timestamp, markets and currencies or None if there is no valid cache
+    """
+    try:
+        with open(filename, 'r') as file:
+            cache = json.load(file)
+        if cache.get('markets'):
+            return cache
+    except (OSError, ValueError, AttributeError) as error:
+        if os.path.isfile(filename):
+            LOG.warning('Ignoring market cache %s %s', filename, str(error.args))
+    return None
+
+
+def write_markets_cache(filename: str, exchange):
+    """
+    Writes the market metadata of the exchange, replacing the cache at once for instances reading it
+    """
+    cache = {'timestamp': time.time(), 'markets': exchange.markets, 'currencies': exchange.currencies}
+    temporary = '{}.{}.tmp'.format(filename, os.getpid())
+    try:
+        with open(temporary, 'w') as file:
+            json.dump(cache, file)
+        os.replace(temporary, filename)
+    except (OSError, TypeError, ValueError) as error:
+        LOG.warning('Failed to write market cache %s %s', filename, str(error.args))
+        if os.path.isfile(temporary):
+            os.remove(temporary)
+
+
+def prepare_markets(exchange):
+    """
+    Pre-populates the markets of the exchange from the disk cache, so the first call after a restart does not load them.
+    A cache older than markets_max_age is used nevertheless and refreshed in the background.
+    Without a cache the markets are loaded once and cached.
+    """
+    filename = get_markets_filename()
+    cache = read_markets_cache(filename)
+    if cache is None:
+        try:
+            exchange.load_markets()
+            write_markets_cache(filename, exchange)
+        except (ccxt.ExchangeError, ccxt.NetworkError) as error:
+            LOG.warning('Failed to load markets %s %s', type(error).__name__, str(error.args))
+        return
+    exchange.set_markets(cache['markets'], cache['currencies'])
+    if time.time() - cache['timestamp'] > CONF.markets_max_age:
+        threading.Thread(target=refresh_markets, args=(exchange, filename), daemon=True).start()
+
+
+def refresh_markets(exchange, filename: str):
+    """
+    Loads the markets through a separate public connection, so the trading calls are not blocked, and caches them.
+    The running exchange keeps its markets, like ccxt keeps them once loaded.
+    """
+    try:
+        public = type(exchange)({'enableRateLimit': True})
+        public.urls['api'] = exchange.urls['api']
+        public.load_markets()
+        write_markets_cache(filename, public)
+        LOG.info('Refreshed market cache %s', filename)
+    except (ccxt.ExchangeError, ccxt.NetworkError) as error:
+        LOG.warning('Failed to refresh markets %s %s', type(error).__name__, str(error.args))
+
+
 def write_control_file():
     with open(INSTANCE + '.pid', 'w') as file:
         file.write(str(os.getpid()) + ' ' + INSTANCE)
@@ -830,7 +1839,7 @@ def do_buy():
     """
     i = 1
     while i <= CONF.trade_trials:
-        buy_price = calculate_buy_price(get_current_price())
+        buy_price = calculate_buy_price(get_current_price(fresh=True))
         order_size = calculate_buy_order_size(buy_price)
         if order_size is None:
             return None
@@ -839,20 +1848,24 @@ def do_buy():
             LOG.error("Could not create buy order over %s", order_size)
             return None
         write_action('-BUY')
+        update_state(True, pending=order)
         order_status = poll_order_status(order.id, 10)
         if order_status in ['open', 'live']:
             cancel_order(order)
+            update_state(pending=None)
             i += 1
             if buy_or_sell() == 'SELL':
                 return do_sell()
             daily_report()
         else:
             return order
-    order_size = calculate_buy_order_size(get_current_price())
+    order_size = calculate_buy_order_size(get_current_price(fresh=True))
     if order_size is None:
         return None
     write_action('-BUY')
-    return create_market_buy_order(order_size)
+    order = create_market_buy_order(order_size)
+    update_state(True, pending=order)
+    return order
 
 
 def calculate_buy_price(price: float):
@@ -887,15 +1900,17 @@ def do_sell():
         return None
     i = 1
     while i <= CONF.trade_trials:
-        sell_price = calculate_sell_price(get_current_price())
+        sell_price = calculate_sell_price(get_current_price(fresh=True))
         order = create_sell_order(sell_price, order_size)
         if order is None:
             LOG.error("Could not create sell order over %s", order_size)
             return None
         write_action('-SELL')
+        update_state(True, pending=order)
         order_status = poll_order_status(order.id, 10)
         if order_status in ['open', 'live']:
             cancel_order(order)
+            update_state(pending=None)
             i += 1
             if buy_or_sell() == 'BUY':
                 return do_buy()
@@ -903,7 +1918,9 @@ def do_sell():
         else:
             return order
     write_action('-SELL')
-    return create_market_sell_order(order_size)
+    order = create_market_sell_order(order_size)
+    update_state(True, pending=order)
+    return order
 
 
 def calculate_sell_price(price: float):
@@ -915,6 +1932,7 @@ def calculate_sell_price(price: float):
     return round(price * (1 + CONF.trade_advantage_in_percent / 100), 1)
 
 
+@account_snapshot
 def calculate_buy_order_size(buy_price: float):
     """
     Calculates the buy order size. For BitMex the short position amount needs to be taken into account.
@@ -956,6 +1974,7 @@ def calculate_buy_order_size(buy_price: float):
     return size if size > MIN_ORDER_SIZE else None
 
 
+@account_snapshot
 def calculate_sell_order_size():
     """
     Calculates the sell order size. Depending on the configured short_in_percent value, the long position amount or the
@@ -1011,23 +2030,71 @@ def buy_or_sell():
 
 
 def get_mas():
-    current = get_current_price(1) if CONF.pair == "BTC/USD" else 0
-    relevant_rates = get_last_rates(calculate_fetch_size(CONF.ma_minutes_long))
-    ma_short = calculate_ma(relevant_rates, calculate_fetch_size(CONF.ma_minutes_short), current)
-    ma_long = calculate_ma(relevant_rates, calculate_fetch_size(CONF.ma_minutes_long), current)
+    current = get_current_price(1) if is_own_rate_symbol() else 0
+    mas = update_moving_averages()
+    ma_short = mas['short'].value(current)
+    ma_long = mas['long'].value(current)
     LOG.debug('Moving average long/short: %d/%d', ma_long, ma_short)
     return {'long': ma_long, 'short': ma_short}
 
 
+def update_moving_averages():
+    """
+    Brings the running moving averages up to date. Only the rates persisted since the last call are applied.
+    They are recalculated from scratch after a restart, a change of the window sizes, a gap in the data or once
+    mamaster has replaced the rate buffer because it rewrote rates.
+    :return dict: short and long MovingAverage
+    """
+    global MAS
+
+    buffer = get_rate_buffer()
+    source = buffer.inode if buffer is not None else None
+    size_short = calculate_fetch_size(CONF.ma_minutes_short)
+    size_long = calculate_fetch_size(CONF.ma_minutes_long)
+    size = max(size_short, size_long)
+    if MAS and MAS['cursor'] and MAS['source'] == source and MAS['short'].size == size_short and \
+            MAS['long'].size == size_long:
+        rates = get_rates_since(MAS['cursor'], size)
+        if len(rates) < size and MAS['short'].add(rates) and MAS['long'].add(rates):
+            if rates:
+                MAS['cursor'] = rates[0][1]
+            return MAS
+        LOG.info('Recalculating moving averages')
+    short = get_rates_sum(size_short)
+    long = get_rates_sum(size_long)
+    attempts = 1
+    while short[3] != long[3]:
+        # a rate has been persisted in between or the windows come from buffer and database which disagree
+        if attempts == MA_SEED_ATTEMPTS:
+            short, long = get_database_rates_sums(size_short, size_long)
+            break
+        attempts += 1
+        short = get_rates_sum(size_short)
+        long = get_rates_sum(size_long)
+    MAS = {'short': MovingAverage(size_short, short[0], short[1], short[2]),
+           'long': MovingAverage(size_long, long[0], long[1], long[2]), 'source': source}
+    last = long[3]
+    MAS['cursor'] = last[1] if last and len(last) > 1 else None
+    return MAS
+
+
 def fetch_order_status(order_id: str):
     """
-    Fetches the status of an order
+    Fetches the status of an order, unless the order ledger knows it is final already
     :param order_id: id of an order
     :return status of the order (open, closed, not found)
     """
+    ledger = get_order_ledger()
+    known = orders.get(ledger, order_id)
+    if known and known['status'] in orders.FINAL_STATUSES:
+        return known['status']
     try:
-        status = EXCHANGE.fetch_order_status(order_id)
+        order = EXCHANGE.fetch_order(order_id)
+        status = order['status']
         if status:
+            orders.store(ledger, CONF.pair, [order])
+            if status.lower() in ['closed', 'filled']:
+                invalidate_account()
             return status.lower()
         return 'not found'
     except ccxt.OrderNotFound:
@@ -1062,6 +2129,8 @@ def cancel_order(order: Order):
         try:
             if status in ['open', 'live']:
                 EXCHANGE.cancel_order(order.id)
+                orders.settle(get_order_ledger(), order.id, 'canceled')
+                invalidate_account()
                 LOG.info('Canceled %s', str(order))
                 return status
             if status in ['closed', 'canceled', 'filled']:
@@ -1098,6 +2167,7 @@ def create_sell_order(price: float, amount_crypto: float):
                                                              {'leverage': CONF.leverage_default + 1})
             else:
                 new_order = EXCHANGE.create_limit_sell_order(CONF.pair, amount_crypto, price, {'leverage': 2})
+        invalidate_account()
         norder = Order(new_order)
         LOG.info('Created %s', str(norder))
         return norder
@@ -1133,6 +2203,7 @@ def create_buy_order(price: float, amount_crypto: float):
             else:
                 new_order = EXCHANGE.create_limit_buy_order(CONF.pair, amount_crypto, price, {'oflags': 'fcib'})
 
+        invalidate_account()
         norder = Order(new_order)
         LOG.info('Created %s', str(norder))
         return norder
@@ -1163,9 +2234,10 @@ def create_market_sell_order(amount_crypto: float):
             else:
                 new_order = EXCHANGE.create_market_sell_order(CONF.pair, amount_crypto)
         elif CONF.exchange == 'bitmex':
-            amount_fiat = round(amount_crypto * get_current_price())
+            amount_fiat = round(amount_crypto * get_current_price(fresh=True))
             new_order = EXCHANGE.create_market_sell_order(CONF.pair, amount_fiat)
 
+        invalidate_account()
         norder = Order(new_order)
         LOG.info('Created market %s', str(norder))
         return norder
@@ -1209,6 +2281,7 @@ def update_stop_loss_order(stop_loss_price: float, amount: float, side: str, sto
                 new_order = EXCHANGE.create_order(CONF.pair, 'stop', direction, amount, None, {'stopPx': stop_loss_price})
             elif CONF.exchange == 'kraken':
                 new_order = EXCHANGE.create_order(CONF.pair, 'stop-loss', direction, amount, stop_loss_price)
+            invalidate_account()
             norder = Order(new_order)
             LOG.info('Created %s', str(norder))
             return norder
@@ -1231,7 +2304,7 @@ def create_market_buy_order(amount_crypto: float):
     """
     try:
         if CONF.exchange == 'bitmex':
-            cur_price = get_current_price()
+            cur_price = get_current_price(fresh=True)
             amount_fiat = round(amount_crypto * cur_price)
             new_order = EXCHANGE.create_market_buy_order(CONF.pair, amount_fiat)
         elif CONF.exchange == 'kraken':
@@ -1241,6 +2314,7 @@ def create_market_buy_order(amount_crypto: float):
             else:
                 new_order = EXCHANGE.create_market_buy_order(CONF.pair, amount_crypto, {'oflags': 'fcib'})
 
+        invalidate_account()
         norder = Order(new_order)
         LOG.info('Created market %s', str(norder))
         return norder
@@ -1268,6 +2342,7 @@ def get_position_balance():
         return get_used_balance()
 
 
+@account_snapshot
 def get_position_side():
     if CONF.exchange == 'bitmex':
         free = float(get_position_balance())
@@ -1286,12 +2361,12 @@ def get_used_balance():
     """
     try:
         if CONF.exchange == 'bitmex':
-            position = EXCHANGE.private_get_position()
+            position = fetch_account('private_get_position')
             if not position:
                 return None
             return position[0]['currentQty']
         if CONF.exchange == 'kraken':
-            result = EXCHANGE.private_post_tradebalance()['result']
+            result = fetch_account('private_post_tradebalance')['result']
             return round(float(result['e']) - float(result['mf']))
 
     except (ccxt.ExchangeError, ccxt.NetworkError) as error:
@@ -1319,7 +2394,7 @@ def get_fiat_balance():
 
 def get_balance(currency: str):
     try:
-        bal = EXCHANGE.fetch_balance()[currency]
+        bal = fetch_account('fetch_balance')[currency]
         if bal['used'] is None:
             bal['used'] = 0
         if bal['free'] is None:
@@ -1333,6 +2408,7 @@ def get_balance(currency: str):
         get_balance(currency)
 
 
+@account_snapshot
 def calculate_percentage_used():
     if CONF.exchange == 'bitmex':
         bal = get_crypto_balance()
@@ -1371,6 +2447,9 @@ def to_crypto_amount(fiat_amount: float, price: float):
 def sleep_for(greater: int, less: int):
     seconds = round(random.uniform(greater, less), 3)
     time.sleep(seconds)
+    deadline = getattr(REPORT_DEADLINE, 'value', None)
+    if deadline is not None and time.monotonic() > deadline:
+        raise ReportTimeout()
 
 
 def calculate_stop_loss_price(market_price: float, order_price: float, stop_loss_price: float, side: str):
@@ -1399,16 +2478,38 @@ def calculate_stop_loss_price(market_price: float, order_price: float, stop_loss
     return None
 
 
-def dump_database():
-    print('Dumping database into dump.csv')
-    dump_to_csv(get_all_entries())
-    print('Finished')
+def profile_startup():
+    """
+    Prints how long loading the modules imported on demand and connecting to the exchange take
+    """
+    timings = []
+    for name in DEFERRED_MODULES:
+        start = time.perf_counter()
+        # accessing an attribute completes a deferred import
+        getattr(importlib.import_module(name), '__name__')
+        timings.append((name, time.perf_counter() - start))
+    start = time.perf_counter()
+    exchange = connect_to_exchange()
+    timings.append(('exchange ' + CONF.exchange, time.perf_counter() - start))
+    start = time.perf_counter()
+    prepare_markets(exchange)
+    timings.append(('markets', time.perf_counter() - start))
+    for name, seconds in timings:
+        print('{:<28} {:>9.1f} ms'.format(name, seconds * 1000))
+    print('{:<28} {:>9.1f} ms'.format('total', sum(timing[1] for timing in timings) * 1000))
+
+
+def dump_database(options: dict):
+    filename = CONF.database + ('.csv.gz' if options['gzip'] else '.csv')
+    print('Dumping database into ' + filename)
+    count = export_rates(filename, options['since'], options['until'], options['gzip'], options['incremental'])
+    print('Finished, exported {} rates'.format(count))
 
 
 def do_post_trade_action(action: str, prefix: str = 'MA'):
     global STATE
 
-    STATE['last_action'] = action
+    update_state(True, last_action=action, pending=None)
     write_action(action)
     LOG.info('Filled %s', str(STATE['order']))
     trade_report(prefix)
@@ -1421,9 +2522,7 @@ def do_post_stop_loss_action():
 
     LOG.info('Filled stop %s order id %s @ %s', STATE['stop_loss_order'].side, STATE['stop_loss_order'].id, STATE['stop_loss_price'])
     trade_report('SL')
-    STATE['order'] = None
-    STATE['stop_loss_order'] = None
-    STATE['stop_loss_price'] = None
+    update_state(True, order=None, stop_loss_order=None, stop_loss_price=None)
 
 
 def calculate_stop_loss_size(force_recalculation: bool = False):
@@ -1444,10 +2543,14 @@ def fix_order_price(order: Order):
     """
     if not order.price:
         LOG.warning('Price of order %s was None', order.id)
-        fix = get_closed_order()
-        if fix.id == order.id and fix.price:
-            order.price = fix.price
-            del fix
+        try:
+            sync_closed_orders()
+        except (ccxt.ExchangeError, ccxt.NetworkError) as error:
+            LOG.error('Unable to sync the closed orders %s %s', type(error).__name__, str(error.args))
+        fix = orders.get(get_order_ledger(), order.id)
+        price = Order(fix).price if fix else None
+        if price:
+            order.price = price
     return order
 
 
@@ -1470,9 +2573,99 @@ def deactivate_bot(message: str):
     text = "Deactivated MA {}".format(INSTANCE)
     LOG.error(text)
     send_mail(text, message)
+    flush_mails(2 * MAIL_TIMEOUT)
     exit(0)
 
 
+def to_record(value):
+    """
+    :return the value as stored in the journal, orders as dict
+    """
+    if isinstance(value, Order):
+        return {name: getattr(value, name, None) for name in Order.__slots__}
+    return value
+
+
+def to_order(record: dict):
+    return Order(record) if record else None
+
+
+def update_state(durable: bool = False, **changes):
+    """
+    Applies a state transition and appends it to the journal
+    :param durable: sync the journal to disk, for transitions involving orders placed on the exchange
+    """
+    STATE.update(changes)
+    if JOURNAL is not None:
+        JOURNAL.append({key: to_record(value) for key, value in changes.items()}, durable)
+
+
+def sync_state():
+    if JOURNAL is not None:
+        JOURNAL.sync()
+
+
+def restore_state(journaled: dict):
+    """
+    Restores the state from the journal, reconciling it with the open orders fetched once from the exchange. An order
+    pending when the bot stopped, or an open limit order missing in the journal, is kept while it still matches the
+    current signal. A stop loss order missing in the journal is adopted. Without a pending order a -BUY or -SELL in
+    the action file means the order was placed but not journaled anymore, it is taken as filled if no longer open.
+    :param journaled: state replayed from the journal
+    :return Dict: the restored state
+    """
+    state = {'last_action': journaled['last_action'], 'order': to_order(journaled.get('order')),
+             'stop_loss_order': to_order(journaled.get('stop_loss_order')),
+             'stop_loss_price': journaled.get('stop_loss_price'), 'pending': None}
+    pending = to_order(journaled.get('pending'))
+    known = {o.id for o in (state['order'], state['stop_loss_order'], pending) if o}
+    untracked = None
+    open_orders = fetch_open_orders()
+    for order in open_orders:
+        if order.id in known:
+            continue
+        if order.type == 'stop':
+            if state['stop_loss_order'] and state['stop_loss_order'].id in {o.id for o in open_orders}:
+                LOG.warning('Replacing journaled stop loss %s', str(state['stop_loss_order']))
+                cancel_order(state['stop_loss_order'])
+            LOG.warning('Adopting stop loss %s missing in the journal', str(order))
+            state['stop_loss_order'] = order
+            state['stop_loss_price'] = order.price
+        elif pending is None and untracked is None:
+            LOG.warning('Found %s missing in the journal', str(order))
+            untracked = order
+        else:
+            LOG.warning('Canceling superfluous %s', str(order))
+            cancel_order(order)
+    if pending is None and untracked is None:
+        act = read_action() or ''
+        if act.startswith('-'):
+            LOG.warning('Pending action was %s', act)
+            state['last_action'] = act[1:].split()[0]
+            state['order'] = get_closed_order()
+            write_action(state['last_action'])
+        LOG.info('Restored last action %s', state['last_action'])
+        return state
+    if pending is None:
+        pending = untracked
+        status = 'open'
+    else:
+        status = fetch_order_status(pending.id)
+    action = 'BUY' if pending.side.startswith('b') else 'SELL'
+    if status in ['open', 'live']:
+        if buy_or_sell() == action:
+            LOG.info('Resuming pending %s', str(pending))
+            status = poll_order_status(pending.id, 10)
+        if status in ['open', 'live']:
+            status = cancel_order(pending)
+    if status in ['closed', 'filled']:
+        LOG.info('Pending %s was filled', str(pending))
+        state['order'] = pending
+        state['last_action'] = action
+    write_action(state['last_action'])
+    return state
+
+
 def init():
     """
     Populate the initial state
@@ -1527,14 +2720,19 @@ def init():
 
 if __name__ == '__main__':
     print('Starting MAverage Bot')
-    print('ccxt version:', ccxt.__version__)
 
     if len(sys.argv) > 1:
         INSTANCE = os.path.basename(sys.argv[1])
         if len(sys.argv) > 2:
             if sys.argv[2] == '-csv':
+                LOG = function_logger(logging.WARNING, INSTANCE)
                 CONF = ExchangeConfig()
-                dump_database()
+                dump_database(parse_export_arguments(sys.argv[3:]))
+                sys.exit(0)
+            if sys.argv[2] == '--startup-profile':
+                LOG = function_logger(logging.WARNING, INSTANCE)
+                CONF = ExchangeConfig()
+                profile_startup()
                 sys.exit(0)
             if sys.argv[2] == '-eo':
                 EMAIL_ONLY = True
@@ -1542,6 +2740,7 @@ if __name__ == '__main__':
                 RESET = True
     else:
         INSTANCE = os.path.basename(input('Filename with API Keys (config): ') or 'config')
+    print('ccxt version:', ccxt.__version__)
 
     LOG_FILENAME = 'log{}{}'.format(os.path.sep, INSTANCE)
     if not os.path.exists('log'):
@@ -1553,14 +2752,22 @@ if __name__ == '__main__':
     LOG.info('MAverage version: %s', CONF.bot_version)
 
     STATS = load_statistics()
+    start_mail_worker()
     EXCHANGE = connect_to_exchange()
+    prepare_markets(EXCHANGE)
 
     if EMAIL_ONLY:
         daily_report(True)
+        flush_mails(2 * MAIL_TIMEOUT)
         sys.exit(0)
 
     write_control_file()
-    STATE = init()
+    JOURNAL = journal.Journal(INSTANCE + '.jnl')
+    if JOURNAL.state.get('last_action') and not RESET:
+        STATE = restore_state(JOURNAL.state)
+    else:
+        STATE = init()
+    update_state(True, **STATE)
 
     if CONF.exchange == 'bitmex':
         MIN_ORDER_SIZE = 0.0001
@@ -1569,13 +2776,14 @@ if __name__ == '__main__':
         set_leverage(0)
 
     while 1:
+        ACCOUNT = {}
         ACTION = buy_or_sell()
 
         if not STATE['last_action'].startswith(ACTION):
             if ACTION == 'SELL':
-                STATE['order'] = do_sell()
+                update_state(order=do_sell())
             else:
-                STATE['order'] = do_buy()
+                update_state(order=do_buy())
             do_post_trade_action(ACTION)
 
         if CONF.stop_loss and STATE['order'] is not None:
@@ -1589,18 +2797,16 @@ if __name__ == '__main__':
                 if STATE['order'] is not None:
                     SIDE = 'SHORT' if str(STATE['order'].side).startswith('s') else 'LONG'
                     if not STATE['order'].price:
-                        STATE['order'] = fix_order_price(STATE['order'])
+                        update_state(order=fix_order_price(STATE['order']))
 
                     CURR_SLP = calculate_stop_loss_price(CURRENT_PRICE, STATE['order'].price, STATE['stop_loss_price'],
                                                          SIDE)
 
                     if is_better_price(CURR_SLP, SIDE):
-                        STATE['stop_loss_order'] = update_stop_loss_order(CURR_SLP, calculate_stop_loss_size(),
-                                                                          SIDE, STATE['stop_loss_order'])
-                        if STATE['stop_loss_order']:
-                            STATE['stop_loss_price'] = STATE['stop_loss_order'].price
-                        else:
-                            STATE['stop_loss_price'] = None
+                        SL_ORDER = update_stop_loss_order(CURR_SLP, calculate_stop_loss_size(), SIDE,
+                                                          STATE['stop_loss_order'])
+                        update_state(True, stop_loss_order=SL_ORDER, stop_loss_price=SL_ORDER.price if SL_ORDER else None)
 
         daily_report()
+        sync_state()
         sleep_for(110, 130)
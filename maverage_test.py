@@ -1,4 +1,9 @@
 import datetime
+import os
+import smtplib
+import sqlite3
+import sys
+import tempfile
 import unittest
 from math import isclose
 from unittest import mock
@@ -68,6 +73,132 @@ class MaverageTest(unittest.TestCase):
         self.assertEqual('SELL', state['last_action'][:4])
         self.assertEqual('s1o', state['order'].id)
 
+    @patch('maverage.logging')
+    @patch('maverage.read_action', return_value='BUY (since 2020-05-20 06:55:08 UTC)')
+    @patch('maverage.fetch_open_orders', return_value=[])
+    @patch('maverage.fetch_order_status')
+    def test_restore_state_without_pending_order(self, mock_fetch_order_status, mock_fetch_open_orders,
+                                                 mock_read_action, mock_logging):
+        maverage.LOG = mock_logging
+        maverage.STATE = {'last_action': None, 'order': None, 'stop_loss_order': None, 'stop_loss_price': None}
+        order = maverage.Order({'side': 'buy', 'id': 'b1', 'price': 9000, 'amount': 100, 'type': 'limit',
+                                'datetime': '2020-05-20T06:55:08Z'})
+        with tempfile.TemporaryDirectory() as directory:
+            maverage.JOURNAL = maverage.journal.Journal(os.path.join(directory, 'test.jnl'))
+            maverage.update_state(True, last_action='BUY', order=order, pending=order)
+            maverage.update_state(True, pending=None, stop_loss_price=8500)
+            maverage.JOURNAL.close()
+            journaled = maverage.journal.Journal(os.path.join(directory, 'test.jnl'))
+            journaled.close()
+        maverage.JOURNAL = None
+
+        state = maverage.restore_state(journaled.state)
+
+        self.assertEqual('BUY', state['last_action'])
+        self.assertEqual(str(order), str(state['order']))
+        self.assertEqual(8500, state['stop_loss_price'])
+        mock_fetch_order_status.assert_not_called()
+        mock_fetch_open_orders.assert_called_once()
+
+    @patch('maverage.fetch_open_orders', return_value=[])
+    @patch('maverage.logging')
+    @patch('maverage.write_action')
+    @patch('maverage.cancel_order')
+    @patch('maverage.poll_order_status', return_value='closed')
+    @patch('maverage.buy_or_sell', return_value='SELL')
+    @patch('maverage.fetch_order_status', return_value='open')
+    def test_restore_state_resumes_pending_order(self, mock_fetch_order_status, mock_buy_or_sell,
+                                                 mock_poll_order_status, mock_cancel_order, mock_write_action,
+                                                 mock_logging, mock_fetch_open_orders):
+        maverage.LOG = mock_logging
+        pending = {'side': 'sell', 'id': 's1o', 'price': 10000, 'amount': 100, 'type': 'limit', 'datetime': None}
+
+        state = maverage.restore_state({'last_action': 'BUY', 'pending': pending})
+
+        self.assertEqual('SELL', state['last_action'])
+        self.assertEqual('s1o', state['order'].id)
+        mock_cancel_order.assert_not_called()
+        mock_write_action.assert_called_with('SELL')
+
+    @patch('maverage.fetch_open_orders', return_value=[])
+    @patch('maverage.logging')
+    @patch('maverage.write_action')
+    @patch('maverage.cancel_order', return_value='open')
+    @patch('maverage.poll_order_status')
+    @patch('maverage.buy_or_sell', return_value='BUY')
+    @patch('maverage.fetch_order_status', return_value='open')
+    def test_restore_state_cancels_outdated_pending_order(self, mock_fetch_order_status, mock_buy_or_sell,
+                                                          mock_poll_order_status, mock_cancel_order, mock_write_action,
+                                                          mock_logging, mock_fetch_open_orders):
+        maverage.LOG = mock_logging
+        pending = {'side': 'sell', 'id': 's1o', 'price': 10000, 'amount': 100, 'type': 'limit', 'datetime': None}
+
+        state = maverage.restore_state({'last_action': 'BUY', 'pending': pending})
+
+        self.assertEqual('BUY', state['last_action'])
+        self.assertIsNone(state['order'])
+        mock_poll_order_status.assert_not_called()
+        mock_cancel_order.assert_called()
+
+    @patch('maverage.logging')
+    @patch('maverage.write_action')
+    @patch('maverage.cancel_order')
+    @patch('maverage.poll_order_status', return_value='closed')
+    @patch('maverage.buy_or_sell', return_value='BUY')
+    @patch('maverage.fetch_order_status')
+    @patch('maverage.fetch_open_orders')
+    def test_restore_state_resumes_order_missing_in_journal(self, mock_fetch_open_orders, mock_fetch_order_status,
+                                                            mock_buy_or_sell, mock_poll_order_status, mock_cancel_order,
+                                                            mock_write_action, mock_logging):
+        maverage.LOG = mock_logging
+        mock_fetch_open_orders.return_value = [maverage.Order({'side': 'buy', 'id': 'b2o', 'price': 9000, 'amount': 100,
+                                                               'type': 'limit', 'datetime': None})]
+
+        state = maverage.restore_state({'last_action': 'SELL'})
+
+        self.assertEqual('BUY', state['last_action'])
+        self.assertEqual('b2o', state['order'].id)
+        mock_fetch_order_status.assert_not_called()
+        mock_poll_order_status.assert_called_with('b2o', 10)
+        mock_cancel_order.assert_not_called()
+        mock_write_action.assert_called_with('BUY')
+
+    @patch('maverage.logging')
+    @patch('maverage.read_action', return_value='BUY (since 2020-05-20 06:55:08 UTC)')
+    @patch('maverage.cancel_order')
+    @patch('maverage.fetch_open_orders')
+    def test_restore_state_adopts_stop_loss_missing_in_journal(self, mock_fetch_open_orders, mock_cancel_order,
+                                                               mock_read_action, mock_logging):
+        maverage.LOG = mock_logging
+        stop = {'side': 'sell', 'id': 's3o', 'price': 8500, 'amount': 100, 'type': 'stop', 'datetime': None}
+        journaled_stop = dict(stop, id='s2o', price=8000)
+        mock_fetch_open_orders.return_value = [maverage.Order(journaled_stop), maverage.Order(stop)]
+
+        state = maverage.restore_state({'last_action': 'BUY', 'stop_loss_order': journaled_stop,
+                                        'stop_loss_price': 8000})
+
+        self.assertEqual('BUY', state['last_action'])
+        self.assertEqual('s3o', state['stop_loss_order'].id)
+        self.assertEqual(8500, state['stop_loss_price'])
+        self.assertEqual('s2o', mock_cancel_order.call_args[0][0].id)
+
+    @patch('maverage.logging')
+    @patch('maverage.write_action')
+    @patch('maverage.get_closed_order')
+    @patch('maverage.read_action', return_value='-BUY (since 2020-05-20 06:55:08 UTC)')
+    @patch('maverage.fetch_open_orders', return_value=[])
+    def test_restore_state_honours_pending_action(self, mock_fetch_open_orders, mock_read_action,
+                                                  mock_get_closed_order, mock_write_action, mock_logging):
+        maverage.LOG = mock_logging
+        mock_get_closed_order.return_value = maverage.Order({'side': 'buy', 'id': 'b1o', 'price': 9000,
+                                                             'amount': 100, 'type': 'limit', 'datetime': None})
+
+        state = maverage.restore_state({'last_action': 'SELL'})
+
+        self.assertEqual('BUY', state['last_action'])
+        self.assertEqual('b1o', state['order'].id)
+        mock_write_action.assert_called_with('BUY')
+
     def test_calculate_fetch_size_long(self):
         maverage.CONF = self.create_default_conf()
 
@@ -280,6 +411,85 @@ class MaverageTest(unittest.TestCase):
 
         self.assertIsNone(order_size)
 
+    @patch('maverage.time')
+    @patch('ccxt.bitmex')
+    def test_fetch_ticker_cached(self, mock_bitmex, mock_time):
+        maverage.CONF = self.create_default_conf()
+        maverage.EXCHANGE = mock_bitmex
+        maverage.TICKERS = {}
+        maverage.TICKER_STATS = {'hits': 0, 'misses': 0}
+        mock_bitmex.fetch_ticker.return_value = {'bid': 9000.5}
+        mock_time.monotonic.return_value = 100.0
+
+        self.assertEqual(9000, maverage.get_current_price())
+        mock_time.monotonic.return_value = 100.9
+        self.assertEqual(9000, maverage.get_current_price())
+        self.assertEqual(1, mock_bitmex.fetch_ticker.call_count)
+
+        self.assertEqual(9000, maverage.get_current_price(fresh=True))
+        mock_time.monotonic.return_value = 102.0
+        self.assertEqual(9000, maverage.get_current_price())
+
+        self.assertEqual(3, mock_bitmex.fetch_ticker.call_count)
+        self.assertEqual({'hits': 1, 'misses': 3}, maverage.TICKER_STATS)
+        maverage.TICKERS = {}
+
+    @patch('maverage.threading')
+    @patch('maverage.get_markets_filename')
+    @patch('ccxt.bitmex')
+    def test_prepare_markets_cached(self, mock_bitmex, mock_get_markets_filename, mock_threading):
+        maverage.CONF = self.create_default_conf()
+        mock_bitmex.markets = {'BTC/USD': {'id': 'XBTUSD', 'symbol': 'BTC/USD'}}
+        mock_bitmex.currencies = {'BTC': {'id': 'XBt', 'code': 'BTC'}}
+        with tempfile.TemporaryDirectory() as directory:
+            mock_get_markets_filename.return_value = os.path.join(directory, 'markets-bitmex.json')
+
+            maverage.prepare_markets(mock_bitmex)
+            maverage.prepare_markets(mock_bitmex)
+            maverage.CONF.markets_max_age = 0
+            maverage.prepare_markets(mock_bitmex)
+
+        mock_bitmex.load_markets.assert_called_once()
+        mock_bitmex.set_markets.assert_called_with(mock_bitmex.markets, mock_bitmex.currencies)
+        self.assertEqual(2, mock_bitmex.set_markets.call_count)
+        mock_threading.Thread.assert_called_once_with(target=maverage.refresh_markets,
+                                                      args=(mock_bitmex, mock_get_markets_filename.return_value),
+                                                      daemon=True)
+
+    @patch('ccxt.kraken')
+    def test_calculate_buy_order_size_fetches_balance_once_kraken(self, mock_kraken):
+        maverage.CONF = self.create_default_conf()
+        maverage.CONF.exchange = 'kraken'
+        maverage.EXCHANGE = mock_kraken
+        mock_kraken.fetch_balance.return_value = {'EUR': {'free': 0.104, 'used': None, 'total': 0}}
+
+        order_size = maverage.calculate_buy_order_size(12345)
+
+        self.assertAlmostEqual(0.099, order_size, 3)
+        mock_kraken.fetch_balance.assert_called_once()
+        self.assertIsNone(maverage.ACCOUNT)
+        self.assertIsNone(mock_kraken.fetch_balance.return_value['EUR']['used'])
+
+    @patch('maverage.logging')
+    @patch('ccxt.bitmex')
+    def test_account_snapshot_invalidated_by_order(self, mock_bitmex, mock_logging):
+        maverage.CONF = self.create_default_conf()
+        maverage.LOG = mock_logging
+        maverage.EXCHANGE = mock_bitmex
+        mock_bitmex.fetch_balance.return_value = {'BTC': {'free': 0.1, 'used': 0.1, 'total': 0.2}}
+        mock_bitmex.create_limit_buy_order.return_value = {'id': '1', 'price': 10000, 'amount': 100, 'side': 'buy',
+                                                            'type': 'limit', 'datetime': '2020-05-01'}
+        maverage.ACCOUNT = {}
+
+        maverage.get_crypto_balance()
+        maverage.get_crypto_balance()
+        self.assertEqual(1, mock_bitmex.fetch_balance.call_count)
+
+        maverage.create_buy_order(10000, 0.01)
+        maverage.get_crypto_balance()
+        self.assertEqual(2, mock_bitmex.fetch_balance.call_count)
+        maverage.ACCOUNT = None
+
     @patch('maverage.get_crypto_balance')
     @patch('maverage.get_position_info')
     def test_calculate_buy_order_size_from_no_position_bitmex(self, mock_get_position_info,
@@ -433,6 +643,17 @@ class MaverageTest(unittest.TestCase):
 
         self.assertEqual('SHORT', side)
 
+    def test_lazy_import(self):
+        sys.modules.pop('colorsys', None)
+
+        module = maverage.lazy_import('colorsys')
+
+        self.assertIs(module, sys.modules['colorsys'])
+        self.assertEqual('_LazyModule', type(module).__name__)
+        self.assertEqual((1, 1, 1), module.hsv_to_rgb(0, 0, 1))
+        self.assertIs(module, maverage.lazy_import('colorsys'))
+        sys.modules.pop('colorsys')
+
     def test_calculate_ma(self):
         rates = [([15000]), ([10000]), ([5000])]
 
@@ -448,6 +669,165 @@ class MaverageTest(unittest.TestCase):
         self.assertEqual(17500, maverage.calculate_ma(rates, 2, current_price))
         self.assertEqual(20000, maverage.calculate_ma(rates, 1, current_price))
 
+    def test_moving_average_including_current_price(self):
+        rates = [(15000, '2020-05-01 00:20:00'), (10000, '2020-05-01 00:10:00'), (5000, '2020-05-01 00:00:00')]
+
+        self.assertEqual(10000, maverage.MovingAverage.from_rates(3, rates).value())
+        self.assertEqual(12500, maverage.MovingAverage.from_rates(2, rates).value())
+        self.assertEqual(20000, maverage.MovingAverage.from_rates(2, rates).value(25000))
+        self.assertEqual(30000, maverage.MovingAverage.from_rates(1, rates).value(30000))
+
+    @patch('maverage.logging')
+    def test_update_moving_averages_incrementally(self, mock_logging):
+        maverage.CONF = self.create_default_conf()
+        maverage.LOG = mock_logging
+        maverage.MAS = None
+        with tempfile.TemporaryDirectory() as directory:
+            maverage.CONF.database = os.path.join(directory, 'mamaster.db')
+            conn = sqlite3.connect(maverage.CONF.database)
+            conn.execute("CREATE TABLE rates (date_time TEXT NOT NULL PRIMARY KEY, price INTEGER)")
+            start = datetime.datetime(2020, 5, 1)
+            for i in range(10):
+                conn.execute("INSERT INTO rates VALUES (?, ?)",
+                             (str(start + datetime.timedelta(minutes=10 * i)), 1000 + i * 7))
+            conn.commit()
+            maverage.update_moving_averages()
+
+            for i in range(10, 14):
+                conn.execute("INSERT INTO rates VALUES (?, ?)",
+                             (str(start + datetime.timedelta(minutes=10 * i)), 900 + i * 3))
+            conn.commit()
+            with patch('maverage.get_rates_sum') as mock_get_rates_sum:
+                mas = maverage.update_moving_averages()
+                mock_get_rates_sum.assert_not_called()
+            conn.close()
+            self.assertEqual([maverage.get_rates_sum(2), maverage.get_rates_sum(6)],
+                             maverage.get_database_rates_sums(2, 6))
+            rates = maverage.get_last_rates(6)
+
+            self.assertEqual(maverage.calculate_ma(rates, 2), mas['short'].value())
+            self.assertEqual(maverage.calculate_ma(rates, 6), mas['long'].value())
+            self.assertEqual(maverage.calculate_ma(rates, 6, 1200), mas['long'].value(1200))
+            maverage.database.close(maverage.CONF.database)
+        maverage.CONF.database = 'mamaster.db'
+        maverage.MAS = None
+
+    @patch('maverage.get_rates_sum')
+    def test_update_moving_averages_from_same_newest_rate(self, mock_get_rates_sum):
+        maverage.CONF = self.create_default_conf()
+        maverage.MAS = None
+        old = [(1000, 1588291200), (1010, 1588290600)]
+        new = [(1100, 1588291800)] + old
+        mock_get_rates_sum.side_effect = [(2, 2010, old[1], old[0]), (3, 3110, new[2], new[0]),
+                                          (2, 2100, new[1], new[0]), (3, 3110, new[2], new[0])]
+
+        mas = maverage.update_moving_averages()
+
+        self.assertEqual(4, mock_get_rates_sum.call_count)
+        self.assertEqual(1050, mas['short'].value())
+        self.assertEqual(1588291800, mas['cursor'])
+        maverage.MAS = None
+
+    @patch('maverage.get_database_rates_sums')
+    @patch('maverage.get_rates_sum')
+    def test_update_moving_averages_from_database_if_sources_disagree(self, mock_get_rates_sum,
+                                                                      mock_get_database_rates_sums):
+        maverage.CONF = self.create_default_conf()
+        maverage.MAS = None
+        old = [(1000, 1588291200), (1010, 1588290600)]
+        new = [(1100, 1588291800)] + old
+        mock_get_rates_sum.side_effect = lambda size: (2, 2100, new[1], new[0]) if size == 2 else (3, 3010, old[1],
+                                                                                                     old[0])
+        mock_get_database_rates_sums.return_value = [(2, 2100, new[1], new[0]), (3, 3110, new[2], new[0])]
+
+        mas = maverage.update_moving_averages()
+
+        self.assertEqual(2 * maverage.MA_SEED_ATTEMPTS, mock_get_rates_sum.call_count)
+        mock_get_database_rates_sums.assert_called_once_with(2, 6)
+        self.assertEqual(1050, mas['short'].value())
+        self.assertEqual(1588291800, mas['cursor'])
+        maverage.MAS = None
+
+    @patch('maverage.logging')
+    @patch('maverage.get_rates_since', return_value=[])
+    @patch('maverage.get_rates_sum', return_value=(2, 2000, (1000, 1588291200), (1000, 1588291800)))
+    @patch('maverage.get_rate_buffer')
+    def test_update_moving_averages_after_replaced_buffer(self, mock_get_rate_buffer, mock_get_rates_sum,
+                                                          mock_get_rates_since, mock_logging):
+        maverage.CONF = self.create_default_conf()
+        maverage.LOG = mock_logging
+        maverage.MAS = None
+        mock_get_rate_buffer.return_value.inode = 1
+        maverage.update_moving_averages()
+        maverage.update_moving_averages()
+        self.assertEqual(2, mock_get_rates_sum.call_count)
+
+        mock_get_rate_buffer.return_value.inode = 2
+        mas = maverage.update_moving_averages()
+
+        self.assertEqual(4, mock_get_rates_sum.call_count)
+        self.assertEqual(2, mas['source'])
+        maverage.MAS = None
+
+    @patch('maverage.logging')
+    def test_get_rate_symbol(self, mock_logging):
+        maverage.CONF = self.create_default_conf()
+        maverage.LOG = mock_logging
+        maverage.RATE_SYMBOL = None
+        with tempfile.TemporaryDirectory() as directory:
+            maverage.CONF.database = os.path.join(directory, 'mamaster.db')
+            conn = maverage.database.connect(maverage.CONF.database)
+            maverage.database.init_schema(conn, ['bitmex:BTC/USD', 'kraken:ETH/USD'])
+            maverage.database.insert_rates(conn, datetime.datetime(2020, 5, 1), {'bitmex:BTC/USD': 9000,
+                                                                                 'kraken:ETH/USD': 200})
+            maverage.CONF.exchange = 'kraken'
+            maverage.CONF.pair = 'ETH/USD'
+
+            self.assertEqual('kraken:ETH/USD', maverage.get_rate_symbol())
+            self.assertTrue(maverage.is_own_rate_symbol())
+            self.assertEqual('mamaster-kraken-ETH-USD.buf', maverage.CONF.rate_buffer_name)
+            self.assertEqual([(200, 1588291200)], maverage.get_last_rates(1))
+
+            maverage.RATE_SYMBOL = None
+            maverage.CONF.pair = 'XRP/USD'
+
+            self.assertEqual('bitmex:BTC/USD', maverage.get_rate_symbol())
+            self.assertFalse(maverage.is_own_rate_symbol())
+            mock_logging.warning.assert_called()
+            maverage.database.close(maverage.CONF.database)
+        maverage.CONF.database = 'mamaster.db'
+        maverage.RATE_SYMBOL = None
+
+    @patch('maverage.get_rate_symbol', return_value=None)
+    def test_export_rates_incremental(self, mock_get_rate_symbol):
+        maverage.CONF = self.create_default_conf()
+        with tempfile.TemporaryDirectory() as directory:
+            maverage.CONF.database = os.path.join(directory, 'mamaster.db')
+            conn = maverage.database.connect(maverage.CONF.database)
+            maverage.database.init_schema(conn, ['bitmex:BTC/USD'])
+            for i in range(3):
+                maverage.database.insert_rate(conn, datetime.datetime(2020, 5, 1, 0, 10 * i), 9000 + i)
+            filename = os.path.join(directory, 'mamaster.db.csv.gz')
+
+            self.assertEqual(2, maverage.export_rates(filename, datetime.datetime(2020, 5, 1, 0, 10), None, True, True))
+            maverage.database.insert_rate(conn, datetime.datetime(2020, 5, 1, 0, 30), 9003)
+            self.assertEqual(1, maverage.export_rates(filename, None, None, True, True))
+            self.assertEqual(0, maverage.export_rates(filename, None, None, True, True))
+
+            with maverage.gzip.open(filename, 'rt') as file:
+                self.assertEqual(['2020-05-01 00:10:00;9001', '2020-05-01 00:20:00;9002', '2020-05-01 00:30:00;9003'],
+                                 file.read().splitlines())
+            maverage.database.close()
+        maverage.CONF.database = 'mamaster.db'
+
+    def test_parse_export_arguments(self):
+        options = maverage.parse_export_arguments(['--since=2020-05-01', '--until=2020-06-01 12:00', '--gzip'])
+
+        self.assertEqual({'since': datetime.datetime(2020, 5, 1), 'until': datetime.datetime(2020, 6, 1, 12),
+                          'gzip': True, 'incremental': False}, options)
+        with self.assertRaises(SystemExit):
+            maverage.parse_export_arguments(['--since=May'])
+
     def test_get_last_rates(self):
         rates = maverage.get_last_rates(50)
 
@@ -518,6 +898,7 @@ class MaverageTest(unittest.TestCase):
         self.assertEqual(-33.33, today['mBalChan24'])
         self.assertEqual(-5.0, today['priceChan24'])
 
+    @patch('maverage.collect_report_data')
     @patch('maverage.create_report_part_trade')
     @patch('maverage.create_report_part_performance')
     @patch('maverage.create_report_part_advice')
@@ -525,7 +906,7 @@ class MaverageTest(unittest.TestCase):
     @patch('maverage.create_mail_part_general')
     def test_create_daily_report(self, mock_create_mail_part_general, mock_create_report_part_settings,
                                  mock_create_report_part_performance, mock_create_report_part_advice,
-                                 mock_create_report_part_trade):
+                                 mock_create_report_part_trade, mock_collect_report_data):
         maverage.INSTANCE = 'test'
         maverage.CONF = self.create_default_conf()
 
@@ -537,6 +918,7 @@ class MaverageTest(unittest.TestCase):
         mock_create_report_part_settings.assert_called()
         mock_create_mail_part_general.assert_called()
 
+    @patch('maverage.collect_report_data')
     @patch('maverage.create_report_part_trade')
     @patch('maverage.create_report_part_performance')
     @patch('maverage.create_report_part_advice')
@@ -544,7 +926,7 @@ class MaverageTest(unittest.TestCase):
     @patch('maverage.create_mail_part_general')
     def test_create_trade_report(self, mock_create_mail_part_general, mock_create_report_part_settings,
                                  mock_create_report_part_performance, mock_create_report_part_advice,
-                                 mock_create_report_part_trade):
+                                 mock_create_report_part_trade, mock_collect_report_data):
         maverage.CONF = self.create_default_conf()
         maverage.STATE = {'last_action': None, 'order': None, 'stop_loss_order': None, 'stop_loss_price': None}
 
@@ -557,8 +939,76 @@ class MaverageTest(unittest.TestCase):
         mock_create_mail_part_general.assert_called()
 
     @patch('maverage.logging')
-    @patch('maverage.get_last_rates')
-    def test_buy_or_sell_expecting_buy(self, mock_last_rates, mock_logging):
+    @patch('maverage.connect_report_exchange')
+    @patch('maverage.get_mayer')
+    @patch('maverage.get_used_balance', return_value=5000)
+    @patch('maverage.get_margin_leverage', return_value=1.5)
+    @patch('maverage.get_wallet_balance', return_value={'crypto': 0.2})
+    @patch('maverage.get_current_price')
+    @patch('maverage.get_net_deposits', return_value=0.1)
+    @patch('maverage.get_margin_balance', return_value={'free': 0.1, 'used': 0.1, 'total': 0.2})
+    def test_collect_report_data_times_out(self, mock_get_margin_balance, mock_get_net_deposits,
+                                           mock_get_current_price, mock_get_wallet_balance, mock_get_margin_leverage,
+                                           mock_get_used_balance, mock_get_mayer, mock_connect_report_exchange,
+                                           mock_logging):
+        maverage.LOG = mock_logging
+        release = maverage.threading.Event()
+        mock_get_mayer.side_effect = lambda: release.wait(5)
+        mock_get_current_price.side_effect = lambda: 10000 if maverage.get_exchange() is \
+            mock_connect_report_exchange.return_value else None
+        with patch.dict(maverage.REPORT_TIMEOUTS, {'mayer': 0.05}):
+
+            data = maverage.collect_report_data()
+
+        release.set()
+        self.assertIsNone(data['mayer'])
+        self.assertEqual(10000, data['price'])
+        self.assertEqual(5000, data['used_balance'])
+        mock_logging.warning.assert_called_once()
+
+    def test_connect_report_exchange(self):
+        maverage.CONF = self.create_default_conf()
+        maverage.EXCHANGE = maverage.connect_to_exchange()
+        maverage.EXCHANGE.set_markets([{'id': 'XBTUSD', 'symbol': 'BTC/USD', 'base': 'BTC', 'quote': 'USD',
+                                        'baseId': 'XBT', 'quoteId': 'USD', 'spot': False, 'swap': True}])
+
+        exchange = maverage.connect_report_exchange()
+
+        self.assertIsNot(maverage.EXCHANGE, exchange)
+        self.assertIsNot(maverage.EXCHANGE.session, exchange.session)
+        self.assertIs(maverage.EXCHANGE.throttle, exchange.throttle)
+        self.assertEqual('XBTUSD', exchange.market_id('BTC/USD'))
+        self.assertIs(maverage.EXCHANGE, maverage.get_exchange())
+        maverage.EXCHANGE = None
+
+    @patch('maverage.logging')
+    @patch('maverage.fetch_ticker', side_effect=ccxt.NetworkError('timed out'))
+    def test_report_task_stops_retrying_after_deadline(self, mock_fetch_ticker, mock_logging):
+        maverage.CONF = self.create_default_conf()
+        maverage.LOG = mock_logging
+        with patch('maverage.time') as mock_time:
+            mock_time.monotonic.side_effect = [1, 2, 3, 4]
+            with self.assertRaises(maverage.ReportTimeout):
+                maverage.run_report_task(maverage.get_current_price, 2.5)
+            maverage.sleep_for(4, 6)
+
+        self.assertEqual(3, mock_fetch_ticker.call_count)
+        self.assertIsNone(maverage.REPORT_DEADLINE.value)
+
+    def test_create_report_part_performance_not_available(self):
+        maverage.CONF = self.create_default_conf()
+        data = {'margin_balance': None, 'net_deposits': 0.1, 'price': None, 'wallet_balance': None, 'leverage': None,
+                'used_balance': None, 'mayer': None}
+
+        part = maverage.create_report_part_performance(False, data)
+
+        self.assertEqual(['Net deposits BTC:;0.1000', 'Overall performance in BTC:;n/a', 'Wallet balance BTC:;n/a',
+                          'Margin balance BTC:;n/a', 'BTC price EUR:;n/a', 'Used margin:;n/a', 'Actual leverage:;n/a',
+                          'Position EUR:;n/a'], part['csv'])
+
+    @patch('maverage.logging')
+    @patch('maverage.get_rates_sum')
+    def test_buy_or_sell_expecting_buy(self, mock_get_rates_sum, mock_logging):
         maverage.CONF = self.create_default_conf()
         maverage.CONF.ma_minutes_short = 120
         maverage.CONF.ma_minutes_long = 200
@@ -566,13 +1016,13 @@ class MaverageTest(unittest.TestCase):
         rates = [([25000]), ([25000]), ([24000]), ([24000]), ([23000]), ([23000]), ([22000]), ([22000]), ([21000]),
                  ([21000]), ([20000]), ([20000]), ([19000]), ([19000]), ([18000]), ([18000]), ([17000]), ([17000]),
                  ([16000]), ([11000])]
-        mock_last_rates.side_effect = [rates]
+        mock_get_rates_sum.side_effect = lambda size: (size, sum(rate[0] for rate in rates[:size]), rates[size - 1], rates[0])
 
         self.assertEqual('BUY', maverage.buy_or_sell())
 
     @patch('maverage.logging')
-    @patch('maverage.get_last_rates')
-    def test_buy_or_sell_expecting_sell(self, mock_last_rates, mock_logging):
+    @patch('maverage.get_rates_sum')
+    def test_buy_or_sell_expecting_sell(self, mock_get_rates_sum, mock_logging):
         maverage.CONF = self.create_default_conf()
         maverage.CONF.ma_minutes_short = 200
         maverage.CONF.ma_minutes_long = 40
@@ -580,7 +1030,7 @@ class MaverageTest(unittest.TestCase):
         rates = [([15000]), ([15000]), ([14000]), ([14000]), ([13000]), ([13000]), ([12000]), ([12000]), ([11000]),
                  ([11000]), ([10000]), ([10000]), ([19000]), ([19000]), ([18000]), ([18000]), ([17000]), ([17000]),
                  ([16000]), ([16000])]
-        mock_last_rates.side_effect = [rates]
+        mock_get_rates_sum.side_effect = lambda size: (size, sum(rate[0] for rate in rates[:size]), rates[size - 1], rates[0])
 
         self.assertEqual('SELL', maverage.buy_or_sell())
 
@@ -638,25 +1088,97 @@ class MaverageTest(unittest.TestCase):
 
     @patch('maverage.logging')
     @mock.patch.object(ccxt.bitmex, 'cancel_order')
-    @mock.patch.object(ccxt.bitmex, 'fetch_order_status')
-    def test_cancel_order(self, mock_fetch_order_status, mock_cancel_order, mock_logging):
+    @mock.patch.object(ccxt.bitmex, 'fetch_order')
+    def test_cancel_order(self, mock_fetch_order, mock_cancel_order, mock_logging):
         maverage.CONF = self.create_default_conf()
         maverage.CONF.test = False
         maverage.LOG = mock_logging
         maverage.EXCHANGE = maverage.connect_to_exchange()
 
-        order1 = maverage.Order({'side': 'sell', 'id': 's1o', 'price': 10000, 'amount': 100, 'type': 'limit',
-                                 'datetime': datetime.datetime.today().isoformat()})
-        order2 = maverage.Order({'side': 'buy', 'id': 'b2c', 'price': 9000, 'amount': 90, 'type': 'limit',
-                                 'datetime': datetime.datetime.today().isoformat()})
+        order1 = {'side': 'sell', 'id': 's1o', 'price': 10000, 'amount': 100, 'type': 'limit',
+                  'datetime': datetime.datetime.today().isoformat(), 'timestamp': 1, 'status': 'open'}
+        order2 = dict(order1, side='buy', id='b2c', price=9000, amount=90, status='filled')
+        mock_fetch_order.side_effect = {'s1o': order1, 'b2c': order2}.get
+        with tempfile.TemporaryDirectory() as directory:
+            maverage.INSTANCE = os.path.join(directory, 'test')
 
-        return_values = {'s1o': 'open', 'b2c': 'filled'}
-        mock_fetch_order_status.side_effect = return_values.get
-        maverage.cancel_order(order1)
-        mock_cancel_order.assert_called()
+            maverage.cancel_order(maverage.Order(order1))
+            mock_cancel_order.assert_called()
 
-        maverage.cancel_order(order2)
-        mock_logging.warning.assert_called_with('Order to be canceled %s was in status: %s', str(order2), 'filled')
+            maverage.cancel_order(maverage.Order(order2))
+            maverage.database.close()
+        maverage.INSTANCE = 'test'
+        mock_logging.warning.assert_called_with('Order to be canceled %s was in status: %s',
+                                                str(maverage.Order(order2)), 'filled')
+
+    @patch('maverage.EXCHANGE')
+    def test_sync_closed_orders(self, mock_exchange):
+        maverage.CONF = self.create_default_conf()
+        page = [{'id': str(i), 'amount': 1, 'side': 'buy', 'type': 'limit', 'price': 1, 'datetime': None,
+                 'timestamp': 1000 + i, 'status': 'closed'} for i in range(3)]
+        with tempfile.TemporaryDirectory() as directory, patch('maverage.ORDER_PAGE', 2):
+            maverage.INSTANCE = os.path.join(directory, 'test')
+            mock_exchange.has = {'fetchOrders': False}
+            mock_exchange.fetch_closed_orders.side_effect = [page[:1], page[1:], page[2:]]
+
+            maverage.sync_closed_orders()
+            maverage.sync_closed_orders()
+
+            last = maverage.get_order_ledger().execute('SELECT count(*) FROM orders').fetchone()[0]
+            maverage.database.close()
+        maverage.INSTANCE = 'test'
+        self.assertEqual(3, last)
+        mock_exchange.fetch_closed_orders.assert_has_calls([
+            call(maverage.CONF.pair, since=None, limit=3, params={'reverse': True}),
+            call(maverage.CONF.pair, since=1000, limit=2),
+            call(maverage.CONF.pair, since=1002, limit=2)])
+
+    @patch('maverage.logging')
+    @patch('maverage.EXCHANGE')
+    def test_get_closed_order_after_canceled_order(self, mock_exchange, mock_logging):
+        maverage.CONF = self.create_default_conf()
+        maverage.LOG = mock_logging
+        exchange = [{'id': 'o{}'.format(i), 'amount': 1, 'side': 'buy', 'type': 'limit', 'price': 1, 'datetime': None,
+                     'timestamp': 1000 + 10 * i, 'status': 'canceled' if i % 7 == 0 else 'closed'} for i in range(150)]
+
+        def fetch(since, limit, statuses):
+            return [order for order in exchange if order['timestamp'] >= since and order['status'] in statuses][:limit]
+
+        mock_exchange.fetch_order.side_effect = lambda order_id: next(o for o in exchange if o['id'] == order_id)
+        for has_fetch_orders in (True, False):
+            mock_exchange.reset_mock()
+            mock_exchange.has = {'fetchOrders': has_fetch_orders}
+            mock_exchange.fetch_orders.side_effect = lambda pair, since, limit: fetch(since, limit, ('closed', 'canceled'))
+            # as bitmex, if the orders were only fetched as closed orders
+            mock_exchange.fetch_closed_orders.side_effect = lambda pair, since, limit: fetch(since, limit, ('closed',))
+            with tempfile.TemporaryDirectory() as directory:
+                maverage.INSTANCE = os.path.join(directory, 'test')
+                ledger = maverage.get_order_ledger()
+                # o0 was open and has been canceled meanwhile
+                maverage.orders.store_open(ledger, maverage.CONF.pair, [dict(exchange[0], status='open')])
+                maverage.orders.store_open(ledger, maverage.CONF.pair, [])
+
+                self.assertEqual('o149', maverage.get_closed_order().id)
+                self.assertEqual('canceled', maverage.orders.get(ledger, 'o0')['status'])
+                self.assertEqual(2490, maverage.orders.closed_cursor(ledger, maverage.CONF.pair))
+                maverage.database.close()
+            maverage.INSTANCE = 'test'
+            self.assertEqual(0 if has_fetch_orders else 1, mock_exchange.fetch_order.call_count)
+
+    @patch('maverage.EXCHANGE')
+    def test_fetch_order_status_final_from_ledger(self, mock_exchange):
+        maverage.CONF = self.create_default_conf()
+        order = {'id': 'b1', 'amount': 1, 'side': 'buy', 'type': 'limit', 'price': 1, 'datetime': None,
+                 'timestamp': 1000, 'status': 'closed'}
+        mock_exchange.fetch_order.return_value = order
+        with tempfile.TemporaryDirectory() as directory, patch('maverage.invalidate_account'):
+            maverage.INSTANCE = os.path.join(directory, 'test')
+
+            self.assertEqual('closed', maverage.fetch_order_status('b1'))
+            self.assertEqual('closed', maverage.fetch_order_status('b1'))
+            maverage.database.close()
+        maverage.INSTANCE = 'test'
+        mock_exchange.fetch_order.assert_called_once_with('b1')
 
     def test_calculate_buy_price(self):
         maverage.CONF = self.create_default_conf()
@@ -887,6 +1409,91 @@ class MaverageTest(unittest.TestCase):
 
         mock_update_stop_loss_trade.assert_called_with(sl_order.id, 100)
 
+    @patch('maverage.get_rate_symbol', return_value=None)
+    def test_calculate_mayer(self, mock_get_rate_symbol):
+        maverage.CONF = self.create_default_conf()
+        today = int(datetime.datetime.utcnow().timestamp()) // 86400 * 86400
+        with tempfile.TemporaryDirectory() as directory:
+            maverage.INSTANCE = os.path.join(directory, 'test')
+            maverage.CONF.database = os.path.join(directory, 'mamaster.db')
+            conn = maverage.database.connect(maverage.CONF.database)
+            maverage.database.init_schema(conn, ['bitmex:BTC/USD'])
+            rates = [(today - day * 86400, 100) for day in range(250, 0, -1)]
+            maverage.database.backfill_rates(conn, 'bitmex:BTC/USD', rates + [(today, 150)])
+
+            mayer = maverage.calculate_mayer()
+
+            self.assertAlmostEqual(150 / 100.25, mayer['current'])
+            self.assertAlmostEqual(1, mayer['average'])
+            self.assertEqual(51, maverage.load_mayer_state()['count'])
+
+            maverage.database.backfill_rates(conn, 'bitmex:BTC/USD', [(today + 86400, 200)])
+            with patch('maverage.time') as mock_time:
+                mock_time.time.return_value = today + 2 * 86400
+                mayer = maverage.calculate_mayer()
+
+            self.assertEqual(53, maverage.load_mayer_state()['count'])
+            self.assertAlmostEqual((51 + 150 / 100.25 + 200 / 100.75) / 53, mayer['average'])
+            maverage.database.close()
+        maverage.CONF.database = 'mamaster.db'
+        maverage.INSTANCE = 'test'
+
+    @patch('maverage.get_rate_symbol', return_value='kraken:ETH/USD')
+    def test_calculate_mayer_from_btc_rates(self, mock_get_rate_symbol):
+        maverage.CONF = self.create_default_conf()
+        maverage.CONF.exchange = 'kraken'
+        maverage.CONF.pair = 'ETH/USD'
+        today = int(datetime.datetime.utcnow().timestamp()) // 86400 * 86400
+        with tempfile.TemporaryDirectory() as directory:
+            maverage.INSTANCE = os.path.join(directory, 'test')
+            maverage.CONF.database = os.path.join(directory, 'mamaster.db')
+            conn = maverage.database.connect(maverage.CONF.database)
+            maverage.database.init_schema(conn, ['kraken:ETH/USD'])
+            rates = [(today - day * 86400, 10) for day in range(250, 0, -1)]
+            maverage.database.backfill_rates(conn, 'kraken:ETH/USD', rates + [(today, 30)])
+
+            self.assertIsNone(maverage.calculate_mayer())
+
+            maverage.database.init_schema(conn, ['kraken:ETH/USD', 'bitmex:BTC/USD', 'kraken:XBT/USD'])
+            maverage.database.backfill_rates(conn, 'bitmex:BTC/USD', [(t, 100) for t, _ in rates] + [(today, 150)])
+            maverage.database.backfill_rates(conn, 'kraken:XBT/USD', [(t, 100) for t, _ in rates] + [(today, 200)])
+
+            mayer = maverage.calculate_mayer()
+
+            self.assertAlmostEqual(200 / 100.5, mayer['current'])
+            self.assertEqual('kraken:XBT/USD', maverage.load_mayer_state()['symbol'])
+            maverage.database.close()
+        maverage.CONF.database = 'mamaster.db'
+        maverage.INSTANCE = 'test'
+
+    @patch('maverage.EXCHANGE')
+    def test_get_net_deposits_kraken(self, mock_exchange):
+        maverage.CONF = self.create_default_conf()
+        maverage.CONF.exchange = 'kraken'
+        mock_exchange.fetch_deposits.side_effect = [
+            [{'id': 'd1', 'txid': None, 'amount': 1.0, 'timestamp': 1600000000000}],
+            [{'id': 'd1', 'txid': None, 'amount': 1.0, 'timestamp': 1600000000000},
+             {'id': 'd2', 'txid': None, 'amount': 0.5, 'timestamp': 1600100000000}]]
+        mock_exchange.private_post_ledgers.side_effect = [
+            {'result': {'ledger': {'w1': {'amount': '-0.2', 'time': 1600050000.5}}, 'count': 2}},
+            {'result': {'ledger': {'w2': {'amount': '-0.1', 'time': 1600060000.1}}, 'count': 2}},
+            {'result': {'ledger': {'w2': {'amount': '-0.1', 'time': 1600060000.1}}, 'count': 1}}]
+        with tempfile.TemporaryDirectory() as directory:
+            maverage.INSTANCE = os.path.join(directory, 'test')
+
+            self.assertAlmostEqual(0.7, maverage.get_net_deposits())
+            self.assertAlmostEqual(1.2, maverage.get_net_deposits())
+            ledger = maverage.load_ledger()
+        maverage.INSTANCE = 'test'
+
+        self.assertEqual(1600100000000, ledger['deposits_since'])
+        self.assertEqual(1600060000, ledger['withdrawals_start'])
+        self.assertEqual(['d1', 'd2'], sorted(ledger['deposits']))
+        mock_exchange.fetch_deposits.assert_called_with('BTC', 1600000000000)
+        mock_exchange.private_post_ledgers.assert_any_call({'asset': 'XBt', 'type': 'withdrawal', 'ofs': 1})
+        mock_exchange.private_post_ledgers.assert_called_with({'asset': 'XBt', 'type': 'withdrawal', 'ofs': 0,
+                                                              'start': 1600059999})
+
     def test_evaluate_mayer_buy(self):
         advice = maverage.evaluate_mayer({'current': 1, 'average': 1.5})
 
@@ -928,8 +1535,9 @@ class MaverageTest(unittest.TestCase):
         self.assertTrue(csv_part.rfind('n/a') > 0)
 
     @patch('maverage.logging')
+    @patch('maverage.get_open_order', return_value=None)
     @patch('maverage.cancel_order')
-    def test_update_stop_loss_order_without_existing(self, mock_cancel_order, mock_logging):
+    def test_update_stop_loss_order_without_existing(self, mock_cancel_order, mock_get_open_order, mock_logging):
         maverage.CONF = self.create_default_conf()
         maverage.LOG = mock_logging
 
@@ -938,9 +1546,10 @@ class MaverageTest(unittest.TestCase):
         mock_cancel_order.assert_not_called()
 
     @patch('maverage.logging')
+    @patch('maverage.get_open_order', return_value=None)
     @patch('maverage.cancel_order', return_value='open')
     @patch('ccxt.bitmex')
-    def test_update_stop_loss_order(self, mock_bitmex, mock_cancel_order, mock_logging):
+    def test_update_stop_loss_order(self, mock_bitmex, mock_cancel_order, mock_get_open_order, mock_logging):
         maverage.CONF = self.create_default_conf()
         maverage.LOG = mock_logging
         maverage.EXCHANGE = mock_bitmex
@@ -994,6 +1603,131 @@ class MaverageTest(unittest.TestCase):
         mock_logging.error.assert_called()
         mock_deactivate_bot.assert_called()
 
+    @patch('maverage.logging')
+    @patch('maverage.connect_to_mail_server')
+    @patch('maverage.get_mail_queue')
+    def test_send_queued_mails(self, mock_get_mail_queue, mock_connect_to_mail_server, mock_logging):
+        maverage.CONF = self.create_default_conf()
+        maverage.LOG = mock_logging
+        server = mock_connect_to_mail_server.return_value
+        with tempfile.TemporaryDirectory() as directory:
+            mock_get_mail_queue.return_value = os.path.join(directory, 'mail')
+            attachment = os.path.join(directory, 'test.csv')
+            with open(attachment, 'w') as file:
+                file.write('test;1')
+            maverage.send_mail('Daily', 'report', attachment)
+            maverage.send_mail('Trade', 'report')
+            server.send_message.side_effect = [None, OSError('timed out')]
+
+            with self.assertRaises(OSError):
+                maverage.send_queued_mails(None)
+            self.assertEqual(1, len(maverage.get_queued_mails()))
+
+            server.send_message.side_effect = None
+            self.assertIs(server, maverage.send_queued_mails(server))
+            self.assertEqual([], maverage.get_queued_mails())
+            self.assertTrue(maverage.flush_mails(0))
+
+        mock_connect_to_mail_server.assert_called_once()
+        self.assertEqual(3, server.send_message.call_count)
+        first, second = (args[0][0] for args in server.send_message.call_args_list[:2])
+        self.assertEqual('Daily', first['Subject'])
+        self.assertEqual(b'test;1', first.get_payload()[1].get_payload(decode=True))
+        self.assertEqual('Trade', second['Subject'])
+
+    @patch('maverage.logging')
+    @patch('maverage.connect_to_mail_server')
+    @patch('maverage.get_mail_queue')
+    def test_send_queued_mails_moves_rejected_mails_to_dead_letters(self, mock_get_mail_queue,
+                                                                    mock_connect_to_mail_server, mock_logging):
+        maverage.CONF = self.create_default_conf()
+        maverage.LOG = mock_logging
+        server = mock_connect_to_mail_server.return_value
+        with tempfile.TemporaryDirectory() as directory:
+            mock_get_mail_queue.return_value = os.path.join(directory, 'mail')
+            os.makedirs(mock_get_mail_queue.return_value)
+            with open(os.path.join(mock_get_mail_queue.return_value, '1.json'), 'w') as file:
+                file.write('{"subject": ')
+            for subject in ('Rejected', 'Deferred', 'Deactivated'):
+                maverage.send_mail(subject, 'text')
+            server.send_message.side_effect = [smtplib.SMTPRecipientsRefused({'to@test.com': (550, b'unknown')}),
+                                               smtplib.SMTPDataError(451, b'try again'), None, None]
+
+            with self.assertRaises(smtplib.SMTPDataError):
+                maverage.send_queued_mails(None)
+            maverage.send_queued_mails(server)
+
+            self.assertEqual([], maverage.get_queued_mails())
+            self.assertEqual(2, len(os.listdir(maverage.get_dead_letters())))
+        subjects = [args[0][0]['Subject'] for args in server.send_message.call_args_list]
+        self.assertEqual(['Rejected', 'Deferred', 'Deferred', 'Deactivated'], subjects)
+        self.assertEqual(2, mock_logging.error.call_count)
+
+    @patch('maverage.logging')
+    @patch('maverage.send_queued_mails', side_effect=[PermissionError('queue'), KeyError('broken'), None])
+    def test_mail_worker_survives_unexpected_errors(self, mock_send_queued_mails, mock_logging):
+        maverage.LOG = mock_logging
+        waits = []
+
+        def wait(timeout):
+            waits.append(timeout)
+            if len(waits) == 3:
+                raise SystemExit()
+            return True
+
+        with patch.object(maverage.MAIL_WAKEUP, 'wait', side_effect=wait):
+            with self.assertRaises(SystemExit):
+                maverage.run_mail_worker()
+
+        self.assertEqual([maverage.MAIL_BACKOFF[0], 2 * maverage.MAIL_BACKOFF[0], None], waits)
+        self.assertEqual(2, mock_logging.warning.call_count)
+
+    @patch('maverage.logging')
+    @patch('maverage.send_mail')
+    def test_aggregate_reports(self, mock_send_mail, mock_logging):
+        maverage.CONF = self.create_default_conf()
+        maverage.LOG = mock_logging
+        day = datetime.date(2021, 3, 2)
+        with tempfile.TemporaryDirectory() as directory, patch('maverage.FLEET_STORE', directory):
+            os.makedirs(os.path.join(directory, '2021-03-01'))
+            for instance, recipients in (('bot1', ['a@example.org']), ('bot2', ['a@example.org', 'b@example.org'])):
+                maverage.INSTANCE = instance
+                maverage.CONF.recipient_addresses = recipients
+                content = {'text': 'report ' + instance, 'csv': instance + ';1\n'}
+                self.assertTrue(maverage.publish_report(day, content))
+
+            maverage.aggregate_reports(day)
+            maverage.aggregate_reports(day)
+            late = maverage.publish_report(day, {'text': 'late', 'csv': 'bot3;1\n'})
+
+            self.assertEqual(['2021-03-02'], os.listdir(directory))
+        self.assertFalse(late)
+        self.assertEqual(day, maverage.FLEET_AGGREGATED)
+        self.assertEqual(2, mock_send_mail.call_count)
+        subject, text, _, recipients = mock_send_mail.call_args_list[0][0]
+        self.assertEqual('Daily MAverage fleet report (2 bots)', subject)
+        self.assertEqual(['a@example.org'], recipients)
+        self.assertIn('report bot1', text)
+        self.assertIn('report bot2', text)
+        subject, text, _, recipients = mock_send_mail.call_args_list[1][0]
+        self.assertEqual('Daily MAverage fleet report (1 bots)', subject)
+        self.assertEqual(['b@example.org'], recipients)
+        self.assertNotIn('report bot1', text)
+
+    def test_get_report_time(self):
+        maverage.CONF = self.create_default_conf()
+        maverage.INSTANCE = 'test'
+        self.assertEqual(datetime.time(12, 1), maverage.get_report_time())
+
+        maverage.CONF.fleet_report = True
+        slot = maverage.get_report_time()
+        maverage.INSTANCE = 'test2'
+        other = maverage.get_report_time()
+        maverage.CONF.fleet_report = False
+
+        self.assertTrue(datetime.time(12, 1) <= slot < datetime.time(12, 15))
+        self.assertNotEqual(slot, other)
+
     @patch('maverage.logging')
     @patch('maverage.send_mail')
     @patch('os.remove')
@@ -1027,6 +1761,13 @@ class MaverageTest(unittest.TestCase):
         conf.ma_minutes_short = 20
         conf.ma_minutes_long = 60
         conf.database = 'mamaster.db'
+        conf.rate_buffer = 'mamaster.buf'
+        conf.rate_buffer_name = 'mamaster.buf'
+        conf.rate_symbol = ''
+        conf.ticker_max_age = 1
+        conf.markets_max_age = 86400
+        conf.mayer_cross_check = False
+        conf.fleet_report = False
         conf.interval = 10
         conf.short_in_percent = 50
         conf.trade_trials = 5
@@ -0,0 +1,123 @@
+"""
+Local ledger of the orders of a MAverage instance, kept in its own SQLite database (<instance>.orders.db).
+The open orders are replaced as a whole whenever they are fetched, the closed ones are synced incrementally since the
+oldest order that might have been closed meanwhile. Orders are stored as the relevant fields of the ccxt order, so
+Order objects can be restored by id without asking the exchange.
+"""
+import json
+import sqlite3
+
+import database
+
+SCHEMA = ("CREATE TABLE IF NOT EXISTS orders (id TEXT NOT NULL PRIMARY KEY, pair TEXT NOT NULL, status TEXT, "
+          "timestamp INTEGER, data TEXT NOT NULL)")
+INDEX = "CREATE INDEX IF NOT EXISTS orders_pair_timestamp ON orders (pair, timestamp)"
+QUERIES = {
+    'store': "INSERT INTO orders VALUES (?, ?, ?, ?, ?) ON CONFLICT(id) DO UPDATE SET status = excluded.status, "
+             "timestamp = excluded.timestamp, data = excluded.data",
+    'get': "SELECT data FROM orders WHERE id = ?",
+    'open': "SELECT id FROM orders WHERE pair = ? AND status = 'open'",
+    'unsettle': "UPDATE orders SET status = NULL WHERE id = ?",
+    'settle': "UPDATE orders SET status = ?, data = ? WHERE id = ?",
+    'newest_open': "SELECT data FROM orders WHERE pair = ? AND status = 'open' ORDER BY timestamp DESC LIMIT 1",
+    'newest_filled': "SELECT data FROM orders WHERE pair = ? AND status IN ('closed', 'filled') "
+                     "ORDER BY timestamp DESC LIMIT 1",
+    'unsettled_ids': "SELECT id FROM orders WHERE pair = ? AND status IS NULL",
+    'unsettled': "SELECT min(timestamp) FROM orders WHERE pair = ? AND status IS NULL",
+    'newest_closed': "SELECT max(timestamp) FROM orders WHERE pair = ? AND status IN ('closed', 'filled')",
+}
+# statuses an order does not leave anymore
+FINAL_STATUSES = ('closed', 'filled', 'canceled', 'cancelled', 'expired', 'rejected')
+FIELDS = ('id', 'amount', 'side', 'type', 'price', 'datetime', 'timestamp', 'status')
+
+
+def connect(filename: str):
+    """
+    Returns the connection to the ledger, creating it on first use
+    :param filename: filename of the ledger, e.g. test1.orders.db
+    :return sqlite3.Connection
+    """
+    conn = database.connect(filename)
+    conn.execute(SCHEMA)
+    conn.execute(INDEX)
+    return conn
+
+
+def to_record(ccxt_order: dict):
+    """
+    Reduces a ccxt order to the fields needed to restore it, including the stop price of bitmex
+    """
+    record = {field: ccxt_order.get(field) for field in FIELDS}
+    if 'info' in ccxt_order and 'stopPx' in ccxt_order['info']:
+        record['info'] = {'stopPx': ccxt_order['info']['stopPx']}
+    if record['status']:
+        record['status'] = record['status'].lower()
+    return record
+
+
+def store(conn: sqlite3.Connection, pair: str, ccxt_orders: list):
+    """
+    Inserts or updates the orders
+    """
+    records = [to_record(order) for order in ccxt_orders]
+    with conn:
+        conn.executemany(QUERIES['store'], [(str(record['id']), pair, record['status'], record['timestamp'],
+                                             json.dumps(record)) for record in records])
+
+
+def store_open(conn: sqlite3.Connection, pair: str, ccxt_orders: list):
+    """
+    Stores the currently open orders. Orders open before but missing now are left without status until they are
+    synced as closed orders.
+    """
+    current = {str(order['id']) for order in ccxt_orders}
+    missing = [(row[0],) for row in conn.execute(QUERIES['open'], (pair,)) if row[0] not in current]
+    store(conn, pair, [dict(order, status='open') for order in ccxt_orders])
+    with conn:
+        conn.executemany(QUERIES['unsettle'], missing)
+
+
+def get(conn: sqlite3.Connection, order_id: str):
+    """
+    :return dict: the stored ccxt fields of the order or None
+    """
+    row = conn.execute(QUERIES['get'], (str(order_id),)).fetchone()
+    return json.loads(row[0]) if row else None
+
+
+def newest(conn: sqlite3.Connection, pair: str, closed: bool = False):
+    """
+    :param closed: the newest closed (filled) order instead of the newest open one, canceled orders are skipped
+    :return dict: the stored ccxt fields of the order or None
+    """
+    row = conn.execute(QUERIES['newest_filled' if closed else 'newest_open'], (pair,)).fetchone()
+    return json.loads(row[0]) if row else None
+
+
+def unsettled(conn: sqlite3.Connection, pair: str):
+    """
+    :return list: ids of the orders that are no longer open but whose final status is not known yet
+    """
+    return [row[0] for row in conn.execute(QUERIES['unsettled_ids'], (pair,))]
+
+
+def settle(conn: sqlite3.Connection, order_id: str, status: str):
+    """
+    Sets the final status of a stored order, e.g. once it has been canceled
+    """
+    record = get(conn, order_id)
+    if record:
+        record['status'] = status
+        with conn:
+            conn.execute(QUERIES['settle'], (status, json.dumps(record), str(order_id)))
+
+
+def closed_cursor(conn: sqlite3.Connection, pair: str):
+    """
+    Canceled or expired orders are left out, as the exchange might not list them among the closed orders again.
+    :return int: milliseconds to sync the closed orders from, the newest closed order or the oldest one that is no
+    longer open but not known to be closed, None if the ledger holds neither
+    """
+    cursors = [conn.execute(QUERIES[name], (pair,)).fetchone()[0] for name in ('unsettled', 'newest_closed')]
+    cursors = [cursor for cursor in cursors if cursor is not None]
+    return min(cursors) if cursors else None
@@ -0,0 +1,69 @@
+import os
+import tempfile
+import unittest
+
+import database
+import orders
+
+PAIR = 'BTC/USD'
+
+
+def create_order(order_id: str, timestamp: int, status: str = 'open', price: float = 10000):
+    return {'id': order_id, 'amount': 100, 'side': 'Buy', 'type': 'limit', 'price': price,
+            'datetime': str(timestamp), 'timestamp': timestamp, 'status': status, 'info': {'orderID': order_id}}
+
+
+class OrdersTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.conn = orders.connect(os.path.join(self.directory.name, 'test.orders.db'))
+
+    def tearDown(self):
+        database.close()
+        self.directory.cleanup()
+
+    def test_store_and_get(self):
+        stop = dict(create_order('s1', 1000, 'Open', None), type='stop', info={'stopPx': 9000})
+        orders.store(self.conn, PAIR, [stop])
+
+        record = orders.get(self.conn, 's1')
+
+        self.assertEqual('open', record['status'])
+        self.assertEqual({'stopPx': 9000}, record['info'])
+        self.assertIsNone(orders.get(self.conn, 'unknown'))
+
+    def test_store_open_clears_status_of_missing_orders(self):
+        orders.store_open(self.conn, PAIR, [create_order('o1', 1000), create_order('o2', 2000)])
+
+        orders.store_open(self.conn, PAIR, [create_order('o2', 2000)])
+
+        self.assertEqual('open', orders.get(self.conn, 'o2')['status'])
+        self.assertIsNone(self.conn.execute("SELECT status FROM orders WHERE id = 'o1'").fetchone()[0])
+        self.assertEqual('o2', orders.newest(self.conn, PAIR)['id'])
+
+    def test_closed_cursor(self):
+        self.assertIsNone(orders.closed_cursor(self.conn, PAIR))
+
+        orders.store(self.conn, PAIR, [create_order('c1', 3000, 'closed'), create_order('c2', 5000, 'canceled')])
+        orders.store_open(self.conn, PAIR, [create_order('o1', 2000), create_order('o2', 4000)])
+        self.assertEqual(3000, orders.closed_cursor(self.conn, PAIR))
+        self.assertEqual('c1', orders.newest(self.conn, PAIR, True)['id'])
+
+        orders.store_open(self.conn, PAIR, [create_order('o2', 4000)])
+        self.assertEqual(2000, orders.closed_cursor(self.conn, PAIR))
+        self.assertEqual(['o1'], orders.unsettled(self.conn, PAIR))
+
+        orders.settle(self.conn, 'o1', 'canceled')
+        self.assertEqual('canceled', orders.get(self.conn, 'o1')['status'])
+        self.assertEqual([], orders.unsettled(self.conn, PAIR))
+        self.assertEqual(3000, orders.closed_cursor(self.conn, PAIR))
+
+        orders.store(self.conn, PAIR, [create_order('o2', 4000, 'closed')])
+        self.assertEqual(4000, orders.closed_cursor(self.conn, PAIR))
+        self.assertEqual('o2', orders.newest(self.conn, PAIR, True)['id'])
+        self.assertIsNone(orders.closed_cursor(self.conn, 'ETH/USD'))
+
+
+if __name__ == '__main__':
+    unittest.main()
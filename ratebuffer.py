@@ -0,0 +1,231 @@
+"""
+Memory mapped ring buffer holding the most recent rates.
+It is written by mamaster and read by any number of MAverage instances without touching the database.
+
+Layout (little endian):
+    header:     magic, version, capacity, count, head (next slot), sequence - padded to 64 bytes
+    timestamps: int64[capacity] epoch seconds (UTC)
+    prices:     float64[capacity]
+The sequence is odd while the writer updates a slot, so readers retry until they got a consistent snapshot.
+"""
+import calendar
+import datetime
+import mmap
+import os
+import re
+import struct
+
+MAGIC = b'MARB'
+VERSION = 1
+HEADER = struct.Struct('<4sIQQQQ')
+HEADER_SIZE = 64
+READ_ATTEMPTS = 100
+
+
+def to_epoch(date_time):
+    """
+    Converts a datetime, a database datetime string or epoch seconds into epoch seconds
+    :param date_time: datetime (UTC), str ('%Y-%m-%d %H:%M:%S') or int
+    :return int: epoch seconds
+    """
+    if isinstance(date_time, str):
+        date_time = datetime.datetime.strptime(date_time[:19], '%Y-%m-%d %H:%M:%S')
+    if isinstance(date_time, datetime.datetime):
+        return calendar.timegm(date_time.timetuple())
+    return int(date_time)
+
+
+def to_datetime(epoch: int):
+    """
+    Converts epoch seconds into a naive UTC datetime
+    """
+    return datetime.datetime(1970, 1, 1) + datetime.timedelta(seconds=epoch)
+
+
+def buffer_name(filename: str, symbol: str):
+    """
+    Derives the filename of the buffer holding the rates of a symbol other than the default one
+    :param filename: filename of the default buffer, e.g. mamaster.buf
+    :param symbol: 'exchange:pair', e.g. kraken:ETH/USD
+    :return str: e.g. mamaster-kraken-ETH-USD.buf
+    """
+    base, extension = os.path.splitext(filename)
+    return '{}-{}{}'.format(base, re.sub('[^A-Za-z0-9]+', '-', symbol).strip('-'), extension)
+
+
+class RateBuffer:
+    """
+    Fixed size ring buffer of (timestamp, price) pairs in a shared memory mapped file
+    """
+
+    def __init__(self, filename: str, capacity: int = None):
+        """
+        Opens the buffer file. With a capacity the buffer is opened for writing and (re)created if necessary,
+        without it is opened read only.
+        :param filename: path of the buffer file
+        :param capacity: number of rates to be held (writer only)
+        """
+        self.filename = filename
+        self.writable = capacity is not None
+        if self.writable and not self._is_valid_file(capacity):
+            # build a new file and swap it in, readers still mapping the old one notice it via is_stale()
+            with open(filename + '.tmp', 'wb') as file:
+                file.write(HEADER.pack(MAGIC, VERSION, capacity, 0, 0, 0))
+                file.truncate(HEADER_SIZE + 16 * capacity)
+            os.replace(filename + '.tmp', filename)
+        self.file = open(filename, 'r+b' if self.writable else 'rb')
+        self.inode = os.fstat(self.file.fileno()).st_ino
+        if not self._is_valid(self.file):
+            self.file.close()
+            raise ValueError('Invalid rate buffer ' + filename)
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_WRITE if self.writable else mmap.ACCESS_READ)
+        self.capacity = self._header()[2]
+        view = memoryview(self.map)
+        self.timestamps = view[HEADER_SIZE:HEADER_SIZE + 8 * self.capacity].cast('q')
+        self.prices = view[HEADER_SIZE + 8 * self.capacity:HEADER_SIZE + 16 * self.capacity].cast('d')
+        view.release()
+
+    def _is_valid_file(self, capacity: int):
+        if not os.path.isfile(self.filename):
+            return False
+        with open(self.filename, 'rb') as file:
+            return self._is_valid(file, capacity)
+
+    @staticmethod
+    def _is_valid(file, capacity: int = None):
+        file.seek(0, os.SEEK_END)
+        size = file.tell()
+        if size < HEADER_SIZE:
+            return False
+        file.seek(0)
+        magic, version, stored_capacity, _, _, _ = HEADER.unpack(file.read(HEADER.size))
+        if magic != MAGIC or version != VERSION:
+            return False
+        if capacity is not None and capacity != stored_capacity:
+            return False
+        return size == HEADER_SIZE + 16 * stored_capacity
+
+    def is_stale(self):
+        """
+        :return bool: True if the buffer file has been replaced by the writer and needs to be reopened
+        """
+        try:
+            return os.stat(self.filename).st_ino != self.inode
+        except FileNotFoundError:
+            return True
+
+    def _header(self):
+        return HEADER.unpack_from(self.map, 0)
+
+    def close(self):
+        if hasattr(self, 'timestamps'):
+            self.timestamps.release()
+            self.prices.release()
+        self.map.close()
+        self.file.close()
+
+    @property
+    def sequence(self):
+        return self._header()[5]
+
+    def clear(self):
+        _, _, capacity, _, _, sequence = self._header()
+        HEADER.pack_into(self.map, 0, MAGIC, VERSION, capacity, 0, 0, sequence + 2)
+
+    def append(self, timestamp: int, price: float):
+        """
+        Adds a rate, overwriting the oldest one if the buffer is full
+        :param timestamp: epoch seconds (UTC)
+        :param price: the rate
+        """
+        _, _, capacity, count, head, sequence = self._header()
+        HEADER.pack_into(self.map, 0, MAGIC, VERSION, capacity, count, head, sequence + 1)
+        self.timestamps[head] = timestamp
+        self.prices[head] = price
+        HEADER.pack_into(self.map, 0, MAGIC, VERSION, capacity, min(count + 1, capacity), (head + 1) % capacity,
+                         sequence + 2)
+
+    def _snapshot(self, read):
+        """
+        Runs the read function on a consistent state of the buffer
+        :param read: function taking count and head
+        :return the result of the read function
+        """
+        for _ in range(READ_ATTEMPTS):
+            _, _, _, count, head, sequence = self._header()
+            if sequence % 2:
+                continue
+            result = read(count, head)
+            if self.sequence == sequence:
+                return result
+        raise BlockingIOError('No consistent snapshot of ' + self.filename)
+
+    def _slot(self, count: int, head: int, index: int):
+        """
+        Maps the index counted from the oldest rate onto the slot in the arrays
+        """
+        return (head - count + index) % self.capacity
+
+    def _bisect(self, count: int, head: int, timestamp: int):
+        """
+        :return index (counted from the oldest rate) of the first rate not older than the timestamp
+        """
+        low, high = 0, count
+        while low < high:
+            middle = (low + high) // 2
+            if self.timestamps[self._slot(count, head, middle)] < timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def count(self):
+        return self._header()[3]
+
+    def last(self, limit: int):
+        """
+        Fetches the last x rates
+        :param limit: number of rates to be fetched
+        :return list of (price, timestamp) ordered newest first or None if the buffer holds less rates
+        """
+        def read(count: int, head: int):
+            if count < limit:
+                return None
+            return self._rows(count, head, count - 1, count - limit - 1)
+        return self._snapshot(read)
+
+    def since(self, timestamp: int, limit: int):
+        """
+        Fetches the rates newer than the timestamp
+        :param timestamp: epoch seconds of the last known rate
+        :param limit: maximal number of rates to be fetched
+        :return list of (price, timestamp) ordered newest first or None if the buffer does not reach back that far
+        """
+        def read(count: int, head: int):
+            if not count or self.timestamps[self._slot(count, head, 0)] > timestamp:
+                return None
+            start = self._bisect(count, head, timestamp + 1)
+            return self._rows(count, head, count - 1, max(start, count - limit) - 1)
+        return self._snapshot(read)
+
+    def starting_at(self, timestamp: int, limit: int):
+        """
+        Fetches the rates starting with the timestamp
+        :param timestamp: epoch seconds of the first rate to be fetched
+        :param limit: number of rates to be fetched
+        :return list of (price, timestamp) ordered oldest first or None if the buffer does not reach back that far
+        """
+        def read(count: int, head: int):
+            if not count or self.timestamps[self._slot(count, head, 0)] > timestamp:
+                return None
+            start = self._bisect(count, head, timestamp)
+            return self._rows(count, head, start, min(start + limit, count))
+        return self._snapshot(read)
+
+    def _rows(self, count: int, head: int, start: int, stop: int):
+        step = 1 if stop > start else -1
+        rows = []
+        for index in range(start, stop, step):
+            slot = self._slot(count, head, index)
+            rows.append((self.prices[slot], self.timestamps[slot]))
+        return rows
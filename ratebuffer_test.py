@@ -0,0 +1,66 @@
+import datetime
+import os
+import tempfile
+import unittest
+
+import ratebuffer
+
+
+class RateBufferTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.directory.name, 'mamaster.buf')
+        self.writer = ratebuffer.RateBuffer(self.filename, 5)
+        for i in range(8):
+            self.writer.append(600 * i, 1000 + i)
+        self.reader = ratebuffer.RateBuffer(self.filename)
+
+    def tearDown(self):
+        self.reader.close()
+        self.writer.close()
+        self.directory.cleanup()
+
+    def test_last(self):
+        self.assertEqual([(1007, 4200), (1006, 3600)], self.reader.last(2))
+        self.assertEqual(5, len(self.reader.last(5)))
+        self.assertIsNone(self.reader.last(6))
+
+    def test_since(self):
+        self.assertEqual([(1007, 4200), (1006, 3600)], self.reader.since(3000, 10))
+        self.assertEqual([(1007, 4200)], self.reader.since(3000, 1))
+        self.assertEqual([], self.reader.since(4200, 10))
+        self.assertIsNone(self.reader.since(600, 10))
+
+    def test_starting_at(self):
+        self.assertEqual([(1005, 3000), (1006, 3600)], self.reader.starting_at(3000, 2))
+        self.assertEqual([(1004, 2400)], self.reader.starting_at(2000, 1))
+        self.assertIsNone(self.reader.starting_at(600, 1))
+
+    def test_replaced_buffer_is_stale(self):
+        self.assertFalse(self.reader.is_stale())
+
+        replacement = ratebuffer.RateBuffer(self.filename, 6)
+
+        self.assertTrue(self.reader.is_stale())
+        self.assertEqual(0, replacement.count())
+        replacement.close()
+
+    def test_reopen_keeps_rates(self):
+        writer = ratebuffer.RateBuffer(self.filename, 5)
+
+        self.assertFalse(self.reader.is_stale())
+        self.assertEqual([(1007, 4200)], writer.last(1))
+        writer.close()
+
+    def test_to_epoch(self):
+        self.assertEqual(1588291200, ratebuffer.to_epoch('2020-05-01 00:00:00'))
+        self.assertEqual(1588291200, ratebuffer.to_epoch(datetime.datetime(2020, 5, 1)))
+        self.assertEqual(datetime.datetime(2020, 5, 1), ratebuffer.to_datetime(1588291200))
+
+    def test_buffer_name(self):
+        self.assertEqual('mamaster-kraken-ETH-USD.buf', ratebuffer.buffer_name('mamaster.buf', 'kraken:ETH/USD'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,212 @@
+#!/usr/bin/python3
+"""
+Searches the best moving average windows and stop loss settings of a MAverage configuration on the rates stored in
+mamaster.db. The grid is evaluated by a pool of processes. The rates and the moving averages of every window,
+each calculated once for the whole grid, are shared with the processes through shared memory.
+
+Usage: ./sweep.py <instance> [short=start:stop:step] [long=start:stop:step] [stop_loss=start:stop:step]
+                  [no_action_at_loss=true,false] [weeks=x] [splits=x] [workers=x] [top=x]
+Windows are given in minutes, the stop loss in percent. With splits the rates are divided into consecutive parts,
+the best settings of every part are evaluated on the following one (walk forward).
+"""
+import os
+import sys
+from array import array
+from multiprocessing import Pool, shared_memory
+
+import backtest
+
+SERIES = {}
+SHARED = None
+ROW = '{:>8} {:>8} {:>6} {:>5} {:>9} {:>7} {:>5} {:>9}'
+HEADER = ROW.format('short', 'long', 'stop', 'noal', 'pnl %', 'trades', 'sl', 'dd %')
+
+
+def parse_range(text: str, cast=int):
+    """
+    Parses a range 'start:stop:step' (stop included) or a list 'a,b,c'
+    :return list of values
+    """
+    if ':' not in text:
+        return [cast(value) for value in text.split(',')]
+    start, stop, step = (cast(value) for value in text.split(':'))
+    values = []
+    value = start
+    while value <= stop + step / 1000:
+        values.append(round(value, 6) if cast is float else value)
+        value += step
+    return values
+
+
+def parse_arguments(arguments: list, conf):
+    """
+    Parses the key=value arguments, the settings of the bot are used for the missing ranges
+    :param arguments: the command line arguments following the instance
+    :param conf: maverage.ExchangeConfig
+    :return dict: options
+    """
+    options = {'short': [conf.ma_minutes_short], 'long': [conf.ma_minutes_long],
+               'stop_loss': [conf.stop_loss_in_percent if conf.stop_loss else 0],
+               'no_action_at_loss': [conf.no_action_at_loss],
+               'weeks': None, 'splits': 0, 'workers': os.cpu_count(), 'top': 20}
+    for argument in arguments:
+        key, _, value = argument.partition('=')
+        if key in ('short', 'long'):
+            options[key] = parse_range(value)
+        elif key == 'stop_loss':
+            options[key] = parse_range(value, float)
+        elif key == 'no_action_at_loss':
+            options[key] = [part.strip().lower() == 'true' for part in value.split(',')]
+        elif key in ('weeks', 'splits', 'workers', 'top'):
+            options[key] = int(value)
+        else:
+            raise SystemExit('Unknown argument ' + argument)
+    return options
+
+
+def build_grid(settings: dict, options: dict):
+    """
+    :param settings: the settings of the bot (see backtest.load_settings)
+    :param options: the ranges to be evaluated
+    :return list of settings, one per combination
+    """
+    grid = []
+    for short in options['short']:
+        for long in options['long']:
+            if short >= long:
+                continue
+            for stop_loss in options['stop_loss']:
+                for no_action_at_loss in options['no_action_at_loss']:
+                    grid.append(dict(settings, ma_minutes_short=short, ma_minutes_long=long, stop_loss=stop_loss > 0,
+                                     stop_loss_in_percent=stop_loss, no_action_at_loss=no_action_at_loss))
+    return grid
+
+
+def get_windows(grid: list):
+    """
+    :return sorted list of the distinct moving average windows (number of rates) of the grid
+    """
+    windows = set()
+    for settings in grid:
+        windows.add(backtest.to_window(settings['ma_minutes_short'], settings['interval']))
+        windows.add(backtest.to_window(settings['ma_minutes_long'], settings['interval']))
+    return sorted(windows)
+
+
+def share_series(prices, windows: list):
+    """
+    Copies the rates and the moving averages of all windows into one block of shared memory
+    :return SharedMemory, dict name: offset (in rates)
+    """
+    length = len(prices)
+    layout = {'prices': 0}
+    for index, window in enumerate(windows):
+        layout[window] = (index + 1) * length
+    memory = shared_memory.SharedMemory(create=True, size=max(1, 8 * length * len(layout)))
+    for name, offset in layout.items():
+        values = prices if name == 'prices' else backtest.moving_average(prices, name)
+        view = memory.buf[8 * offset:8 * (offset + length)].cast('d')
+        view[:] = array('d', values)
+        view.release()
+    return memory, layout
+
+
+def attach_series(name: str, layout: dict, length: int):
+    """
+    Maps the shared rates and moving averages, used as initializer of the worker processes
+    """
+    global SHARED, SERIES
+
+    SHARED = shared_memory.SharedMemory(name=name)
+    SERIES = {}
+    for key, offset in layout.items():
+        if backtest.numpy is not None:
+            SERIES[key] = backtest.numpy.ndarray((length,), dtype=backtest.numpy.float64, buffer=SHARED.buf,
+                                                 offset=8 * offset)
+        else:
+            SERIES[key] = SHARED.buf[8 * offset:8 * (offset + length)].cast('d')
+
+
+def evaluate(task: tuple):
+    """
+    Backtests one combination on the shared series
+    :param task: settings, index of the first and after the last rate
+    :return tuple: settings, result
+    """
+    settings, start, stop = task
+    averages = {key: series for key, series in SERIES.items() if key != 'prices'}
+    return settings, backtest.backtest(SERIES['prices'], settings, averages, start, stop)
+
+
+def rank(results: list):
+    """
+    :return the results ordered by PnL, the smaller drawdown first if equal
+    """
+    return sorted(results, key=lambda result: (-result[1]['pnl_percent'], result[1]['max_drawdown_percent']))
+
+
+def sweep(pool: Pool, workers: int, grid: list, start: int = 0, stop: int = None):
+    """
+    Evaluates all combinations of the grid on the rates between start and stop
+    :return ranked list of (settings, result)
+    """
+    chunk = max(1, len(grid) // (4 * workers))
+    return rank(pool.imap_unordered(evaluate, [(settings, start, stop) for settings in grid], chunk))
+
+
+def walk_forward(pool: Pool, workers: int, grid: list, length: int, splits: int):
+    """
+    Divides the rates into splits + 1 consecutive parts. The best combination of each part is evaluated on the next one.
+    :return list of (best settings, in sample result, out of sample result)
+    """
+    bounds = [length * part // (splits + 1) for part in range(splits + 2)]
+    walks = []
+    for part in range(splits):
+        best = sweep(pool, workers, grid, bounds[part], bounds[part + 1])[0]
+        _, result = pool.apply(evaluate, ((best[0], bounds[part + 1], bounds[part + 2]),))
+        walks.append((best[0], best[1], result))
+    return walks
+
+
+def format_row(settings: dict, result: dict):
+    return ROW.format(
+        settings['ma_minutes_short'], settings['ma_minutes_long'], settings['stop_loss_in_percent'],
+        'yes' if settings['no_action_at_loss'] else 'no', result['pnl_percent'], result['trades'],
+        result['stop_losses'], result['max_drawdown_percent'])
+
+
+def run(prices, settings: dict, options: dict):
+    """
+    Runs the sweep and prints the ranked table or the walk forward results
+    """
+    grid = build_grid(settings, options)
+    memory, layout = share_series(prices, get_windows(grid))
+    try:
+        with Pool(options['workers'], attach_series, (memory.name, layout, len(prices))) as pool:
+            print('Evaluating {} combinations on {} rates'.format(len(grid), len(prices)))
+            if options['splits']:
+                print('best in sample / out of sample')
+                walks = walk_forward(pool, options['workers'], grid, len(prices), options['splits'])
+                for best, in_sample, out_of_sample in walks:
+                    print(HEADER)
+                    print(format_row(best, in_sample))
+                    print(format_row(best, out_of_sample))
+            else:
+                print(HEADER)
+                for best, result in sweep(pool, options['workers'], grid)[:options['top']]:
+                    print(format_row(best, result))
+    finally:
+        memory.close()
+        memory.unlink()
+
+
+if __name__ == '__main__':
+    import maverage
+
+    if len(sys.argv) < 2:
+        raise SystemExit(__doc__)
+    maverage.INSTANCE = os.path.basename(sys.argv[1])
+    CONF = maverage.ExchangeConfig()
+    OPTIONS = parse_arguments(sys.argv[2:], CONF)
+    _, PRICES = backtest.load_rates(CONF.database, backtest.resolve_symbol(CONF), OPTIONS['weeks'])
+    run(PRICES, backtest.load_settings(CONF), OPTIONS)
@@ -0,0 +1,66 @@
+import math
+import unittest
+from multiprocessing import Pool
+
+import backtest
+import sweep
+
+
+class SweepTest(unittest.TestCase):
+
+    def test_parse_range(self):
+        self.assertEqual([1440, 2880, 4320], sweep.parse_range('1440:4320:1440'))
+        self.assertEqual([0.5, 1.0, 1.5, 2.0], sweep.parse_range('0.5:2:0.5', float))
+        self.assertEqual([100, 300], sweep.parse_range('100,300'))
+
+    def test_build_grid_skips_short_not_below_long(self):
+        options = {'short': [100, 200], 'long': [200, 300], 'stop_loss': [0, 2.5], 'no_action_at_loss': [True]}
+
+        grid = sweep.build_grid(self.create_settings(), options)
+
+        self.assertEqual(6, len(grid))
+        self.assertFalse([settings for settings in grid if settings['ma_minutes_short'] >= settings['ma_minutes_long']])
+        self.assertFalse(grid[0]['stop_loss'])
+        self.assertTrue(grid[1]['stop_loss'])
+
+    def test_get_windows(self):
+        options = {'short': [100, 200], 'long': [200, 300], 'stop_loss': [0], 'no_action_at_loss': [True]}
+
+        self.assertEqual([10, 20, 30], sweep.get_windows(sweep.build_grid(self.create_settings(), options)))
+
+    def test_sweep_matches_backtest(self):
+        prices = self.create_prices()
+        options = {'short': [50, 100], 'long': [200, 400], 'stop_loss': [0, 3], 'no_action_at_loss': [True, False]}
+        grid = sweep.build_grid(self.create_settings(), options)
+        memory, layout = sweep.share_series(prices, sweep.get_windows(grid))
+        try:
+            with Pool(2, sweep.attach_series, (memory.name, layout, len(prices))) as pool:
+                results = sweep.sweep(pool, 2, grid)
+                walks = sweep.walk_forward(pool, 2, grid, len(prices), 2)
+        finally:
+            memory.close()
+            memory.unlink()
+
+        self.assertEqual(len(grid), len(results))
+        for settings, result in results:
+            self.assertEqual(backtest.backtest(prices, settings), result)
+        self.assertEqual(results, sweep.rank(results))
+        self.assertEqual(2, len(walks))
+        best, in_sample, out_of_sample = walks[1]
+        self.assertEqual(backtest.backtest(prices, best, None, 200, 400), in_sample)
+        self.assertEqual(backtest.backtest(prices, best, None, 400, 600), out_of_sample)
+
+    @staticmethod
+    def create_prices():
+        return [10000 + 1000 * math.sin(i / 40) + 300 * math.sin(i / 7) for i in range(600)]
+
+    @staticmethod
+    def create_settings():
+        return {'ma_minutes_short': 50, 'ma_minutes_long': 200, 'interval': 10, 'stop_loss': False,
+                'stop_loss_in_percent': 0, 'no_action_at_loss': True, 'trade_advantage_in_percent': 0.1,
+                'short_in_percent': 50, 'apply_leverage': False, 'leverage_default': 2, 'trade_trials': 1,
+                'order_adjust_seconds': 600, 'fee_in_percent': 0.075}
+
+
+if __name__ == '__main__':
+    unittest.main()